@@ -0,0 +1,460 @@
+import gc
+import os
+import random
+import pickle
+import argparse
+import tracemalloc
+from time import perf_counter
+from array import array
+from nltk.stem.porter import PorterStemmer
+from compact_index import CompactPosInvertedIndex, CompactPostings
+from compressed_index import CompressedPosInvertedIndex, save_compressed_pos_inverted_index
+from mmap_index import MmapPosInvertedIndex, save_mmap_pos_inverted_index
+from text_index import save_text_pos_inverted_index, load_text_pos_inverted_index
+from code import SimpleTokenizer, SimplePreprocessor, construct_stopwords_set, read_input_trec_file_and_create_index_and_docId_set, intersect_postings
+from code import read_queries, create_dense_docIDs, parse_and_answer_ranked_query, parse_and_answer_ranked_query_term_at_a_time, parse_and_answer_ranked_query_wand
+from code import execute_and_write_boolean_queries_in_parallel, execute_and_write_ranked_queries_in_parallel, parse_and_answer_boolean_query
+from code import create_ranked_query_answerer, save_pos_inverted_index
+from result_cache import QueryResultCache
+from docid_bitmap import DocIDBitmap
+from build_profiler import BuildProfiler
+from synthetic_corpus import ZipfVocabulary, generate_documents, generate_queries, write_trec_file
+from benchmark_results import latency_summary, format_latency_summary, append_benchmark_results
+
+# Usage (from this folder):
+#
+# python benchmark.py memory trec.sample.xml
+# python benchmark.py index-format trec.sample.xml
+# python benchmark.py intersection
+# python benchmark.py ranking trec.sample.xml queries.ranked.txt
+# python benchmark.py batch trec.sample.xml queries.boolean.txt queries.ranked.txt --workers 1 2 4 8
+# python benchmark.py result-cache trec.sample.xml queries.boolean.txt
+# python benchmark.py stemming trec.sample.xml
+# python benchmark.py index-txt trec.sample.xml
+# python benchmark.py bitmap
+# python benchmark.py suite --nr-docs 20000 --results benchmark_results.jsonl
+
+def create_pre_processor(stopwords_file_name:str, stem_cache_size:int=100000) -> SimplePreprocessor:
+    """Same pre-processing setup as the one used by code.py.
+    """
+    stopwords_set = construct_stopwords_set(stopwords_file_name)
+    tokenizer = SimpleTokenizer('[a-zA-Z0-9]+')
+    return SimplePreprocessor(tokenizer, stopwords_set, PorterStemmer(), stem_cache_size)
+
+def format_bytes(nr_bytes:int) -> str:
+    return '%.2f MB' % (nr_bytes / (1024 * 1024))
+
+def benchmark_memory(args):
+    """Compares the memory retained by the dictionary-based index and by the CompactPosInvertedIndex
+    built from the same collection (measured with tracemalloc).
+    """
+    pre_processor = create_pre_processor(args.stopwords)
+
+    gc.collect()
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+
+    pos_inverted_index, docId_set = read_input_trec_file_and_create_index_and_docId_set(args.trec_file, pre_processor)
+    gc.collect()
+    dict_bytes = tracemalloc.get_traced_memory()[0] - baseline
+
+    compact_index = CompactPosInvertedIndex.from_pos_inverted_index(pos_inverted_index)
+    del pos_inverted_index
+    gc.collect()
+    compact_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    nr_postings = sum(len(compact_index[term]) for term in compact_index)
+    print('Documents: %d, terms: %d, postings: %d, positions: %d' % (len(docId_set), len(compact_index), nr_postings, len(compact_index.positions)))
+    print('Dict index:    %s' % format_bytes(dict_bytes))
+    print('Compact index: %s (array buffers: %s)' % (format_bytes(compact_bytes), format_bytes(compact_index.nbytes())))
+    print('Ratio: %.2fx' % (dict_bytes / compact_bytes))
+
+def benchmark_index_format(args):
+    """Compares the pickled dictionary index with the compressed and the memory-mapped formats: file size, time to load
+    the index, and time to load it and answer a lookup for every term.
+    """
+    pre_processor = create_pre_processor(args.stopwords)
+    pos_inverted_index, docId_set = read_input_trec_file_and_create_index_and_docId_set(args.trec_file, pre_processor)
+    terms = list(pos_inverted_index.keys())
+
+    pickle_file_name = args.output_prefix + '.pkl'
+    compressed_file_name = args.output_prefix + '.idx'
+    mmap_file_name = args.output_prefix + '.mmap'
+    with open(pickle_file_name, 'wb') as f:
+        pickle.dump(pos_inverted_index, f)
+    save_compressed_pos_inverted_index(pos_inverted_index, compressed_file_name)
+    save_mmap_pos_inverted_index(pos_inverted_index, docId_set, mmap_file_name)
+    del pos_inverted_index
+    gc.collect()
+
+    def load_pickle():
+        with open(pickle_file_name, 'rb') as f:
+            return pickle.load(f)
+
+    def time_load(load_function, lookup_terms):
+        ts = perf_counter()
+        index = load_function()
+        for term in lookup_terms:
+            # Touch the positions of every posting, so lazily-read formats do the same work as the others.
+            postings = index[term]
+            for docID in postings:
+                len(postings[docID])
+        return perf_counter() - ts
+
+    loaders = (('pickle', pickle_file_name, load_pickle),
+               ('compressed', compressed_file_name, lambda: CompressedPosInvertedIndex(compressed_file_name)),
+               ('mmap', mmap_file_name, lambda: MmapPosInvertedIndex(mmap_file_name)))
+
+    print('File size:         ' + ', '.join('%s %s' % (name, format_bytes(os.path.getsize(file_name))) for name, file_name, _ in loaders))
+    for description, lookup_terms in (('load', []), ('load + 1 term', terms[:1]), ('load + all terms', terms)):
+        times = [min(time_load(load, lookup_terms) for _ in range(args.repeat)) for _, _, load in loaders]
+        print('%-18s' % (description + ':') + ', '.join('%s %.4fs' % (loaders[ii][0], times[ii]) for ii in range(len(loaders))))
+
+    for _, file_name, _ in loaders:
+        os.remove(file_name)
+
+def benchmark_intersection(args):
+    """Intersects a rare term with a frequent one (synthetic postings), comparing the old approach (building
+    a set of the docIDs of each term) with intersect_postings on dictionary and on array-backed postings.
+    """
+    random.seed(0)
+    nr_docs = args.nr_docs
+
+    def make_postings(df):
+        docIDs = array('I', sorted(random.sample(range(nr_docs), df)))
+        dict_postings = {docID: [0] for docID in docIDs}
+        compact_postings = CompactPostings(docIDs, array('I', range(df+1)), 0, array('I', range(df)))
+        return dict_postings, compact_postings
+
+    def time_it(function):
+        ts = perf_counter()
+        for _ in range(args.repeat):
+            result = function()
+        return (perf_counter() - ts) / args.repeat, len(result)
+
+    frequent_dict, frequent_compact = make_postings(args.frequent_df)
+    print('Frequent term df: %d' % args.frequent_df)
+    for rare_df in args.rare_df:
+        rare_dict, rare_compact = make_postings(rare_df)
+        sets_time, n = time_it(lambda: set(rare_dict.keys()).intersection(set(frequent_dict.keys())))
+        dict_time, _ = time_it(lambda: intersect_postings([rare_dict, frequent_dict]))
+        galloping_time, _ = time_it(lambda: intersect_postings([rare_compact, frequent_compact]))
+        print('rare df %7d (%6d common): sets %.5fs, dict probing %.5fs, galloping %.5fs' % (rare_df, n, sets_time, dict_time, galloping_time))
+
+def benchmark_ranking(args):
+    """Times the exhaustive, term-at-a-time and WAND ranked query modes on the same queries and checks that
+    they return the same top k.
+    """
+    pre_processor = create_pre_processor(args.stopwords)
+    tokenizer = pre_processor.tokenizer
+    pos_inverted_index, docId_set = read_input_trec_file_and_create_index_and_docId_set(args.trec_file, pre_processor, args.compact_index)
+    queries = list(read_queries(args.queries_file).values())
+    dense_docIDs = create_dense_docIDs(docId_set)
+    N = len(docId_set)
+    k = args.k
+
+    def exhaustive(query):
+        answers = parse_and_answer_ranked_query(query, N, pos_inverted_index, pre_processor, tokenizer)
+        answers.sort(key=lambda x: (-x[1], x[0]))
+        return answers[:k]
+
+    modes = (('exhaustive', exhaustive),
+             ('term-at-a-time', lambda query: parse_and_answer_ranked_query_term_at_a_time(query, dense_docIDs, pos_inverted_index, pre_processor, tokenizer, k)),
+             ('wand', lambda query: parse_and_answer_ranked_query_wand(query, N, pos_inverted_index, pre_processor, tokenizer, k)))
+
+    reference = [exhaustive(query) for query in queries]
+    for name, answer in modes:
+        ts = perf_counter()
+        for _ in range(args.repeat):
+            results = [answer(query) for query in queries]
+        elapsed = (perf_counter() - ts) / args.repeat
+        print('%-15s %.4fs for %d queries (%.2f ms/query), same top %d: %s' % (name, elapsed, len(queries), 1000 * elapsed / len(queries), k, results == reference))
+
+def benchmark_batch(args):
+    """Throughput (queries/second) of the parallel batch query executor for each number of workers, on the
+    boolean and the ranked query files (each repeated --copies times, under new query ids), and whether
+    the results match the ones written by a single worker.
+    """
+    pre_processor = create_pre_processor(args.stopwords)
+    tokenizer = pre_processor.tokenizer
+    pos_inverted_index, docId_set = read_input_trec_file_and_create_index_and_docId_set(args.trec_file, pre_processor, args.compact_index)
+    if args.mmap_index:
+        save_mmap_pos_inverted_index(pos_inverted_index, docId_set, args.output_prefix + '.mmap')
+        del pos_inverted_index
+        gc.collect()
+        pos_inverted_index = MmapPosInvertedIndex(args.output_prefix + '.mmap')
+
+    def replicate(queries):
+        step = max(queries.keys()) + 1
+        return {copy * step + query_id: query for copy in range(args.copies) for query_id, query in queries.items()}
+
+    boolean_queries = replicate(read_queries(args.boolean_queries_file))
+    ranked_queries = replicate(read_queries(args.ranked_queries_file))
+
+    runs = (('boolean', len(boolean_queries), lambda file_name, nr_workers: execute_and_write_boolean_queries_in_parallel(boolean_queries, docId_set, pos_inverted_index, file_name, pre_processor, nr_workers, args.chunk_size)),
+            ('ranked', len(ranked_queries), lambda file_name, nr_workers: execute_and_write_ranked_queries_in_parallel(ranked_queries, docId_set, pos_inverted_index, file_name, pre_processor, tokenizer, args.k, nr_workers, args.ranking_mode, None, args.chunk_size)))
+
+    for name, nr_queries, run in runs:
+        reference_file_name = args.output_prefix + '.' + name + '.1.txt'
+        run(reference_file_name, 1)
+        with open(reference_file_name, 'r') as f:
+            reference = f.read()
+
+        for nr_workers in args.workers:
+            file_name = args.output_prefix + '.' + name + '.txt'
+            throughput = max(run(file_name, nr_workers) for _ in range(args.repeat))
+            with open(file_name, 'r') as f:
+                same = f.read() == reference
+            print('%-8s %d queries, %2d workers: %9.1f queries/s, same results: %s' % (name, nr_queries, nr_workers, throughput, same))
+            os.remove(file_name)
+        os.remove(reference_file_name)
+
+    if args.mmap_index:
+        os.remove(args.output_prefix + '.mmap')
+
+def benchmark_result_cache(args):
+    """Answers the boolean queries --copies times without and with a QueryResultCache of each budget, and reports
+    the time, the hit rate of the cache and whether the answers are the same.
+    """
+    pre_processor = create_pre_processor(args.stopwords)
+    pos_inverted_index, docId_set = read_input_trec_file_and_create_index_and_docId_set(args.trec_file, pre_processor, args.compact_index)
+    queries = list(read_queries(args.queries_file).values()) * args.copies
+
+    def run(result_cache):
+        ts = perf_counter()
+        answers = [parse_and_answer_boolean_query(query, docId_set, pos_inverted_index, pre_processor, result_cache) for query in queries]
+        return perf_counter() - ts, answers
+
+    elapsed, reference = run(None)
+    print('no cache:      %.4fs for %d queries' % (elapsed, len(queries)))
+    for budget_mb in args.budget_mb:
+        result_cache = QueryResultCache(int(budget_mb * 1024 * 1024))
+        elapsed, answers = run(result_cache)
+        stats = result_cache.stats()
+        print('%8.2f MB:   %.4fs, hit rate %.2f, %d entries (%s), %d evictions, same answers: %s' % (budget_mb, elapsed, stats['hit_rate'], stats['entries'], format_bytes(stats['bytes']), stats['evictions'], answers == reference))
+
+def benchmark_stemming(args):
+    """Indexing throughput (stemmed tokens per second) without the stem cache and with each stem cache size,
+    and whether the resulting index is the same.
+    """
+    def build(stem_cache_size):
+        pre_processor = create_pre_processor(args.stopwords, stem_cache_size)
+        ts = perf_counter()
+        pos_inverted_index, _ = read_input_trec_file_and_create_index_and_docId_set(args.trec_file, pre_processor)
+        return perf_counter() - ts, pos_inverted_index, pre_processor.stem_cache_stats()
+
+    elapsed, reference, stats = build(0)
+    print('no cache:       %.3fs, %.0f tokens/s (%d tokens)' % (elapsed, stats['lookups'] / elapsed, stats['lookups']))
+    for stem_cache_size in args.stem_cache_size:
+        elapsed, pos_inverted_index, stats = build(stem_cache_size)
+        print('cache %8d: %.3fs, %.0f tokens/s, hit rate %.4f, %d cached stems, same index: %s' % (stem_cache_size, elapsed, stats['lookups'] / elapsed, stats['hit_rate'], stats['size'], pos_inverted_index == reference))
+
+def benchmark_index_txt(args):
+    """Time to write index.txt with each number of workers, and to parse it back (checking that the parsed index
+    is the one which was written).
+    """
+    pre_processor = create_pre_processor(args.stopwords)
+    pos_inverted_index, _ = read_input_trec_file_and_create_index_and_docId_set(args.trec_file, pre_processor, args.compact_index)
+    file_name = args.output_prefix + '.txt'
+
+    for nr_workers in args.workers:
+        ts = perf_counter()
+        save_text_pos_inverted_index(pos_inverted_index, file_name, nr_workers)
+        print('write, %2d workers: %.3fs' % (nr_workers, perf_counter() - ts))
+    print('index.txt size: %s' % format_bytes(os.path.getsize(file_name)))
+
+    ts = perf_counter()
+    parsed_index = load_text_pos_inverted_index(file_name)
+    elapsed = perf_counter() - ts
+    same = len(parsed_index) == len(pos_inverted_index) and all(parsed_index[term] == {docID: list(positions) for docID, positions in pos_inverted_index[term].items()} for term in pos_inverted_index)
+    print('parse: %.3fs, same index: %s' % (elapsed, same))
+    os.remove(file_name)
+
+def benchmark_bitmap(args):
+    """Memory and latency of NOT t (all documents minus t) and t1 OR t2 on high-df terms (synthetic postings),
+    with Python sets and with DocIDBitmaps, and the cost of converting a bitmap result back to a set.
+    """
+    random.seed(0)
+    nr_docs = args.nr_docs
+
+    def time_it(function):
+        ts = perf_counter()
+        for _ in range(args.repeat):
+            result = function()
+        return (perf_counter() - ts) / args.repeat, result
+
+    def traced_size(function):
+        gc.collect()
+        tracemalloc.start()
+        result = function()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size, result
+
+    all_set_bytes, all_set = traced_size(lambda: set(range(nr_docs)))
+    all_bitmap_bytes, all_bitmap = traced_size(lambda: DocIDBitmap.from_iterable(range(nr_docs)))
+    print('All %d documents: set %s, bitmap %s' % (nr_docs, format_bytes(all_set_bytes), format_bytes(all_bitmap_bytes)))
+
+    for df in args.df:
+        docIDs = sorted(random.sample(range(nr_docs), df))
+        other_docIDs = sorted(random.sample(range(nr_docs), df))
+        set_bytes, term_set = traced_size(lambda: set(docIDs))
+        bitmap_bytes, term_bitmap = traced_size(lambda: DocIDBitmap.from_iterable(docIDs))
+        other_set, other_bitmap = set(other_docIDs), DocIDBitmap.from_iterable(other_docIDs)
+        build_time, _ = time_it(lambda: DocIDBitmap.from_iterable(docIDs))
+
+        not_set_time, not_set = time_it(lambda: all_set.difference(term_set))
+        not_bitmap_time, not_bitmap = time_it(lambda: all_bitmap.difference(term_bitmap))
+        or_set_time, or_set = time_it(lambda: term_set.union(other_set))
+        or_bitmap_time, or_bitmap = time_it(lambda: term_bitmap.union(other_bitmap))
+        decode_time, _ = time_it(lambda: set(not_bitmap))
+        same = set(not_bitmap) == not_set and set(or_bitmap) == or_set
+
+        print('df %8d: memory set %s, bitmap %s (build %.4fs) | NOT set %.5fs, bitmap %.5fs | OR set %.5fs, bitmap %.5fs | bitmap -> set %.4fs | same: %s'
+              % (df, format_bytes(set_bytes), format_bytes(bitmap_bytes), build_time, not_set_time, not_bitmap_time, or_set_time, or_bitmap_time, decode_time, same))
+
+def benchmark_suite(args):
+    """Reproducible end-to-end benchmark on a synthetic TREC collection (Zipfian vocabulary, see synthetic_corpus.py):
+    index build time and throughput, then the latency percentiles and throughput of boolean, phrase, proximity and
+    ranked queries. The run is appended to the --results file, tagged with the git commit, to compare commits.
+    """
+    pre_processor = create_pre_processor(args.stopwords)
+    tokenizer = pre_processor.tokenizer
+    trec_file_name = args.output_prefix + '.xml'
+
+    vocabulary = ZipfVocabulary(args.vocabulary_size, args.zipf_s, args.seed, pre_processor.stop_words_set)
+    documents = generate_documents(vocabulary, args.nr_docs, args.doc_length)
+    queries = generate_queries(vocabulary, documents, args.nr_queries)
+    write_trec_file(documents, trec_file_name)
+    del documents
+
+    results = dict()
+    profiler = BuildProfiler()
+    ts = perf_counter()
+    pos_inverted_index, docId_set = read_input_trec_file_and_create_index_and_docId_set(trec_file_name, pre_processor, args.compact_index, None, profiler)
+    build_seconds = perf_counter() - ts
+    ts = perf_counter()
+    save_pos_inverted_index(pos_inverted_index, args.output_prefix + '.idx')
+    save_seconds = perf_counter() - ts
+    build_report = profiler.report()
+    results['build'] = {'seconds': build_seconds,
+                        'save_seconds': save_seconds,
+                        'documents_per_second': len(docId_set) / build_seconds,
+                        'tokens_per_second': build_report['tokens_per_second'],
+                        'stages': {name: stage['seconds'] for name, stage in build_report['stages'].items()},
+                        'counters': build_report['counters'],
+                        'index_file_bytes': os.path.getsize(args.output_prefix + '.idx'),
+                        'peak_rss_bytes': build_report['peak_rss_bytes']}
+    print('build: %.3fs (%.0f documents/s, %.0f tokens/s), save: %.3fs, %s' % (build_seconds, results['build']['documents_per_second'], results['build']['tokens_per_second'], save_seconds, format_bytes(results['build']['index_file_bytes'])))
+    os.remove(trec_file_name)
+    os.remove(args.output_prefix + '.idx')
+
+    result_cache = QueryResultCache(int(args.result_cache_mb * 1024 * 1024)) if args.result_cache_mb > 0 else None
+    answer_ranked_query = create_ranked_query_answerer(docId_set, pos_inverted_index, pre_processor, tokenizer, args.k, args.ranking_mode)
+    answerers = {'boolean': lambda query: parse_and_answer_boolean_query(query, docId_set, pos_inverted_index, pre_processor, result_cache),
+                 'ranked': answer_ranked_query}
+    answerers['phrase'] = answerers['proximity'] = answerers['boolean']
+
+    for kind in ['boolean', 'phrase', 'proximity', 'ranked']:
+        answer = answerers[kind]
+        latencies = []
+        for query in queries[kind]:
+            ts = perf_counter()
+            answer(query)
+            latencies.append(perf_counter() - ts)
+        results[kind] = latency_summary(latencies)
+        print(format_latency_summary(kind, results[kind]))
+
+    config = {key: value for key, value in vars(args).items() if key != 'func'}
+    append_benchmark_results(args.results, 'assignment1', config, results)
+    print('Results appended to %s' % args.results)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--stopwords', type=str, default='englishST.txt')
+subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+memory_parser = subparsers.add_parser('memory', help="Memory used by the dict index vs. the compact index.")
+memory_parser.add_argument('trec_file', type=str)
+memory_parser.set_defaults(func=benchmark_memory)
+
+index_format_parser = subparsers.add_parser('index-format', help="Pickle vs. compressed vs. memory-mapped index: file size and load time.")
+index_format_parser.add_argument('trec_file', type=str)
+index_format_parser.add_argument('--output-prefix', type=str, default='benchmark_index')
+index_format_parser.add_argument('--repeat', type=int, default=3)
+index_format_parser.set_defaults(func=benchmark_index_format)
+
+intersection_parser = subparsers.add_parser('intersection', help="Set-based vs. galloping postings intersection on skewed document frequencies.")
+intersection_parser.add_argument('--nr-docs', type=int, default=2000000)
+intersection_parser.add_argument('--frequent-df', type=int, default=1000000)
+intersection_parser.add_argument('--rare-df', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+intersection_parser.add_argument('--repeat', type=int, default=5)
+intersection_parser.set_defaults(func=benchmark_intersection)
+
+ranking_parser = subparsers.add_parser('ranking', help="Exhaustive vs. term-at-a-time vs. WAND ranked retrieval.")
+ranking_parser.add_argument('trec_file', type=str)
+ranking_parser.add_argument('queries_file', type=str)
+ranking_parser.add_argument('--k', type=int, default=150)
+ranking_parser.add_argument('--compact-index', action='store_true')
+ranking_parser.add_argument('--repeat', type=int, default=3)
+ranking_parser.set_defaults(func=benchmark_ranking)
+
+batch_parser = subparsers.add_parser('batch', help="Throughput of the parallel batch query executor per number of workers.")
+batch_parser.add_argument('trec_file', type=str)
+batch_parser.add_argument('boolean_queries_file', type=str)
+batch_parser.add_argument('ranked_queries_file', type=str)
+batch_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+batch_parser.add_argument('--copies', type=int, default=20, help="Number of times the query files are repeated.")
+batch_parser.add_argument('--chunk-size', type=int, default=16)
+batch_parser.add_argument('--k', type=int, default=150)
+batch_parser.add_argument('--ranking-mode', type=str, default='term-at-a-time', choices=['term-at-a-time', 'wand', 'impact', 'exhaustive'])
+batch_parser.add_argument('--compact-index', action='store_true')
+batch_parser.add_argument('--mmap-index', action='store_true', help="Answer the queries from a memory-mapped copy of the index.")
+batch_parser.add_argument('--output-prefix', type=str, default='benchmark_batch')
+batch_parser.add_argument('--repeat', type=int, default=3)
+batch_parser.set_defaults(func=benchmark_batch)
+
+result_cache_parser = subparsers.add_parser('result-cache', help="Boolean queries with and without the LRU result cache.")
+result_cache_parser.add_argument('trec_file', type=str)
+result_cache_parser.add_argument('queries_file', type=str)
+result_cache_parser.add_argument('--budget-mb', type=float, nargs='+', default=[0.05, 1, 64])
+result_cache_parser.add_argument('--copies', type=int, default=10, help="Number of times the query file is repeated.")
+result_cache_parser.add_argument('--compact-index', action='store_true')
+result_cache_parser.set_defaults(func=benchmark_result_cache)
+
+stemming_parser = subparsers.add_parser('stemming', help="Indexing throughput with and without the stem cache of SimplePreprocessor.")
+stemming_parser.add_argument('trec_file', type=str)
+stemming_parser.add_argument('--stem-cache-size', type=int, nargs='+', default=[1000, 100000])
+stemming_parser.set_defaults(func=benchmark_stemming)
+
+index_txt_parser = subparsers.add_parser('index-txt', help="Writing and parsing index.txt.")
+index_txt_parser.add_argument('trec_file', type=str)
+index_txt_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+index_txt_parser.add_argument('--compact-index', action='store_true')
+index_txt_parser.add_argument('--output-prefix', type=str, default='benchmark_index')
+index_txt_parser.set_defaults(func=benchmark_index_txt)
+
+bitmap_parser = subparsers.add_parser('bitmap', help="Set vs. compressed bitmap NOT and OR on high-df terms.")
+bitmap_parser.add_argument('--nr-docs', type=int, default=2000000)
+bitmap_parser.add_argument('--df', type=int, nargs='+', default=[10000, 100000, 500000, 1000000])
+bitmap_parser.add_argument('--repeat', type=int, default=5)
+bitmap_parser.set_defaults(func=benchmark_bitmap)
+
+suite_parser = subparsers.add_parser('suite', help="Index build and query latency on a synthetic collection, appended to a results file.")
+suite_parser.add_argument('--nr-docs', type=int, default=20000)
+suite_parser.add_argument('--doc-length', type=int, default=200)
+suite_parser.add_argument('--vocabulary-size', type=int, default=50000)
+suite_parser.add_argument('--zipf-s', type=float, default=1.0)
+suite_parser.add_argument('--seed', type=int, default=0)
+suite_parser.add_argument('--nr-queries', type=int, default=200, help="Number of queries of each kind.")
+suite_parser.add_argument('--k', type=int, default=150)
+suite_parser.add_argument('--ranking-mode', type=str, default='term-at-a-time', choices=['term-at-a-time', 'wand', 'impact', 'exhaustive'])
+suite_parser.add_argument('--result-cache-mb', type=float, default=0, help="Result cache of the boolean queries (off by default, to measure the queries themselves).")
+suite_parser.add_argument('--compact-index', action='store_true')
+suite_parser.add_argument('--output-prefix', type=str, default='benchmark_suite')
+suite_parser.add_argument('--results', type=str, default='benchmark_results.jsonl')
+suite_parser.set_defaults(func=benchmark_suite)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,166 @@
+import re
+from typing import List
+
+# Recursive-descent parser for boolean queries. Produces a tree of the node classes below, which code.py evaluates.
+#
+# Grammar (AND binds tighter than OR, NOT binds tighter than both; adjacent operands are implicitly AND-ed):
+#   query    := or_expr
+#   or_expr  := and_expr ('OR' and_expr)*
+#   and_expr := unary (['AND'] unary)*
+#   unary    := 'NOT' unary | primary
+#   primary  := '(' or_expr ')' | '"' word+ '"' | '#' n '(' word ',' word ')' | word
+#
+# Examples: 'Scotland AND NOT Edinburgh', '"middle east" AND (peace OR war)', '#20(income, taxes) AND NOT "wall street"'.
+#
+# Words are kept exactly as they appear in the query, pre-processing them is left to the caller.
+
+class BooleanQueryNode():
+    pass
+
+class Term(BooleanQueryNode):
+    def __init__(self, term:str):
+        self.term = term
+
+    def __repr__(self):
+        return 'Term(%r)' % self.term
+
+class Phrase(BooleanQueryNode):
+    def __init__(self, terms:List[str]):
+        self.terms = terms
+
+    def __repr__(self):
+        return 'Phrase(%r)' % self.terms
+
+class Proximity(BooleanQueryNode):
+    def __init__(self, distance:int, term1:str, term2:str):
+        self.distance = distance
+        self.term1 = term1
+        self.term2 = term2
+
+    def __repr__(self):
+        return 'Proximity(%d, %r, %r)' % (self.distance, self.term1, self.term2)
+
+class Not(BooleanQueryNode):
+    def __init__(self, child:BooleanQueryNode):
+        self.child = child
+
+    def __repr__(self):
+        return 'Not(%r)' % self.child
+
+class And(BooleanQueryNode):
+    def __init__(self, children:List[BooleanQueryNode]):
+        self.children = children
+
+    def __repr__(self):
+        return 'And(%r)' % self.children
+
+class Or(BooleanQueryNode):
+    def __init__(self, children:List[BooleanQueryNode]):
+        self.children = children
+
+    def __repr__(self):
+        return 'Or(%r)' % self.children
+
+
+# Proximity operators contain parentheses, so they are matched as a whole before "(" and ")".
+TOKEN_RE = re.compile(r'\s*(?:'
+                      r'(?P<proximity>#(?P<distance>[0-9]+)\(\s*(?P<term1>[^\s,()"]+)\s*,\s*(?P<term2>[^\s,()"]+)\s*\))'
+                      r'|(?P<phrase>"(?P<phrase_text>[^"]*)")'
+                      r'|(?P<paren>[()])'
+                      r'|(?P<word>[^\s()"]+)'
+                      r')')
+
+OPERATORS = {'AND', 'OR', 'NOT'}
+
+def tokenize_boolean_query(query:str) -> List[BooleanQueryNode]:
+    """Splits the query into operator / parenthesis strings and Term, Phrase, Proximity leaves.
+    """
+    tokens = []
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        match = TOKEN_RE.match(query, pos)
+        if match is None or match.end() == pos:
+            raise Exception('Cannot parse boolean query "%s" at position %d.' % (query, pos))
+        pos = match.end()
+
+        if match.group('proximity') is not None:
+            tokens.append(Proximity(int(match.group('distance')), match.group('term1'), match.group('term2')))
+        elif match.group('phrase') is not None:
+            tokens.append(Phrase(match.group('phrase_text').split()))
+        elif match.group('paren') is not None:
+            tokens.append(match.group('paren'))
+        elif match.group('word') in OPERATORS:
+            tokens.append(match.group('word'))
+        else:
+            tokens.append(Term(match.group('word')))
+    return tokens
+
+class BooleanQueryParser():
+    def __init__(self, query:str):
+        self.query = query
+        self.tokens = tokenize_boolean_query(query)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise Exception('Unexpected end of boolean query "%s".' % self.query)
+        self.pos += 1
+        return token
+
+    def parse(self) -> BooleanQueryNode:
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise Exception('Unexpected %r in boolean query "%s".' % (self.peek(), self.query))
+        return node
+
+    @staticmethod
+    def flatten(node_class, children:List[BooleanQueryNode]) -> BooleanQueryNode:
+        """Builds an n-ary node, merging nested nodes of the same class: a AND (b AND c) -> And([a, b, c]).
+        """
+        if len(children) == 1:
+            return children[0]
+        flat_children = []
+        for child in children:
+            if isinstance(child, node_class):
+                flat_children += child.children
+            else:
+                flat_children.append(child)
+        return node_class(flat_children)
+
+    def parse_or(self) -> BooleanQueryNode:
+        children = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.next()
+            children.append(self.parse_and())
+        return BooleanQueryParser.flatten(Or, children)
+
+    def parse_and(self) -> BooleanQueryNode:
+        children = [self.parse_unary()]
+        while self.peek() is not None and self.peek() not in ('OR', ')'):
+            if self.peek() == 'AND':
+                self.next()
+            children.append(self.parse_unary())
+        return BooleanQueryParser.flatten(And, children)
+
+    def parse_unary(self) -> BooleanQueryNode:
+        token = self.next()
+        if token == 'NOT':
+            return Not(self.parse_unary())
+        if token == '(':
+            node = self.parse_or()
+            if self.next() != ')':
+                raise Exception('Missing ")" in boolean query "%s".' % self.query)
+            return node
+        if isinstance(token, BooleanQueryNode):
+            return token
+        raise Exception('Unexpected %r in boolean query "%s".' % (token, self.query))
+
+def parse_boolean_query(query:str) -> BooleanQueryNode:
+    """Parses a boolean query into a tree of BooleanQueryNode.
+    """
+    return BooleanQueryParser(query).parse()
@@ -0,0 +1,122 @@
+import sys
+import json
+import platform
+from time import perf_counter, time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, Iterable, Union, ContextManager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak RSS is then not reported.
+    resource = None
+
+# Per-stage timing of the index build (code.py --profile-build report.json).
+#
+# Each stage accumulates the wall-clock time spent in "with profiler.stage(name):" blocks (or in the next() calls of an
+# iterator wrapped by profiler.iterate(name, iterator)), and counters record the amount of work (documents, tokens...).
+# report() returns the times, the share of each stage, the tokens per second, and the peak RSS of the process, and
+# save_json writes it as JSON, so that runs of different versions can be compared.
+#
+# The profiled build runs the same loop as the normal one: the documents and the tokens of the single-pass text
+# processing (tokenisation, stop words, stemming) are produced by wrapped iterators, and the time they take is left
+# out of the posting insertion stage which consumes them. The timers (two per token) add some overhead, so the total
+# of a profiled build is higher than that of a normal one.
+
+class BuildProfiler():
+    def __init__(self):
+        self.stage_seconds = dict()
+        self.stage_calls = dict()
+        self.counters = dict()
+        self.start_time = perf_counter()
+
+    @contextmanager
+    def stage(self, name:str, exclude:str=None) -> Iterator[None]:
+        """Adds the time spent in the with block to stage "name", less the time added to stage "exclude" meanwhile
+        (e.g. the time spent producing the tokens the block consumes).
+        """
+        start = perf_counter()
+        excluded_start = self.stage_seconds.get(exclude, 0.0)
+        try:
+            yield
+        finally:
+            self.add_time(name, perf_counter() - start - (self.stage_seconds.get(exclude, 0.0) - excluded_start))
+
+    def add_time(self, name:str, seconds:float):
+        self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+        self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+
+    def iterate(self, name:str, iterable:Iterable, counter:str=None) -> Iterator:
+        """Yields the items of iterable, adding the time spent producing each of them to stage "name"
+        (e.g. the time spent parsing the XML by iterate_trec_documents), and counting them in "counter" if given.
+        """
+        iterator = iter(iterable)
+        nr_items = 0
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    self.add_time(name, perf_counter() - start)
+                    return
+                self.add_time(name, perf_counter() - start)
+                nr_items += 1
+                yield item
+        finally:
+            if counter is not None:
+                self.count(counter, nr_items)
+
+    def count(self, name:str, n:int=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @staticmethod
+    def peak_rss_bytes() -> Union[int, None]:
+        """Peak resident set size of this process so far, or None if it cannot be measured on this platform.
+        """
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Reported in bytes on macOS, in kilobytes on Linux.
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    def report(self) -> Dict:
+        total_seconds = perf_counter() - self.start_time
+        stages = dict()
+        for name, seconds in self.stage_seconds.items():
+            stages[name] = {'seconds': seconds,
+                            'calls': self.stage_calls[name],
+                            'fraction': seconds / total_seconds if total_seconds > 0 else 0.0}
+
+        # Throughput of the stages which process the text of the documents.
+        text_seconds = sum(self.stage_seconds.get(name, 0.0) for name in ['xml_parsing', 'text_processing', 'posting_insertion'])
+        tokens = self.counters.get('tokens', 0)
+
+        return {'timestamp': time(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'total_seconds': total_seconds,
+                'stages': stages,
+                'counters': dict(self.counters),
+                'tokens_per_second': tokens / text_seconds if text_seconds > 0 else 0.0,
+                'peak_rss_bytes': BuildProfiler.peak_rss_bytes()}
+
+    def save_json(self, file_name:str) -> Dict:
+        report = self.report()
+        with open(file_name, 'w') as f:
+            json.dump(report, f, indent=2)
+        return report
+
+    @staticmethod
+    def format_report(report:Dict) -> str:
+        lines = ['%-20s %9.3fs %6.1f%%' % (name, stage['seconds'], 100 * stage['fraction']) for name, stage in report['stages'].items()]
+        lines.append('%-20s %9.3fs' % ('total', report['total_seconds']))
+        lines.append('%.0f tokens/s, %s' % (report['tokens_per_second'], ', '.join('%s: %d' % item for item in report['counters'].items())))
+        if report['peak_rss_bytes'] is not None:
+            lines.append('peak RSS: %.1f MB' % (report['peak_rss_bytes'] / (1024 * 1024)))
+        return '\n'.join(lines)
+
+def profiled_stage(profiler:Union[BuildProfiler, None], name:str, exclude:str=None) -> ContextManager:
+    """profiler.stage(name, exclude), or a context manager which does nothing if profiling is disabled (profiler is None).
+    """
+    return nullcontext() if profiler is None else profiler.stage(name, exclude)
@@ -1,10 +1,26 @@
+import os
 import re
+import heapq
+import argparse
+import multiprocessing as mp
+from time import perf_counter
+from bisect import bisect_left
 import linecache
 import xml.etree.ElementTree as ElementTree
-import pickle
 from nltk.stem.porter import PorterStemmer
 import numpy as np
-from typing import List, Set, Dict, Tuple, TypeVar
+from typing import List, Set, Dict, Tuple, Union, Iterator, Iterable, Sequence, Mapping, Callable, AbstractSet
+from compact_index import CompactPosInvertedIndex, CompactIndexBuilder, CompactPostings
+from compressed_index import CompressedPosInvertedIndex, save_compressed_pos_inverted_index
+from mmap_index import MmapPosInvertedIndex, save_mmap_pos_inverted_index
+from text_index import save_text_pos_inverted_index
+from dynamic_index import DynamicPosInvertedIndex
+from docid_mapping import DocIDMapping, docid_mapping_file_name
+from impact_index import ImpactIndex, impact_weights_file_name
+from boolean_query import BooleanQueryNode, Term, Phrase, Proximity, Not, And, Or, parse_boolean_query
+from result_cache import QueryResultCache
+from docid_bitmap import DocIDBitmap
+from build_profiler import BuildProfiler, profiled_stage
 
 class SimpleTokenizer():
     def __init__(self, pattern:str):
@@ -44,23 +60,56 @@ def construct_stopwords_set(stopwords_file_name:str) -> Set[str]:
 
 class SimplePreprocessor():
     """Class for pre-processing text. Given a list of strings, it tokenizes them, removes stop words, lowercases and stems them.
+    The stems of the words are memoised (the vocabulary is tiny compared to the number of tokens), in a dictionary of
+    at most stem_cache_size words; 0 disables the cache. When it is full, the first-inserted words are evicted (FIFO,
+    a hit does not refresh a word): an evicted frequent word is stemmed again and re-inserted on its next occurrence,
+    which keeps the lookups of the tokenizing loops a plain dictionary get.
     """
-    def __init__(self, tokenizer:SimpleTokenizer, stop_words_set:Set[str], stemmer:PorterStemmer):
+    def __init__(self, tokenizer:SimpleTokenizer, stop_words_set:Set[str], stemmer:PorterStemmer, stem_cache_size:int=100000):
         self.tokenizer = tokenizer
         self.stop_words_set = stop_words_set
         self.stemmer = stemmer
+
+        self.stem_cache_size = stem_cache_size
+        self.stem_cache = dict()
+        self.stem_lookups = 0
+        self.stem_cache_misses = 0
     
     @staticmethod
     def lowercase_word(word:str) -> str:
         return str.lower(word)
+
+    def stem(self, word:str) -> str:
+        """Stems a word which is not in the stem cache and adds it to the cache, evicting the first-inserted word if it is full.
+        """
+        self.stem_cache_misses += 1
+        stemmed_word = self.stemmer.stem(word)
+        if self.stem_cache_size > 0:
+            if len(self.stem_cache) >= self.stem_cache_size:
+                # Dictionaries keep insertion order, so the first key is the first-inserted one.
+                del self.stem_cache[next(iter(self.stem_cache))]
+            self.stem_cache[word] = stemmed_word
+        return stemmed_word
+
+    def stem_cache_stats(self) -> Dict[str, float]:
+        hits = self.stem_lookups - self.stem_cache_misses
+        return {'lookups': self.stem_lookups,
+                'hits': hits,
+                'misses': self.stem_cache_misses,
+                'hit_rate': hits / self.stem_lookups if self.stem_lookups > 0 else 0.0,
+                'size': len(self.stem_cache)}
     
     def remove_stop_words_lowercase_and_stem(self, tokens:List[str]) -> List[str]:
         final_tokens = []
+        stem_cache = self.stem_cache
         for token in tokens:
             lowercase_token = SimplePreprocessor.lowercase_word(token)
             if lowercase_token not in self.stop_words_set:
-                stemmed_token = self.stemmer.stem(lowercase_token)
+                stemmed_token = stem_cache.get(lowercase_token)
+                if stemmed_token is None:
+                    stemmed_token = self.stem(lowercase_token)
                 final_tokens.append(stemmed_token)
+        self.stem_lookups += len(final_tokens)
         return final_tokens
     
     def process_text_lines(self, text_lines:List[str]) -> List[str]:
@@ -68,54 +117,157 @@ class SimplePreprocessor():
         tokens = self.remove_stop_words_lowercase_and_stem(tokens)
         return tokens
 
+    def iterate_processed_tokens(self, text_lines:Iterable[str]) -> Iterator[str]:
+        """Single-pass version of process_text_lines: tokenizes, lowercases, removes stop words and stems each
+        token as soon as the tokenizer finds it and yields it, so no intermediate list of the tokens is built.
+        """
+        stop_words_set = self.stop_words_set
+        stem_cache = self.stem_cache
+        finditer = self.tokenizer.regexp.finditer
+        nr_tokens = 0
+        try:
+            for line in text_lines:
+                for match in finditer(line):
+                    lowercase_token = match[0].lower()
+                    if lowercase_token not in stop_words_set:
+                        stemmed_token = stem_cache.get(lowercase_token)
+                        if stemmed_token is None:
+                            stemmed_token = self.stem(lowercase_token)
+                        nr_tokens += 1
+                        yield stemmed_token
+        finally:
+            self.stem_lookups += nr_tokens
+
 # ----------------------------------CREATE INDEX AND DOCID SET----------------------------------
-PosInvertedIndex = TypeVar('PosInvertedIndex', Dict[str, Dict[int, List[int]]])
-def read_input_trec_file_and_create_index_and_docId_set(input_file_name:str, preprocessor:SimplePreprocessor) -> Tuple[PosInvertedIndex, Set[int]]:
+def iterate_trec_documents(input_file_name:str) -> Iterator[Tuple[int, str, str]]:
+    """Incrementally parses the input trec file and yields its documents one at a time.
+    Each document element is cleared after it is yielded, so memory usage does not grow with the size of the file.
+
+    Args:
+        input_file_name (str): input trec file name.
+
+    Yields:
+        Iterator[Tuple[int, str, str]]: (DOCNO, HEADLINE, TEXT) of each document, in file order.
+    """
+    root = None
+    depth = 0
+
+    for event, elem in ElementTree.iterparse(input_file_name, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+
+        depth -= 1
+        # Documents are the direct children of the root element.
+        if depth != 1:
+            continue
+
+        docId = int(elem.find('DOCNO').text.strip())
+        docHeadline = elem.find('HEADLINE').text.strip()
+        docText = elem.find('TEXT').text.strip()
+
+        # Drop the parsed document (and the root's reference to it) before moving on to the next one.
+        elem.clear()
+        root.clear()
+
+        yield docId, docHeadline, docText
+
+# The search functions accept any of these representations: CompactPosInvertedIndex, CompressedPosInvertedIndex,
+# MmapPosInvertedIndex and DynamicPosInvertedIndex implement the same read-only mapping interface as the nested dictionaries.
+PosInvertedIndex = Union[Dict[str, Dict[int, List[int]]], CompactPosInvertedIndex, CompressedPosInvertedIndex, MmapPosInvertedIndex, DynamicPosInvertedIndex]
+def add_document_to_pos_inverted_index(pos_inverted_index:Dict[str, Dict[int, List[int]]], docId:int, tokens:Iterable[str]):
+    """Adds the term occurrences of a document (its processed tokens, a list or a generator) to a dictionary-based index.
+    """
+    for index, token in enumerate(tokens):
+        if token in pos_inverted_index:
+            if docId in pos_inverted_index[token]:
+                pos_inverted_index[token][docId].append(index)
+            else:
+                pos_inverted_index[token][docId] = [index]
+        else:
+            pos_inverted_index[token] = dict()
+            pos_inverted_index[token][docId] = [index]
+
+def read_input_trec_file_and_create_index_and_docId_set(input_file_name:str, preprocessor:SimplePreprocessor, compact:bool=False, docID_mapping:DocIDMapping=None, profiler:BuildProfiler=None) -> Tuple[PosInvertedIndex, Set[int]]:
     """Reads input trec file and creates a positional inverted index from it, and it also creates a set containing all document IDs.
 
     Args:
         input_file_name (str): input trec file name.
         preprocessor (SimplePreprocessor): initialized SimplePreprocessor.
+        compact (bool): build a CompactPosInvertedIndex (array-backed) instead of nested dictionaries.
+        docID_mapping (DocIDMapping): if given, documents are indexed under dense internal IDs 0..N-1 (in file order)
+        instead of their DOCNO, and the mapping between the two is recorded in it.
+        A DOCNO which appears more than once is indexed as one document, with the term occurrences of all its copies.
+        profiler (BuildProfiler): if given, the time spent parsing the XML, processing the text (tokenising, removing the
+        stop words and stemming) and inserting the postings is recorded in it, together with the number of documents and
+        indexed tokens.
 
     Returns:
         Tuple[PosInvertedIndex, Set[int]]: [description]
     """
     pos_inverted_index = dict()
+    compact_index_builder = CompactIndexBuilder() if compact else None
     docId_set = set()
-
-    # Read trec xml file.
-    with open(input_file_name, 'r') as f:
-        xml_trec_file = f.read()
-    xml = ElementTree.fromstring(xml_trec_file)
+    # Documents whose DOCNO appears more than once in the collection: their term occurrences are merged.
+    repeated_docIds = set()
 
     # For each document, pre-process the headline and body and add the term occurences to the positional inverted index.
-    for doc in xml:
-        docId = int(doc.find('DOCNO').text.strip())
-        docHeadline = doc.find('HEADLINE').text.strip()
-        docText = doc.find('TEXT').text.strip()
-
+    # Documents are streamed from the trec xml file, so the whole file is never loaded in memory.
+    documents = iterate_trec_documents(input_file_name)
+    if profiler is not None:
+        documents = profiler.iterate('xml_parsing', documents)
+    for docno, docHeadline, docText in documents:
+        docId = docno if docID_mapping is None else docID_mapping.add(docno)
+        if docId in docId_set:
+            repeated_docIds.add(docId)
         docId_set.add(docId)
         
         text = [docHeadline, docText]
-        tokens = preprocessor.process_text_lines(text)
-
-        for index, token in enumerate(tokens):
-            if token in pos_inverted_index:
-                if docId in pos_inverted_index[token]:
-                    pos_inverted_index[token][docId].append(index)
-                else:
-                    pos_inverted_index[token][docId] = [index]
+        tokens = preprocessor.iterate_processed_tokens(text)
+        if profiler is not None:
+            tokens = profiler.iterate('text_processing', tokens, 'tokens')
+
+        # The tokens are produced while the postings are inserted, their time is recorded as text_processing.
+        with profiled_stage(profiler, 'posting_insertion', 'text_processing'):
+            if compact:
+                compact_index_builder.add_document(docId, tokens)
             else:
-                pos_inverted_index[token] = dict()
-                pos_inverted_index[token][docId] = [index]
+                add_document_to_pos_inverted_index(pos_inverted_index, docId, tokens)
+        if profiler is not None:
+            profiler.count('documents')
+
+    if profiler is not None:
+        profiler.count('terms', len(compact_index_builder.postings) if compact else len(pos_inverted_index))
     
-    # This might be useless as indices are added in-order -> TODO: check.
-    for term in pos_inverted_index:
-        for docId in pos_inverted_index[term]:
-            pos_inverted_index[term][docId].sort()
+    if compact:
+        with profiled_stage(profiler, 'compact_build'):
+            return compact_index_builder.build(), docId_set
+
+    # The positions of a document are appended in increasing order, so the postings are already sorted, except those of
+    # the repeated DOCNOs, where the positions of each occurrence of the document were appended one after the other.
+    # (CompactIndexBuilder.build merges them itself.)
+    if len(repeated_docIds) > 0:
+        for term in pos_inverted_index:
+            for docId in repeated_docIds.intersection(pos_inverted_index[term]):
+                pos_inverted_index[term][docId].sort()
     
     return pos_inverted_index, docId_set
 
+def update_index_from_trec_file(dynamic_index:DynamicPosInvertedIndex, input_file_name:str, preprocessor:SimplePreprocessor) -> int:
+    """Adds the documents of a trec file to a DynamicPosInvertedIndex, replacing the documents which are already in it
+    (e.g. a new batch of a news feed).
+
+    Returns:
+        int: number of documents added or replaced.
+    """
+    nr_docs = 0
+    for docId, docHeadline, docText in iterate_trec_documents(input_file_name):
+        dynamic_index.update_document(docId, preprocessor.iterate_processed_tokens([docHeadline, docText]))
+        nr_docs += 1
+    return nr_docs
+
 #------------------------SEARCH functions-----------------------------------------
 def answer_simple_search(term:str, pos_inverted_index:PosInvertedIndex) -> Set[int]:
     """Finds the documents that contain the term and returns their docIDs.
@@ -133,33 +285,134 @@ def answer_simple_search(term:str, pos_inverted_index:PosInvertedIndex) -> Set[i
     term_docIDs = set(pos_inverted_index[term].keys())
     return term_docIDs
 
+def galloping_search(docIDs:Sequence[int], target:int, lo:int) -> int:
+    """Returns the smallest index i >= lo such that docIDs[i] >= target (len(docIDs) if there is none).
+    Probes lo, lo+1, lo+3, lo+7, ... until it overshoots the target, then binary searches the last gap,
+    so skipping over k postings costs O(log k) comparisons.
+
+    Args:
+        docIDs (Sequence[int]): sorted docIDs.
+        target (int): docID to search for.
+        lo (int): index to start the search from.
+    """
+    n = len(docIDs)
+    hi = lo
+    step = 1
+    while hi < n and docIDs[hi] < target:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(docIDs, target, lo, min(hi, n))
+
+def intersect_sorted_docIDs(short_docIDs:Sequence[int], long_docIDs:Sequence[int]) -> List[int]:
+    """Intersects two sorted docID lists by galloping through the longer one for every docID of the shorter one.
+    Runs in O(|short| * log(|long| / |short|)) and does not allocate anything besides the result.
+    """
+    result = []
+    pos = 0
+    n = len(long_docIDs)
+    for docID in short_docIDs:
+        pos = galloping_search(long_docIDs, docID, pos)
+        if pos == n:
+            break
+        if long_docIDs[pos] == docID:
+            result.append(docID)
+    return result
+
+def intersect_postings(postings_lists:List[Mapping[int, Sequence[int]]]) -> List[int]:
+    """Returns the sorted docIDs which appear in every postings list.
+    Lists are intersected from the shortest to the longest, so the intermediate result never grows. Array-backed
+    postings (sorted docIDs) are intersected by galloping search, dictionary postings by probing them with the
+    current (smaller) result; neither builds a set of all the docIDs of a term.
+    """
+    postings_lists = sorted(postings_lists, key=len)
+    if len(postings_lists) == 0 or len(postings_lists[0]) == 0:
+        return []
+
+    shortest = postings_lists[0]
+    result = list(shortest.docIDs) if isinstance(shortest, CompactPostings) else sorted(shortest.keys())
+    for postings in postings_lists[1:]:
+        if isinstance(postings, CompactPostings):
+            result = intersect_sorted_docIDs(result, postings.docIDs)
+        else:
+            result = [docID for docID in result if docID in postings]
+        if len(result) == 0:
+            break
+    return result
+
 
 def answer_phrase_search(term1:str, term2:str, pos_inverted_index:PosInvertedIndex) -> Set[int]:
     """Search for the documents which contain the phrase "term1 term2".
     """
-    if term1 not in pos_inverted_index or term2 not in pos_inverted_index:
+    return answer_multi_term_phrase_search([term1, term2], pos_inverted_index)
+
+def positions_contain_phrase(positions_lists:List[Sequence[int]], pointers:List[int]) -> bool:
+    """Checks whether there is a position p such that p+k is in positions_lists[k] for every k, i.e. whether the
+    terms whose (sorted) positions are given appear one after the other in the document.
+    Walks all the lists at once, each pointer only moves forward, so the cost is linear in the total number of positions.
+
+    Args:
+        positions_lists (List[Sequence[int]]): sorted positions of each phrase term in the document, in phrase order.
+        pointers (List[int]): scratch list with one entry per phrase term (reused across documents).
+    """
+    nr_terms = len(positions_lists)
+    for k in range(nr_terms):
+        pointers[k] = 0
+
+    # Candidate start of the phrase. Term k must be found at position candidate+k.
+    candidate = positions_lists[0][0]
+    k = 0
+    while True:
+        positions = positions_lists[k]
+        target = candidate + k
+        idx = pointers[k]
+        length = len(positions)
+        while idx < length and positions[idx] < target:
+            idx += 1
+        if idx == length:
+            return False
+        pointers[k] = idx
+
+        if positions[idx] == target:
+            k += 1
+            if k == nr_terms:
+                return True
+        else:
+            # Term k only appears further on, so the phrase cannot start before positions[idx]-k: restart from the first term.
+            candidate = positions[idx] - k
+            k = 0
+
+def answer_multi_term_phrase_search(terms:List[str], pos_inverted_index:PosInvertedIndex) -> Set[int]:
+    """Search for the documents which contain the phrase "terms[0] terms[1] ... terms[n-1]".
+
+    Args:
+        terms (List[str]): pre-processed phrase terms, in order.
+        pos_inverted_index (PosInvertedIndex): pos. inverted index.
+
+    Returns:
+        Set[int]: docs which contain the phrase.
+    """
+    if len(terms) == 0:
         return set()
+    for term in terms:
+        if term not in pos_inverted_index:
+            return set()
     
-    # Retrieve documents which contain both terms.
-    term1_docIDs = set(pos_inverted_index[term1].keys())
-    term2_docIDs = set(pos_inverted_index[term2].keys())
-    common_docIDs = term1_docIDs.intersection(term2_docIDs)
+    # Retrieve documents which contain all the terms.
+    terms_postings = [pos_inverted_index[term] for term in terms]
+    common_docIDs = intersect_postings(terms_postings)
 
     # If no docs were found, return an empty set.
     if len(common_docIDs) == 0:
         return set()
     
-    # Search for an occurence of "term1 term2" in every common document.
+    # Search for an occurence of the phrase in every common document.
     result_set = set()
+    pointers = [0] * len(terms)
     for docID in common_docIDs:
-        term1_indices = pos_inverted_index[term1][docID]
-        term2_indices = pos_inverted_index[term2][docID]
-
-        term2_indices = set(term2_indices)
-        for index in term1_indices:
-            if (index+1) in term2_indices:
-                result_set.add(docID)
-                break
+        positions_lists = [term_postings[docID] for term_postings in terms_postings]
+        if positions_contain_phrase(positions_lists, pointers):
+            result_set.add(docID)
     
     return result_set
 
@@ -170,17 +423,17 @@ def answer_proximity_search(term1:str, term2:str, distance:int, pos_inverted_ind
     if term1 not in pos_inverted_index or term2 not in pos_inverted_index:
         return set()
 
-    term1_docIDs = set(pos_inverted_index[term1].keys())
-    term2_docIDs = set(pos_inverted_index[term2].keys())
-    common_docIDs = term1_docIDs.intersection(term2_docIDs)
+    term1_postings = pos_inverted_index[term1]
+    term2_postings = pos_inverted_index[term2]
+    common_docIDs = intersect_postings([term1_postings, term2_postings])
 
     if len(common_docIDs) == 0:
         return set()
     
     result_set = set()
     for docID in common_docIDs:
-        term1_indices = pos_inverted_index[term1][docID]
-        term2_indices = pos_inverted_index[term2][docID]
+        term1_indices = term1_postings[docID]
+        term2_indices = term2_postings[docID]
 
         list_idx1, list_idx2 = 0, 0
         len1, len2 = len(term1_indices), len(term2_indices)
@@ -206,109 +459,173 @@ def answer_proximity_search(term1:str, term2:str, distance:int, pos_inverted_ind
     return result_set
 
 # -------------------------BOOL_query_parser + answer-er----------------
-def parse_and_answer_boolean_term(term:str, docIDs:Set[int], pos_inverted_index:PosInvertedIndex, pre_processor:SimplePreprocessor) -> Set[int]:
-    """Parses the term obtained from "parse_and_answer_boolean_query". The term can be a simple term, a negation of a simple term or a phrase query.
-    Returns the documents which contain the terms.
+def pre_process_boolean_query_tree(node:BooleanQueryNode, pre_processor:SimplePreprocessor) -> BooleanQueryNode:
+    """Returns a copy of the query tree whose words have been pre-processed like the indexed text.
+    A term which is removed by the pre-processor (e.g. a stop word) becomes Term(''), which matches no document.
+    A term which the tokenizer splits in several tokens (e.g. "U.S.") becomes a phrase.
+    """
+    if isinstance(node, Term):
+        terms = pre_processor.process_text_lines([node.term])
+        if len(terms) > 1:
+            return Phrase(terms)
+        return Term(terms[0] if len(terms) == 1 else '')
+    if isinstance(node, Phrase):
+        return Phrase(pre_processor.process_text_lines([" ".join(node.terms)]))
+    if isinstance(node, Proximity):
+        term1 = pre_processor.remove_stop_words_lowercase_and_stem([node.term1])
+        term2 = pre_processor.remove_stop_words_lowercase_and_stem([node.term2])
+        return Proximity(node.distance, term1[0] if len(term1) > 0 else '', term2[0] if len(term2) > 0 else '')
+    if isinstance(node, Not):
+        return Not(pre_process_boolean_query_tree(node.child, pre_processor))
+    return type(node)([pre_process_boolean_query_tree(child, pre_processor) for child in node.children])
+
+def estimate_boolean_node_frequency(node:BooleanQueryNode, N:int, pos_inverted_index:PosInvertedIndex) -> int:
+    """Cheap upper bound of the number of documents matching the node, computed from document frequencies only.
+    Used to evaluate the most selective conjuncts first.
+    """
+    if isinstance(node, Term):
+        return len(pos_inverted_index[node.term]) if node.term in pos_inverted_index else 0
+    if isinstance(node, (Phrase, Proximity)):
+        terms = node.terms if isinstance(node, Phrase) else [node.term1, node.term2]
+        if len(terms) == 0:
+            return 0
+        return min(estimate_boolean_node_frequency(Term(term), N, pos_inverted_index) for term in terms)
+    if isinstance(node, Not):
+        return N - estimate_boolean_node_frequency(node.child, N, pos_inverted_index)
+    if isinstance(node, And):
+        return min(estimate_boolean_node_frequency(child, N, pos_inverted_index) for child in node.children)
+    return min(N, sum(estimate_boolean_node_frequency(child, N, pos_inverted_index) for child in node.children))
+
+def new_docID_set(docIDs:AbstractSet[int], elements:Iterable[int]=()) -> AbstractSet[int]:
+    """Returns the elements as a set of the same kind as docIDs, the set of all documents: a DocIDBitmap if the boolean
+    queries are evaluated with bitmaps, a set otherwise.
+    """
+    if isinstance(docIDs, DocIDBitmap):
+        return DocIDBitmap.from_iterable(elements)
+    return elements if isinstance(elements, (set, frozenset)) else set(elements)
 
-    Returns:
-        Set[int]: Documents which contain the term.
+def answer_boolean_leaf(node:Union[Term, Phrase, Proximity], pos_inverted_index:PosInvertedIndex, result_cache:QueryResultCache=None, bitmap:bool=False) -> AbstractSet[int]:
+    """Returns the documents which match a (pre-processed) term, phrase or proximity node, as a DocIDBitmap if bitmap is True.
+    With a result_cache, the result is looked up under the normalised node first, and cached (as a frozenset or a DocIDBitmap) if missing.
     """
-    not_term = False
-    result_set = set()
+    if isinstance(node, Term):
+        key = ('term', node.term)
+    elif isinstance(node, Phrase):
+        key = ('phrase', tuple(node.terms))
+    else:
+        key = ('proximity', node.distance, node.term1, node.term2)
+
+    if result_cache is not None:
+        result_set = result_cache.get(key)
+        if result_set is not None:
+            return DocIDBitmap.from_iterable(result_set) if bitmap else result_set
+
+    if isinstance(node, Term) and bitmap:
+        # Build the bitmap straight from the postings list.
+        result_set = DocIDBitmap.from_iterable(pos_inverted_index[node.term].keys() if node.term in pos_inverted_index else ())
+    elif isinstance(node, Term):
+        result_set = answer_simple_search(node.term, pos_inverted_index)
+    elif isinstance(node, Phrase):
+        result_set = answer_multi_term_phrase_search(node.terms, pos_inverted_index)
+    else:
+        result_set = answer_proximity_search(node.term1, node.term2, node.distance, pos_inverted_index)
+    if bitmap:
+        result_set = DocIDBitmap.from_iterable(result_set)
 
-    if term[:4] == "NOT ":
-        not_term = True
-        term = term[4:]
-    
-    # If the term contains a " -> it is a phrase query. Parse it accordingly and return the documents containing it.
-    if "\"" in term:
-        term1_re = re.compile("\"(.+) ")
-        term2_re = re.compile(" (.+)\"")
+    if result_cache is not None:
+        result_set = result_cache.put(key, result_set)
+    return result_set
 
-        term1 = term1_re.search(term).group(1)
-        term1 = pre_processor.remove_stop_words_lowercase_and_stem([term1])[0]
+def filter_by_boolean_node(candidates:Set[int], node:BooleanQueryNode, keep:bool, docIDs:Set[int], pos_inverted_index:PosInvertedIndex, result_cache:QueryResultCache=None) -> Set[int]:
+    """Returns the candidates which match the node (keep=True) or which do not match it (keep=False).
+    Plain terms are checked against their postings lists directly, without materialising their docIDs (except with
+    bitmaps, which are combined with the term's bitmap instead).
+    """
+    if isinstance(node, Term) and not isinstance(candidates, DocIDBitmap):
+        postings = pos_inverted_index[node.term] if node.term in pos_inverted_index else dict()
+        return set(docID for docID in candidates if (docID in postings) == keep)
 
-        term2 = term2_re.search(term).group(1)
-        term2 = pre_processor.remove_stop_words_lowercase_and_stem([term2])[0]
+    matches = answer_boolean_query_tree(node, docIDs, pos_inverted_index, result_cache)
+    return candidates.intersection(matches) if keep else candidates.difference(matches)
 
-        result_set = answer_phrase_search(term1, term2, pos_inverted_index)
-    # Otherwise, it is a simple search.
+def answer_boolean_conjunction(children:List[BooleanQueryNode], docIDs:Set[int], pos_inverted_index:PosInvertedIndex, result_cache:QueryResultCache=None) -> Set[int]:
+    """Answers child_1 AND child_2 AND ... AND child_n.
+    The positive conjuncts are evaluated from the rarest to the most frequent; negated conjuncts are applied last as
+    filters (A AND NOT B = A minus B), so the complement of B is never built. Stops as soon as the result is empty.
+    """
+    N = len(docIDs)
+    positives = [child for child in children if not isinstance(child, Not)]
+    negatives = [child.child for child in children if isinstance(child, Not)]
+
+    # NOT a AND NOT b = NOT (a OR b).
+    if len(positives) == 0:
+        return docIDs.difference(answer_boolean_query_tree(Or(negatives), docIDs, pos_inverted_index, result_cache))
+
+    positives.sort(key=lambda child: estimate_boolean_node_frequency(child, N, pos_inverted_index))
+    if estimate_boolean_node_frequency(positives[0], N, pos_inverted_index) == 0:
+        return new_docID_set(docIDs)
+
+    if isinstance(positives[0], Term):
+        # The rarest conjunct is a plain term: intersect all the plain terms straight from their postings lists.
+        terms = [child.term for child in positives if isinstance(child, Term)]
+        result_set = new_docID_set(docIDs, intersect_postings([pos_inverted_index[term] for term in terms]))
+        remaining = [child for child in positives if not isinstance(child, Term)]
     else:
-        term = pre_processor.remove_stop_words_lowercase_and_stem([term])[0]
-        result_set = answer_simple_search(term, pos_inverted_index)
-    
-    # If the term was negated, return the documents which do not contain it.
-    if not_term:
-        result_set = docIDs.difference(result_set)
-    
+        result_set = answer_boolean_query_tree(positives[0], docIDs, pos_inverted_index, result_cache)
+        remaining = positives[1:]
+
+    for child in remaining:
+        if len(result_set) == 0:
+            return result_set
+        result_set = filter_by_boolean_node(result_set, child, True, docIDs, pos_inverted_index, result_cache)
+
+    for child in negatives:
+        if len(result_set) == 0:
+            return result_set
+        result_set = filter_by_boolean_node(result_set, child, False, docIDs, pos_inverted_index, result_cache)
+
     return result_set
 
+def answer_boolean_query_tree(node:BooleanQueryNode, docIDs:Set[int], pos_inverted_index:PosInvertedIndex, result_cache:QueryResultCache=None) -> AbstractSet[int]:
+    """Returns the documents which match the (pre-processed) query tree.
+    The result may be a frozenset shared with result_cache, it must not be modified.
+    If docIDs is a DocIDBitmap, the sets of documents are DocIDBitmaps too: NOT and OR are then computed on bitmaps.
+    """
+    if isinstance(node, (Term, Phrase, Proximity)):
+        return answer_boolean_leaf(node, pos_inverted_index, result_cache, isinstance(docIDs, DocIDBitmap))
+    if isinstance(node, Not):
+        return docIDs.difference(answer_boolean_query_tree(node.child, docIDs, pos_inverted_index, result_cache))
+    if isinstance(node, And):
+        return answer_boolean_conjunction(node.children, docIDs, pos_inverted_index, result_cache)
+
+    # OR: stop early if every document already matches.
+    result_set = new_docID_set(docIDs)
+    for child in node.children:
+        result_set.update(answer_boolean_query_tree(child, docIDs, pos_inverted_index, result_cache))
+        if len(result_set) == len(docIDs):
+            break
+    return result_set
 
-def parse_and_answer_boolean_query(query:str, docIDs:Set[int], pos_inverted_index:PosInvertedIndex, pre_processor:SimplePreprocessor) -> Set[int]:
+def parse_and_answer_boolean_query(query:str, docIDs:Set[int], pos_inverted_index:PosInvertedIndex, pre_processor:SimplePreprocessor, result_cache:QueryResultCache=None) -> Set[int]:
     """Returns the documents which answer the input query.
+    The query can combine terms, phrases ("a b c") and proximity searches (#n(a, b)) with AND, OR, NOT and parentheses
+    (see boolean_query.py for the grammar).
 
     Args:
         query (str): input boolean query.
-        docIDs (Set[int]): set of all document ids.
+        docIDs (Set[int]): set of all document ids, or a DocIDBitmap of them to evaluate the query with bitmaps.
         pos_inverted_index (PosInvertedIndex): pos inverted index.
         pre_processor (SimplePreprocessor): the same SimplePreprocessor which was used to pre-process the text used to 
         create the positional inverted index.
+        result_cache (QueryResultCache): optional cache of the results of terms, phrases and proximity searches,
+        shared by all the queries answered from pos_inverted_index.
 
     Returns:
         Set[int]: Documents which answer the query.
     """
-    result_set = set()
-
-    # If the query contains "#" -> it is a proximity query. Parse it and answer it.
-    if "#" in query:
-        distance_re = re.compile("#([0-9]+)\(")
-        term1_re = re.compile("\(([a-zA-Z0-9]+),")
-        term2_re = re.compile(", ?([a-zA-Z0-9]+)\)")
-
-        distance = distance_re.search(query).group(1)
-        distance = int(distance)
-
-        term1 = term1_re.search(query).group(1)
-        term1 = pre_processor.remove_stop_words_lowercase_and_stem([term1])[0]
-
-        term2 = term2_re.search(query).group(1)
-        term2 = pre_processor.remove_stop_words_lowercase_and_stem([term2])[0]
-
-        result_set = answer_proximity_search(term1, term2, distance, pos_inverted_index)
-    
-    else:
-        # If the query contains and, the query will be term1 AND term2.
-        # Retrieve the documents which contain both terms.
-        if " AND " in query:
-            term1_re = re.compile("(.+) AND ")
-            term2_re = re.compile(" AND (.+)")
-
-            term1 = term1_re.search(query).group(1)
-            term2 = term2_re.search(query).group(1)
-
-            results_q1 = parse_and_answer_boolean_term(term1, docIDs, pos_inverted_index, pre_processor)
-            results_q2 = parse_and_answer_boolean_term(term2, docIDs, pos_inverted_index, pre_processor)
-            result_set = results_q1.intersection(results_q2)
-            
-        # If the query contains or, the query will be term1 OR term2.
-        # Retrieve the documents which contain either term.
-        elif " OR " in query:
-            term1_re = re.compile("(.+) OR ")
-            term2_re = re.compile(" OR (.+)")
-
-            term1 = term1_re.search(query).group(1)
-            term2 = term2_re.search(query).group(1)
-
-            results_q1 = parse_and_answer_boolean_term(term1, docIDs, pos_inverted_index, pre_processor)
-            results_q2 = parse_and_answer_boolean_term(term2, docIDs, pos_inverted_index, pre_processor)
-            result_set = results_q1.union(results_q2)
-        
-        # If the query is not a proximity query and does not contain AND or OR, then it is comprised of a single "term".
-        # This "term" is either a proper term or a phrase query (or a negation of either of those).
-        else:
-            result_set = parse_and_answer_boolean_term(query, docIDs, pos_inverted_index, pre_processor)
-    
-    return result_set
+    query_tree = pre_process_boolean_query_tree(parse_boolean_query(query), pre_processor)
+    result_set = answer_boolean_query_tree(query_tree, docIDs, pos_inverted_index, result_cache)
+    return set(result_set) if isinstance(result_set, (frozenset, DocIDBitmap)) else result_set
 
 def tf_idf(tf_term:int, df_term:int, N:int) -> float:
     """Calculate tf_idf.
@@ -372,45 +689,269 @@ def parse_and_answer_ranked_query(query:str, N:int, pos_inverted_index:PosInvert
     
     return doc_scores
 
+def create_dense_docIDs(docIDs:Set[int]) -> np.ndarray:
+    """Sorted array of all document IDs. The dense (internal) ID of a document is its index in this array,
+    so a batch of docIDs is mapped to dense IDs with a single np.searchsorted.
+    """
+    return np.array(sorted(docIDs), dtype=np.int64)
+
+def to_dense_ids(dense_docIDs:np.ndarray, docIDs:np.ndarray) -> np.ndarray:
+    """Dense IDs of a batch of docIDs. If the docIDs of the collection already are 0..N-1 (the index was built with
+    a DocIDMapping), they are their own dense IDs and no search is needed.
+    """
+    if len(dense_docIDs) > 0 and dense_docIDs[0] == 0 and dense_docIDs[-1] == len(dense_docIDs) - 1:
+        return docIDs
+    return np.searchsorted(dense_docIDs, docIDs)
+
+def postings_docIDs_and_tfs(postings:Mapping[int, Sequence[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the docIDs of a postings list and the term frequency in each of them, as NumPy arrays.
+    """
+    if isinstance(postings, CompactPostings):
+        docIDs = np.frombuffer(postings.docIDs, dtype=np.uint32)
+        tfs = np.diff(np.frombuffer(postings.offsets, dtype=np.uint32).astype(np.int64))
+        return docIDs, tfs
+
+    docIDs = np.fromiter(postings.keys(), dtype=np.int64, count=len(postings))
+    tfs = np.fromiter((len(positions) for positions in postings.values()), dtype=np.int64, count=len(postings))
+    return docIDs, tfs
+
+def parse_and_answer_ranked_query_term_at_a_time(query:str, dense_docIDs:np.ndarray, pos_inverted_index:PosInvertedIndex, pre_processor:SimplePreprocessor, tokenizer:SimpleTokenizer, k:int) -> List[Tuple[int, float]]:
+    """Term-at-a-time version of "parse_and_answer_ranked_query": the idf of each query term is computed once, the
+    tf-idf weights of all its postings are computed at once and added to a score accumulator indexed by dense docID.
+    The scores are the same as the ones computed by "parse_and_answer_ranked_query".
+
+    Args:
+        query (str): string containing the ranked query.
+        dense_docIDs (np.ndarray): all the docIDs of the collection, see "create_dense_docIDs".
+        pos_inverted_index (PosInvertedIndex): pos inverted index constructed from the collection.
+        pre_processor (SimplePreprocessor): pre-processor used to extract terms from the collection.
+        tokenizer (SimpleTokenizer): tokenizer used to create the pos inverted index.
+        k (int): number of results to return.
+
+    Returns:
+        The k (docID, score) pairs with the highest scores, in descending order of score (ties broken by docID).
+    """
+    tokens = tokenizer.tokenize_text_lines([query])
+    terms = pre_processor.remove_stop_words_lowercase_and_stem(tokens)
+
+    N = len(dense_docIDs)
+    scores = np.zeros(N, dtype=np.float64)
+    # Documents which contain at least one query term (they are returned even if their score is 0).
+    matched = np.zeros(N, dtype=bool)
+
+    for term in terms:
+        if term not in pos_inverted_index:
+            continue
+        
+        postings = pos_inverted_index[term]
+        idf = np.log10(N/len(postings))
+        docIDs, tfs = postings_docIDs_and_tfs(postings)
+        dense_ids = to_dense_ids(dense_docIDs, docIDs)
+
+        # A document appears at most once in a postings list, so there are no repeated indices here.
+        scores[dense_ids] += (1+np.log10(tfs)) * idf
+        matched[dense_ids] = True
+    
+    return select_top_k_documents(scores, matched, dense_docIDs, k)
+
+def select_top_k_documents(scores:np.ndarray, matched:np.ndarray, dense_docIDs:np.ndarray, k:int) -> List[Tuple[int, float]]:
+    """Returns the k matched documents with the highest scores as (docID, score), in descending order of score
+    (ties broken by docID).
+
+    Args:
+        scores (np.ndarray): score accumulator, indexed by dense docID.
+        matched (np.ndarray): boolean mask of the documents which contain at least one query term.
+        dense_docIDs (np.ndarray): all the docIDs of the collection, see "create_dense_docIDs".
+        k (int): number of results to return.
+    """
+    candidates = np.flatnonzero(matched)
+    if len(candidates) > k:
+        # Keep the documents scoring at least as much as the k-th best one (ties included, they are resolved below).
+        candidate_scores = scores[candidates]
+        kth = np.argpartition(-candidate_scores, k-1)[k-1]
+        candidates = candidates[candidate_scores >= candidate_scores[kth]]
+    
+    # Sort by descending score, then by docID, and cut at k. Dense IDs are in docID order.
+    order = np.lexsort((candidates, -scores[candidates]))
+    candidates = candidates[order][:k]
+    return list(zip(dense_docIDs[candidates].tolist(), scores[candidates].tolist()))
+
+def create_impact_index(pos_inverted_index:PosInvertedIndex, docIDs:Set[int], quantise:bool=False, internal_docIDs:bool=False) -> ImpactIndex:
+    """Precomputes the idf of every term and the tf-idf weight of every posting (see impact_index.py), so that
+    "parse_and_answer_ranked_query_impact" only has to add them up.
+
+    Args:
+        pos_inverted_index (PosInvertedIndex): pos inverted index constructed from the collection.
+        docIDs (Set[int]): set of all document ids.
+        quantise (bool): store the weights as uint8 instead of float64 (approximate scores).
+        internal_docIDs (bool): whether the index was built with internal docIDs (recorded with the weights).
+    """
+    dense_docIDs = create_dense_docIDs(docIDs)
+    N = len(dense_docIDs)
+
+    term_weights = []
+    for term in pos_inverted_index:
+        postings = pos_inverted_index[term]
+        idf = np.log10(N/len(postings))
+        term_docIDs, tfs = postings_docIDs_and_tfs(postings)
+        weights = (1+np.log10(tfs)) * idf
+        term_weights.append((term, float(idf), to_dense_ids(dense_docIDs, term_docIDs), weights))
+
+    return ImpactIndex.from_term_weights(dense_docIDs, term_weights, quantise, internal_docIDs)
+
+def parse_and_answer_ranked_query_impact(query:str, impact_index:ImpactIndex, pre_processor:SimplePreprocessor, tokenizer:SimpleTokenizer, k:int) -> List[Tuple[int, float]]:
+    """Same as "parse_and_answer_ranked_query_term_at_a_time", but using the weights precomputed by "create_impact_index":
+    answering the query only adds the weights of the postings of its terms into the accumulator.
+    With unquantised weights the scores are the same as the other scorers'.
+    """
+    tokens = tokenizer.tokenize_text_lines([query])
+    terms = pre_processor.remove_stop_words_lowercase_and_stem(tokens)
+
+    N = len(impact_index.dense_docIDs)
+    quantised = impact_index.scale is not None
+    scores = np.zeros(N, dtype=np.int64 if quantised else np.float64)
+    matched = np.zeros(N, dtype=bool)
+
+    for term in terms:
+        if term not in impact_index:
+            continue
+        dense_ids, impacts = impact_index.term_impacts(term)
+        scores[dense_ids] += impacts
+        matched[dense_ids] = True
+
+    if quantised:
+        scores = scores * impact_index.scale
+    return select_top_k_documents(scores, matched, impact_index.dense_docIDs, k)
+
+class WandCursor():
+    """Cursor over the postings of one query term, used by "parse_and_answer_ranked_query_wand".
+    """
+    def __init__(self, docIDs:Sequence[int], weights:List[float], multiplicity:int):
+        self.docIDs = docIDs
+        self.weights = weights
+        self.pos = 0
+        # The term may appear several times in the query, each occurrence adds its weight to the score.
+        self.upper_bound = multiplicity * max(weights)
+
+    def doc(self) -> Union[int, None]:
+        return self.docIDs[self.pos] if self.pos < len(self.docIDs) else None
+
+    def advance_to(self, docID:int):
+        """Moves the cursor to the first posting >= docID."""
+        self.pos = galloping_search(self.docIDs, docID, self.pos)
+
+def parse_and_answer_ranked_query_wand(query:str, N:int, pos_inverted_index:PosInvertedIndex, pre_processor:SimplePreprocessor, tokenizer:SimpleTokenizer, k:int) -> List[Tuple[int, float]]:
+    """Document-at-a-time top-k retrieval with WAND dynamic pruning. Returns the same results (and scores) as
+    "parse_and_answer_ranked_query_term_at_a_time", but documents which cannot make it into the current top k
+    are skipped without being scored.
+
+    Every query term has a cursor over its postings (sorted by docID) and an upper bound of its contribution to
+    a score. The cursors are kept sorted by their current docID; the pivot is the first cursor at which the sum of
+    the upper bounds of the cursors before it (included) exceeds the score of the k-th best document so far.
+    No document before the pivot's document can beat that score, so the cursors before the pivot jump straight
+    to the pivot document (by galloping search). The top k are kept in a bounded min-heap.
+
+    Args:
+        query (str): string containing the ranked query.
+        N (int): number of unique documents in the collection.
+        pos_inverted_index (PosInvertedIndex): pos inverted index constructed from the collection.
+        pre_processor (SimplePreprocessor): pre-processor used to extract terms from the collection.
+        tokenizer (SimpleTokenizer): tokenizer used to create the pos inverted index.
+        k (int): number of results to return.
+
+    Returns:
+        The k (docID, score) pairs with the highest scores, in descending order of score (ties broken by docID).
+    """
+    tokens = tokenizer.tokenize_text_lines([query])
+    terms = [term for term in pre_processor.remove_stop_words_lowercase_and_stem(tokens) if term in pos_inverted_index]
+    if len(terms) == 0 or k <= 0:
+        return []
+
+    cursors = dict()
+    for term in terms:
+        if term in cursors:
+            continue
+        postings = pos_inverted_index[term]
+        docIDs, tfs = postings_docIDs_and_tfs(postings)
+        order = np.argsort(docIDs, kind='stable')
+        weights = (1+np.log10(tfs[order])) * np.log10(N/len(postings))
+        cursors[term] = WandCursor(docIDs[order].tolist(), weights.tolist(), terms.count(term))
+    # One entry per query term occurrence, so scores are summed in the same order as the other scorers.
+    term_cursors = [cursors[term] for term in terms]
+    active = list(cursors.values())
+
+    # Min-heap of (score, -docID): the root is the worst of the current top k (lowest score, then highest docID).
+    heap = []
+    # Upper bounds are sums of floats, allow for rounding before discarding a document.
+    epsilon = 1e-9
+
+    while True:
+        active = [cursor for cursor in active if cursor.doc() is not None]
+        if len(active) == 0:
+            break
+        active.sort(key=lambda cursor: cursor.doc())
+
+        # Documents are visited in increasing docID order, so a later document with the same score as the
+        # current k-th best would lose the tie: a document needs a strictly higher score to get in.
+        threshold = heap[0][0] if len(heap) == k else None
+        pivot = None
+        bound = 0.0
+        for idx, cursor in enumerate(active):
+            bound += cursor.upper_bound
+            if threshold is None or bound + epsilon > threshold:
+                pivot = idx
+                break
+        if pivot is None:
+            break
+
+        pivot_doc = active[pivot].doc()
+        if active[0].doc() == pivot_doc:
+            # Every cursor up to the pivot is on the pivot document: score it.
+            score = 0.0
+            for cursor in term_cursors:
+                if cursor.doc() == pivot_doc:
+                    score += cursor.weights[cursor.pos]
+            entry = (score, -pivot_doc)
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+            for cursor in active:
+                if cursor.doc() == pivot_doc:
+                    cursor.pos += 1
+        else:
+            for cursor in active[:pivot]:
+                cursor.advance_to(pivot_doc)
+
+    results = [(-neg_docID, score) for score, neg_docID in heap]
+    results.sort(key=lambda x: (-x[1], x[0]))
+    return results
+
 # -------------------------------I/O-------------------------------
 def save_pos_inverted_index(pos_inverted_index:PosInvertedIndex, file_name:str):
-    with open(file_name, 'wb') as f:
-        pickle.dump(pos_inverted_index, f)
+    """Saves the index in the delta + variable-byte compressed format (see compressed_index.py).
+    """
+    save_compressed_pos_inverted_index(pos_inverted_index, file_name)
 
-def pretty_print_pos_inverted_index(pos_inverted_index:PosInvertedIndex, file_name:str):
-    """ This method produces the file "index.txt", by saving the positional inverted index in the required format.
+def pretty_print_pos_inverted_index(pos_inverted_index:PosInvertedIndex, file_name:str, nr_workers:int=1, docID_mapping:DocIDMapping=None):
+    """ This method produces the file "index.txt", by saving the positional inverted index in the required format
+    (see text_index.py, which can also read it back).
 
     Args:
         pos_inverted_index (PosInvertedIndex): pos. inverted index to save
         file_name (str): file name, "index.txt" in our case
+        nr_workers (int): number of forked processes formatting the file
+        docID_mapping (DocIDMapping): mapping of the internal docIDs of the index, the file shows the external ones
     """
-    terms = list(pos_inverted_index.keys())
-    terms.sort()
-
-    tab = '\t'
-    
-    with open(file_name, 'w') as f:
-        for term in terms:
-            docIDs = list(pos_inverted_index[term].keys())
-            docIDs.sort()
-            
-            f.write(term + ':' + str(len(docIDs)) + '\n')
-            for docID in docIDs:
-                line = ''
-                line += tab
-                line += str(docID) + ': '
-                for position in pos_inverted_index[term][docID]:
-                    line += str(position) + ', '
-                line = line[:-2]
-                line += '\n'
-                f.write(line)
-    
+    save_text_pos_inverted_index(pos_inverted_index, file_name, nr_workers, docID_mapping.external_ids if docID_mapping is not None else None)
     return True
 
 def load_pos_inverted_index(file_name:str) -> PosInvertedIndex:
-    with open(file_name, 'rb') as f:
-        pos_inverted_index = pickle.load(f)
-    return pos_inverted_index
+    """Opens an index saved by save_pos_inverted_index. Only the term dictionary is read here,
+    the postings of each term are decoded when the term is first looked up.
+    """
+    return CompressedPosInvertedIndex(file_name)
 
 def read_queries(file_name:str) -> Dict[int, str]:
     """Read queries from the specified file (+ strip the number of the query).
@@ -431,60 +972,231 @@ def read_queries(file_name:str) -> Dict[int, str]:
     
     return queries
 
-def execute_and_write_ranked_queries(ranked_queries:Dict[int, str], docIDs:Set[str], pos_inverted_index:PosInvertedIndex, file_name:str, pre_processor:SimplePreprocessor, tokenizer:SimpleTokenizer, query_answer_limit:int):
+def create_ranked_query_answerer(docIDs:Set[str], pos_inverted_index:PosInvertedIndex, pre_processor:SimplePreprocessor, tokenizer:SimpleTokenizer, query_answer_limit:int, ranking_mode:str='term-at-a-time', impact_index:ImpactIndex=None) -> Callable[[str], List[Tuple[int, float]]]:
+    """Returns a function which answers one ranked query with its top query_answer_limit (docID, score) pairs.
+    ranking_mode is "term-at-a-time" (parse_and_answer_ranked_query_term_at_a_time), "wand" (parse_and_answer_ranked_query_wand),
+    "impact" (parse_and_answer_ranked_query_impact, with impact_index or, if None, weights computed here)
+    or "exhaustive" (parse_and_answer_ranked_query, which scores the documents one by one).
+    """
+    if ranking_mode == 'term-at-a-time':
+        dense_docIDs = create_dense_docIDs(docIDs)
+        return lambda query: parse_and_answer_ranked_query_term_at_a_time(query, dense_docIDs, pos_inverted_index, pre_processor, tokenizer, query_answer_limit)
+
+    if ranking_mode == 'impact':
+        if impact_index is None:
+            impact_index = create_impact_index(pos_inverted_index, docIDs)
+        return lambda query: parse_and_answer_ranked_query_impact(query, impact_index, pre_processor, tokenizer, query_answer_limit)
+
+    if ranking_mode == 'wand':
+        return lambda query: parse_and_answer_ranked_query_wand(query, len(docIDs), pos_inverted_index, pre_processor, tokenizer, query_answer_limit)
+
+    def answer_exhaustive(query):
+        query_answers = parse_and_answer_ranked_query(query, len(docIDs), pos_inverted_index, pre_processor, tokenizer)
+
+        # Sort documents in descending order of their tf-idf score.
+        query_answers.sort(key=lambda x: x[1], reverse=True)
+        return query_answers[:query_answer_limit]
+    return answer_exhaustive
+
+def format_ranked_query_answers(query_id:int, query_answers:List[Tuple[int, float]]) -> str:
+    return "".join(str(query_id) + ", " + str(query_answer[0]) + ", " + str(round(query_answer[1], 4)) + "\n" for query_answer in query_answers)
+
+def format_boolean_query_answers(query_id:int, query_answers:Iterable[int]) -> str:
+    return "".join(str(query_id) + ", " + str(doc_nr) + "\n" for doc_nr in sorted(query_answers))
+
+def to_external_ranked_answers(query_answers:List[Tuple[int, float]], docID_mapping:DocIDMapping) -> List[Tuple[int, float]]:
+    """Restores the external docIDs of ranked answers (ties stay in internal ID order, i.e. in indexing order).
+    """
+    if docID_mapping is None:
+        return query_answers
+    return [(docID_mapping.to_external(docID), score) for docID, score in query_answers]
+
+def to_external_boolean_answers(query_answers:AbstractSet[int], docID_mapping:DocIDMapping) -> AbstractSet[int]:
+    if docID_mapping is None:
+        return query_answers
+    return docID_mapping.to_external_ids(query_answers)
+
+def execute_and_write_ranked_queries(ranked_queries:Dict[int, str], docIDs:Set[str], pos_inverted_index:PosInvertedIndex, file_name:str, pre_processor:SimplePreprocessor, tokenizer:SimpleTokenizer, query_answer_limit:int, ranking_mode:str='term-at-a-time', impact_index:ImpactIndex=None, docID_mapping:DocIDMapping=None):
+    """Answers the ranked queries and writes their top query_answer_limit results (see create_ranked_query_answerer for ranking_mode).
+    With a docID_mapping, the index uses internal docIDs and the results are written with the external ones.
+    """
+    answer_ranked_query = create_ranked_query_answerer(docIDs, pos_inverted_index, pre_processor, tokenizer, query_answer_limit, ranking_mode, impact_index)
+
     with open(file_name, 'w') as f:
         for query_id in ranked_queries:
-            query_answers = parse_and_answer_ranked_query(ranked_queries[query_id], len(docIDs), pos_inverted_index, pre_processor, tokenizer)
-            
-            if len(query_answers) == 0:
-                continue
-            
-            # Sort documents in descending order of their tf-idf score.
-            query_answers.sort(key=lambda x: x[1], reverse=True)
-
-            for query_answer in query_answers[:query_answer_limit]:
-                f.write(str(query_id) + ", " + str(query_answer[0]) + ", " + str(round(query_answer[1], 4)) + "\n")
+            query_answers = answer_ranked_query(ranked_queries[query_id])
+            f.write(format_ranked_query_answers(query_id, to_external_ranked_answers(query_answers, docID_mapping)))
 
 
-def execute_and_write_boolean_queries(boolean_queries:Dict[int, str], docIDs:Set[str], pos_inverted_index:PosInvertedIndex, file_name:str, pre_processor:SimplePreprocessor):
+def execute_and_write_boolean_queries(boolean_queries:Dict[int, str], docIDs:Set[str], pos_inverted_index:PosInvertedIndex, file_name:str, pre_processor:SimplePreprocessor, result_cache:QueryResultCache=None, docID_mapping:DocIDMapping=None):
     with open(file_name, 'w') as f:
         for query_id in boolean_queries:
-            query_answers = parse_and_answer_boolean_query(boolean_queries[query_id], docIDs, pos_inverted_index, pre_processor)
-            query_answers = list(query_answers)
-            query_answers.sort()
-
-            for doc_nr in query_answers:
-                line = str(query_id) + ", " + str(doc_nr) + "\n"
-                f.write(line)
-
-# Hardcoded assignment variables:
-stopwords_file_name = "englishST.txt"
-boolean_queries_file_name = "queries.boolean.txt"
-ranked_queries_file_name = "queries.ranked.txt"
-input_trec_file_name = "trec.sample.xml"
-
-index_output_file_name = "index.txt"
-boolean_queries_output_file_name = "results.boolean.txt"
-ranked_queries_output_file_name = "results.ranked.txt"
-
-# Read the stop words set, initialise the preprocessor, tokenizer and stemmer.
-stopwords_set = construct_stopwords_set(stopwords_file_name)
-tokenizer = SimpleTokenizer('[a-zA-Z0-9]+')
-stemmer = PorterStemmer()
-pre_processor = SimplePreprocessor(tokenizer, stopwords_set, stemmer)
-
-# Create pos inverted index and the set of document IDs.
-pos_inverted_index, docId_set = read_input_trec_file_and_create_index_and_docId_set(input_trec_file_name, pre_processor)
-
-# Pickle pos inverted index and also create "index.txt".
-save_pos_inverted_index(pos_inverted_index, 'pos_inverted_index.pkl')
-pretty_print_pos_inverted_index(pos_inverted_index, index_output_file_name)
-
-# Read boolean queries, execute them and write the results.
-boolean_queries = read_queries(boolean_queries_file_name)
-execute_and_write_boolean_queries(boolean_queries, docId_set, pos_inverted_index, boolean_queries_output_file_name, pre_processor)
-
-# Read ranked queries, execute them and write the results.
-query_answer_limit = 150
-ranked_queries = read_queries(ranked_queries_file_name)
-execute_and_write_ranked_queries(ranked_queries, docId_set, pos_inverted_index, ranked_queries_output_file_name, pre_processor, tokenizer, query_answer_limit)
\ No newline at end of file
+            query_answers = parse_and_answer_boolean_query(boolean_queries[query_id], docIDs, pos_inverted_index, pre_processor, result_cache)
+            f.write(format_boolean_query_answers(query_id, to_external_boolean_answers(query_answers, docID_mapping)))
+
+# ----------------------------PARALLEL query execution----------------------------
+# The function answering a single query (query_id, query) -> result lines, set by execute_and_write_queries_in_parallel
+# right before it creates its pool. The workers are forked, so they inherit it together with the index it refers to:
+# the index is shared copy-on-write (or through the page cache for a MmapPosInvertedIndex) instead of being pickled
+# and sent with every task. Only the (query_id, query) chunks and the formatted result lines cross process boundaries.
+#
+# Note that CPython writes reference counts into the objects it touches, so the pages of a dictionary-based index
+# which a worker reads are gradually copied into it; the compact and memory-mapped indices keep their postings in flat
+# buffers and stay shared.
+batch_query_answerer = None
+
+def answer_query_chunk(chunk:List[Tuple[int, str]]) -> str:
+    """Runs in a worker: answers a chunk of (query_id, query) pairs and returns their result lines.
+    """
+    return "".join(batch_query_answerer(query_id, query) for query_id, query in chunk)
+
+def execute_and_write_queries_in_parallel(queries:Dict[int, str], answer_query:Callable[[int, str], str], file_name:str, nr_workers:int, chunk_size:int=16) -> float:
+    """Answers the queries with a pool of nr_workers forked processes and writes the result lines in query-id order.
+
+    Args:
+        queries (Dict[int, str]): query_id -> query, as returned by read_queries.
+        answer_query (Callable[[int, str], str]): answers one query and formats its results (query_id, query) -> lines.
+        file_name (str): output file.
+        nr_workers (int): number of worker processes.
+        chunk_size (int): number of queries sent to a worker at a time.
+
+    Returns:
+        float: throughput, in queries per second.
+    """
+    global batch_query_answerer
+
+    query_ids = sorted(queries.keys())
+    chunks = [[(query_id, queries[query_id]) for query_id in query_ids[ii:ii+chunk_size]] for ii in range(0, len(query_ids), chunk_size)]
+
+    ts = perf_counter()
+    batch_query_answerer = answer_query
+    try:
+        # imap returns the chunks in the order they were submitted, so the results can be written as they arrive.
+        with mp.get_context('fork').Pool(nr_workers) as pool, open(file_name, 'w') as f:
+            for chunk_lines in pool.imap(answer_query_chunk, chunks):
+                f.write(chunk_lines)
+    finally:
+        batch_query_answerer = None
+    elapsed = perf_counter() - ts
+
+    return len(query_ids) / elapsed if elapsed > 0 else float('inf')
+
+def execute_and_write_boolean_queries_in_parallel(boolean_queries:Dict[int, str], docIDs:Set[str], pos_inverted_index:PosInvertedIndex, file_name:str, pre_processor:SimplePreprocessor, nr_workers:int, chunk_size:int=16, result_cache:QueryResultCache=None, docID_mapping:DocIDMapping=None) -> float:
+    """Parallel version of execute_and_write_boolean_queries, returns the throughput in queries per second.
+    Every worker fills its own copy of result_cache.
+    """
+    answer_query = lambda query_id, query: format_boolean_query_answers(query_id, to_external_boolean_answers(parse_and_answer_boolean_query(query, docIDs, pos_inverted_index, pre_processor, result_cache), docID_mapping))
+    return execute_and_write_queries_in_parallel(boolean_queries, answer_query, file_name, nr_workers, chunk_size)
+
+def execute_and_write_ranked_queries_in_parallel(ranked_queries:Dict[int, str], docIDs:Set[str], pos_inverted_index:PosInvertedIndex, file_name:str, pre_processor:SimplePreprocessor, tokenizer:SimpleTokenizer, query_answer_limit:int, nr_workers:int, ranking_mode:str='term-at-a-time', impact_index:ImpactIndex=None, chunk_size:int=16, docID_mapping:DocIDMapping=None) -> float:
+    """Parallel version of execute_and_write_ranked_queries, returns the throughput in queries per second.
+    """
+    # Built once in the parent (dense docIDs, impact weights), so the workers inherit it instead of each building its own.
+    answer_ranked_query = create_ranked_query_answerer(docIDs, pos_inverted_index, pre_processor, tokenizer, query_answer_limit, ranking_mode, impact_index)
+    answer_query = lambda query_id, query: format_ranked_query_answers(query_id, to_external_ranked_answers(answer_ranked_query(query), docID_mapping))
+    return execute_and_write_queries_in_parallel(ranked_queries, answer_query, file_name, nr_workers, chunk_size)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--compact-index', action='store_true', help="Keep the positional inverted index in flat arrays instead of nested dictionaries.")
+parser.add_argument('--save-mmap-index', type=str, default=None, help="Also save the index in the memory-mapped format, to this file.")
+parser.add_argument('--mmap-index', type=str, default=None, help="Answer the queries from this prebuilt memory-mapped index instead of indexing the trec file.")
+parser.add_argument('--ranking-mode', type=str, default='term-at-a-time', choices=['term-at-a-time', 'wand', 'impact', 'exhaustive'], help="How ranked queries are scored.")
+parser.add_argument('--quantise-impacts', action='store_true', help="Store the precomputed tf-idf weights as uint8.")
+parser.add_argument('--bitmap-sets', action='store_true', help="Evaluate the boolean queries on compressed docID bitmaps (cheaper NOT and OR of frequent terms).")
+parser.add_argument('--result-cache-mb', type=float, default=64, help="Memory budget of the LRU cache of term / phrase / proximity results used by the boolean queries (0 disables it).")
+parser.add_argument('--index-txt-workers', type=int, default=1, help="Number of forked processes formatting index.txt.")
+parser.add_argument('--workers', type=int, default=1, help="Answer the queries with this many forked worker processes (results are written in query-id order).")
+parser.add_argument('--profile-build', type=str, default=None, help="Time each stage of the index build and save the report (JSON) to this file.")
+parser.add_argument('--dense-docids', action='store_true', help="Index the documents under internal IDs 0..N-1; the mapping to the DOCNOs is saved next to the index files.")
+
+if __name__ == '__main__':
+    # Hardcoded assignment variables:
+    stopwords_file_name = "englishST.txt"
+    boolean_queries_file_name = "queries.boolean.txt"
+    ranked_queries_file_name = "queries.ranked.txt"
+    input_trec_file_name = "trec.sample.xml"
+
+    index_output_file_name = "index.txt"
+    boolean_queries_output_file_name = "results.boolean.txt"
+    ranked_queries_output_file_name = "results.ranked.txt"
+
+    args = parser.parse_args()
+
+    # Read the stop words set, initialise the preprocessor, tokenizer and stemmer.
+    stopwords_set = construct_stopwords_set(stopwords_file_name)
+    tokenizer = SimpleTokenizer('[a-zA-Z0-9]+')
+    stemmer = PorterStemmer()
+    pre_processor = SimplePreprocessor(tokenizer, stopwords_set, stemmer)
+
+    if args.mmap_index is not None:
+        # Map the prebuilt index, nothing is read from it until the queries look up their terms.
+        pos_inverted_index = MmapPosInvertedIndex(args.mmap_index)
+        docId_set = pos_inverted_index.all_docIDs()
+
+        # The index was built with internal docIDs if their mapping was saved next to it.
+        docID_mapping = None
+        if os.path.exists(docid_mapping_file_name(args.mmap_index)):
+            docID_mapping = DocIDMapping.load(docid_mapping_file_name(args.mmap_index))
+
+        # Use the weights saved next to the index only if they were computed for it, otherwise they are computed here.
+        impact_index = None
+        if args.ranking_mode == 'impact':
+            impact_weights_file = impact_weights_file_name(args.mmap_index)
+            if os.path.exists(impact_weights_file):
+                impact_index = ImpactIndex.load(impact_weights_file)
+                if not impact_index.matches(len(docId_set), len(pos_inverted_index), docID_mapping is not None):
+                    print('Ignoring %s: it was not computed for this index, the weights are computed from the index.' % impact_weights_file)
+                    impact_index = None
+    else:
+        # Create pos inverted index and the set of document IDs.
+        docID_mapping = DocIDMapping() if args.dense_docids else None
+        profiler = BuildProfiler() if args.profile_build is not None else None
+        pos_inverted_index, docId_set = read_input_trec_file_and_create_index_and_docId_set(input_trec_file_name, pre_processor, args.compact_index, docID_mapping, profiler)
+
+        # Save pos inverted index and also create "index.txt".
+        with profiled_stage(profiler, 'index_save'):
+            save_pos_inverted_index(pos_inverted_index, 'pos_inverted_index.idx')
+        with profiled_stage(profiler, 'index_txt'):
+            pretty_print_pos_inverted_index(pos_inverted_index, index_output_file_name, args.index_txt_workers, docID_mapping)
+        if args.save_mmap_index is not None:
+            with profiled_stage(profiler, 'mmap_index_save'):
+                save_mmap_pos_inverted_index(pos_inverted_index, docId_set, args.save_mmap_index)
+
+        # Save the docID mapping next to the saved indices (and remove stale ones, the indices now use DOCNOs).
+        saved_index_file_names = ['pos_inverted_index.idx'] + ([args.save_mmap_index] if args.save_mmap_index is not None else [])
+        for index_file_name in saved_index_file_names:
+            if docID_mapping is not None:
+                docID_mapping.save(docid_mapping_file_name(index_file_name))
+            elif os.path.exists(docid_mapping_file_name(index_file_name)):
+                os.remove(docid_mapping_file_name(index_file_name))
+
+        # Precompute the idf of every term and the tf-idf weight of every posting, saved next to the saved indices.
+        with profiled_stage(profiler, 'impact_index'):
+            impact_index = create_impact_index(pos_inverted_index, docId_set, args.quantise_impacts, docID_mapping is not None)
+            for index_file_name in saved_index_file_names:
+                impact_index.save(impact_weights_file_name(index_file_name))
+
+        if profiler is not None:
+            profiler.count('stem_cache_misses', pre_processor.stem_cache_misses)
+            print(BuildProfiler.format_report(profiler.save_json(args.profile_build)))
+
+    # Read boolean queries, execute them and write the results.
+    boolean_queries = read_queries(boolean_queries_file_name)
+    result_cache = QueryResultCache(int(args.result_cache_mb * 1024 * 1024)) if args.result_cache_mb > 0 else None
+    boolean_docId_set = DocIDBitmap.from_iterable(docId_set) if args.bitmap_sets else docId_set
+    if args.workers > 1:
+        throughput = execute_and_write_boolean_queries_in_parallel(boolean_queries, boolean_docId_set, pos_inverted_index, boolean_queries_output_file_name, pre_processor, args.workers, result_cache=result_cache, docID_mapping=docID_mapping)
+        print('Boolean queries: %.1f queries/s with %d workers' % (throughput, args.workers))
+    else:
+        execute_and_write_boolean_queries(boolean_queries, boolean_docId_set, pos_inverted_index, boolean_queries_output_file_name, pre_processor, result_cache, docID_mapping)
+        if result_cache is not None:
+            print('Result cache: %(hits)d hits, %(misses)d misses (hit rate %(hit_rate).2f), %(entries)d entries, %(bytes)d / %(max_bytes)d bytes, %(evictions)d evictions' % result_cache.stats())
+
+    # Read ranked queries, execute them and write the results.
+    query_answer_limit = 150
+    ranked_queries = read_queries(ranked_queries_file_name)
+    if args.workers > 1:
+        throughput = execute_and_write_ranked_queries_in_parallel(ranked_queries, docId_set, pos_inverted_index, ranked_queries_output_file_name, pre_processor, tokenizer, query_answer_limit, args.workers, args.ranking_mode, impact_index, docID_mapping=docID_mapping)
+        print('Ranked queries: %.1f queries/s with %d workers' % (throughput, args.workers))
+    else:
+        execute_and_write_ranked_queries(ranked_queries, docId_set, pos_inverted_index, ranked_queries_output_file_name, pre_processor, tokenizer, query_answer_limit, args.ranking_mode, impact_index, docID_mapping)
@@ -0,0 +1,180 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+# Compact alternative to the Dict[str, Dict[int, List[int]]] positional inverted index.
+#
+# For every term we keep:
+#   - a sorted array('I') of the docIDs which contain the term;
+#   - an array('I') of offsets (len(docIDs) + 1 entries), relative to the start of the term's positions;
+#   - the start of the term's positions in a single array('I') shared by all terms.
+# The positions of term t in the i-th document of its postings list are
+# positions[start + offsets[i] : start + offsets[i+1]].
+#
+# CompactPosInvertedIndex and CompactPostings implement the read-only Mapping protocol,
+# so the search functions which expect a PosInvertedIndex can use them directly:
+# "term in index", index[term].keys(), index[term][docID], docID in index[term], len(index[term]).
+
+class CompactPostings(Mapping):
+    """Read-only view over the postings of a single term. Behaves like Dict[int, array('I')].
+    """
+    __slots__ = ('docIDs', 'offsets', 'start', 'positions')
+
+    def __init__(self, docIDs:array, offsets:array, start:int, positions:array):
+        self.docIDs = docIDs
+        self.offsets = offsets
+        self.start = start
+        self.positions = positions
+
+    def find(self, docID:int) -> int:
+        """Returns the index of docID in the postings list, or -1 if the term does not appear in docID.
+        """
+        idx = bisect_left(self.docIDs, docID)
+        if idx < len(self.docIDs) and self.docIDs[idx] == docID:
+            return idx
+        return -1
+
+    def __getitem__(self, docID:int) -> array:
+        idx = self.find(docID)
+        if idx == -1:
+            raise KeyError(docID)
+        return self.positions[self.start + self.offsets[idx] : self.start + self.offsets[idx+1]]
+
+    def __contains__(self, docID) -> bool:
+        return self.find(docID) != -1
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.docIDs)
+
+    def __len__(self) -> int:
+        return len(self.docIDs)
+
+    def term_frequency(self, docID:int) -> int:
+        """Number of positions of the term in docID, without copying them out of the positions array.
+        """
+        idx = self.find(docID)
+        if idx == -1:
+            return 0
+        return self.offsets[idx+1] - self.offsets[idx]
+
+
+class CompactPosInvertedIndex(Mapping):
+    """Read-only positional inverted index backed by flat arrays. Behaves like Dict[str, Dict[int, List[int]]].
+    """
+    def __init__(self, terms:Dict[str, Tuple[array, array, int]], positions:array):
+        self.terms = terms
+        self.positions = positions
+
+    @staticmethod
+    def from_pos_inverted_index(pos_inverted_index:Dict[str, Dict[int, List[int]]]) -> 'CompactPosInvertedIndex':
+        """Converts a dictionary-based positional inverted index to its compact representation.
+        """
+        terms = dict()
+        positions = array('I')
+
+        for term in pos_inverted_index:
+            docIDs = array('I', sorted(pos_inverted_index[term].keys()))
+            offsets = array('I', [0])
+            start = len(positions)
+            for docID in docIDs:
+                positions.extend(pos_inverted_index[term][docID])
+                offsets.append(len(positions) - start)
+            terms[term] = (docIDs, offsets, start)
+
+        return CompactPosInvertedIndex(terms, positions)
+
+    def __getitem__(self, term:str) -> CompactPostings:
+        docIDs, offsets, start = self.terms[term]
+        return CompactPostings(docIDs, offsets, start, self.positions)
+
+    def __contains__(self, term) -> bool:
+        return term in self.terms
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.terms)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def nbytes(self) -> int:
+        """Size in bytes of the docID, offset and position buffers (excludes the term dictionary itself).
+        """
+        total = self.positions.itemsize * len(self.positions)
+        for docIDs, offsets, _ in self.terms.values():
+            total += docIDs.itemsize * len(docIDs) + offsets.itemsize * len(offsets)
+        return total
+
+
+class CompactIndexBuilder():
+    """Builds a CompactPosInvertedIndex one document at a time, without going through the dictionary representation.
+    """
+    def __init__(self):
+        # term -> (docIDs, offsets, positions), each an array('I') which grows as documents are added.
+        self.postings = dict()
+        self.sorted = True
+        self.last_docID = -1
+
+    def add_document(self, docID:int, tokens:Iterable[str]):
+        """Adds the tokens of document docID to the index. Token positions are their indices in "tokens",
+        which can be a list or a generator (e.g. SimplePreprocessor.iterate_processed_tokens).
+        """
+        if docID <= self.last_docID:
+            self.sorted = False
+        self.last_docID = max(docID, self.last_docID)
+
+        # Group the positions by term, so that each term gets one posting for this document.
+        doc_positions = dict()
+        for index, token in enumerate(tokens):
+            if token in doc_positions:
+                doc_positions[token].append(index)
+            else:
+                doc_positions[token] = [index]
+
+        for term, term_positions in doc_positions.items():
+            if term not in self.postings:
+                self.postings[term] = (array('I'), array('I', [0]), array('I'))
+            docIDs, offsets, positions = self.postings[term]
+            docIDs.append(docID)
+            positions.extend(term_positions)
+            offsets.append(len(positions))
+
+    def build(self) -> CompactPosInvertedIndex:
+        """Concatenates the per-term positions into a single array and returns the finished index.
+        The builder should not be used afterwards.
+        """
+        terms = dict()
+        all_positions = array('I')
+
+        for term in list(self.postings.keys()):
+            docIDs, offsets, positions = self.postings.pop(term)
+            if not self.sorted:
+                docIDs, offsets, positions = CompactIndexBuilder.sort_postings(docIDs, offsets, positions)
+            start = len(all_positions)
+            all_positions.extend(positions)
+            terms[term] = (docIDs, offsets, start)
+
+        return CompactPosInvertedIndex(terms, all_positions)
+
+    @staticmethod
+    def sort_postings(docIDs:array, offsets:array, positions:array) -> Tuple[array, array, array]:
+        """Reorders the postings of a term by docID (only needed if documents were not added in docID order).
+        The postings of a document added more than once (a DOCNO repeated in the collection) are merged into one,
+        with the positions of all of them in increasing order.
+        """
+        order = sorted(range(len(docIDs)), key=lambda i: docIDs[i])
+        sorted_docIDs = array('I')
+        sorted_offsets = array('I', [0])
+        sorted_positions = array('I')
+        for i in order:
+            if len(sorted_docIDs) > 0 and sorted_docIDs[-1] == docIDs[i]:
+                start = sorted_offsets[-2]
+                merged_positions = sorted(sorted_positions[start:] + positions[offsets[i]:offsets[i+1]])
+                del sorted_positions[start:]
+                sorted_positions.extend(merged_positions)
+                sorted_offsets[-1] = len(sorted_positions)
+                continue
+            sorted_docIDs.append(docIDs[i])
+            sorted_positions.extend(positions[offsets[i]:offsets[i+1]])
+            sorted_offsets.append(len(sorted_positions))
+        return sorted_docIDs, sorted_offsets, sorted_positions
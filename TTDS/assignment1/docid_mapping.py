@@ -0,0 +1,71 @@
+import os
+import struct
+from array import array
+from typing import Iterable, List
+from compressed_index import IndexFormatError
+
+# Mapping between the document IDs of the collection (DOCNO, arbitrary ints) and dense internal IDs 0..N-1.
+#
+# Internal IDs are assigned in the order the documents are indexed. An index built with internal IDs can keep its
+# postings in flat arrays, and a score accumulator can be a NumPy array indexed directly by docID. The external IDs
+# are only restored when the results are written.
+#
+# File layout: magic (4 bytes) | version (uint32) | N (uint64) | external IDs (int64[N], in internal ID order).
+
+MAGIC = b'DIDM'
+VERSION = 1
+HEADER = struct.Struct('<4sIQ')
+
+def docid_mapping_file_name(index_file_name:str) -> str:
+    """File holding the docID mapping of an index: pos_inverted_index.idx -> pos_inverted_index.docids.
+    """
+    return os.path.splitext(index_file_name)[0] + '.docids'
+
+class DocIDMapping():
+    def __init__(self, external_ids:array=None):
+        """
+        Args:
+            external_ids (array): array('q') of the external ID of each internal ID.
+        """
+        self.external_ids = array('q') if external_ids is None else external_ids
+        self.internal_ids = {external_id: internal_id for internal_id, external_id in enumerate(self.external_ids)}
+
+    def add(self, external_id:int) -> int:
+        """Returns the internal ID of the document, assigning the next one if it is new.
+        """
+        internal_id = self.internal_ids.get(external_id)
+        if internal_id is None:
+            internal_id = len(self.external_ids)
+            self.internal_ids[external_id] = internal_id
+            self.external_ids.append(external_id)
+        return internal_id
+
+    def to_internal(self, external_id:int) -> int:
+        return self.internal_ids[external_id]
+
+    def to_external(self, internal_id:int) -> int:
+        return self.external_ids[internal_id]
+
+    def to_external_ids(self, internal_ids:Iterable[int]) -> List[int]:
+        external_ids = self.external_ids
+        return [external_ids[internal_id] for internal_id in internal_ids]
+
+    def __len__(self) -> int:
+        return len(self.external_ids)
+
+    def save(self, file_name:str):
+        with open(file_name, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.external_ids)))
+            f.write(self.external_ids.tobytes())
+
+    @staticmethod
+    def load(file_name:str) -> 'DocIDMapping':
+        with open(file_name, 'rb') as f:
+            magic, version, nr_docs = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise IndexFormatError('%s is not a docID mapping.' % file_name)
+            if version != VERSION:
+                raise IndexFormatError('%s is a docID mapping of version %d, version %d is supported.' % (file_name, version, VERSION))
+            external_ids = array('q')
+            external_ids.frombytes(f.read(8 * nr_docs))
+        return DocIDMapping(external_ids)
@@ -0,0 +1,187 @@
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Set, Union
+
+# Positional inverted index which can be kept up to date document by document (e.g. from a news feed),
+# instead of being rebuilt from scratch.
+#
+# Postings are stored like the dictionary-based index, term -> {docID: positions}. The positions of a document
+# are appended in increasing order as it is added, so they never need sorting afterwards. A forward index,
+# docID -> terms of the document, makes it possible to find the postings of a document again.
+#
+# Deleting a document only marks it with a tombstone: its docID is removed from the set of live documents and
+# its terms are marked as dirty. Looking up a dirty term returns its postings without the deleted documents, filtered
+# once and cached until a document of the term is added or deleted again (the query evaluators look the same terms up
+# many times); every other term is returned as stored, without copying. The postings of deleted documents are removed by
+# compact(), which runs automatically once the tombstones exceed compaction_ratio of the live documents.
+# Updating a document deletes it and adds it again; if it was already deleted, its old postings are removed first.
+
+class DynamicPosInvertedIndex(Mapping):
+    """Positional inverted index supporting add_document, update_document and delete_document.
+    Behaves like a read-only Dict[str, Dict[int, List[int]]] of the live documents, so it can be passed to the
+    search functions like any other PosInvertedIndex. Caches of query results (e.g. QueryResultCache) must be
+    cleared after the index is modified.
+    """
+    def __init__(self, compaction_ratio:float=0.2):
+        """
+        Args:
+            compaction_ratio (float): compact the index once the number of deleted (but not yet removed)
+            documents exceeds this fraction of the live documents.
+        """
+        self.postings = dict()
+        self.doc_terms = dict()
+        self.docIDs = set()
+        self.tombstones = set()
+        self.dirty_terms = set()
+        self.compaction_ratio = compaction_ratio
+
+        # Dirty term -> its postings without the deleted documents (None if there are none left).
+        self.live_postings_cache = dict()
+        # Number of terms with live documents, None until it is counted again after a modification.
+        self.nr_live_terms = None
+
+    @staticmethod
+    def from_pos_inverted_index(pos_inverted_index:Mapping, docId_set:Iterable[int]=None, compaction_ratio:float=0.2) -> 'DynamicPosInvertedIndex':
+        """Builds a dynamic index from any positional inverted index representation.
+        docId_set should be the set of all the documents of the index: documents without any term do not appear in the
+        postings, and would not be counted in all_docIDs otherwise.
+        """
+        dynamic_index = DynamicPosInvertedIndex(compaction_ratio)
+        doc_terms = dict()
+        for term in pos_inverted_index:
+            term_postings = dict()
+            for docID, positions in pos_inverted_index[term].items():
+                term_postings[docID] = list(positions)
+                if docID in doc_terms:
+                    doc_terms[docID].append(term)
+                else:
+                    doc_terms[docID] = [term]
+            dynamic_index.postings[term] = term_postings
+
+        if docId_set is not None:
+            for docID in docId_set:
+                if docID not in doc_terms:
+                    doc_terms[docID] = []
+
+        dynamic_index.doc_terms = doc_terms
+        dynamic_index.docIDs = set(doc_terms.keys())
+        return dynamic_index
+
+    def add_document(self, docID:int, tokens:Iterable[str]):
+        """Adds a new document. Token positions are their indices in "tokens" (a list or a generator).
+        """
+        if docID in self.docIDs:
+            raise Exception('Document %d is already in the index, use update_document to replace it.' % docID)
+        if docID in self.tombstones:
+            self.remove_postings([docID])
+
+        doc_postings = dict()
+        for index, token in enumerate(tokens):
+            if token in doc_postings:
+                doc_postings[token].append(index)
+            else:
+                doc_postings[token] = [index]
+
+        for term, positions in doc_postings.items():
+            if term in self.postings:
+                self.postings[term][docID] = positions
+            else:
+                self.postings[term] = {docID: positions}
+
+        self.doc_terms[docID] = list(doc_postings.keys())
+        self.docIDs.add(docID)
+        self.invalidate_terms(self.doc_terms[docID])
+
+    def delete_document(self, docID:int):
+        """Marks the document as deleted. Its postings are removed by the next compaction.
+        """
+        if docID not in self.docIDs:
+            raise KeyError(docID)
+        self.add_tombstone(docID)
+
+        if len(self.tombstones) > self.compaction_ratio * len(self.docIDs):
+            self.compact()
+
+    def update_document(self, docID:int, tokens:Iterable[str]):
+        """Replaces the contents of a document (or adds it if it is not in the index).
+        """
+        if docID in self.docIDs:
+            self.add_tombstone(docID)
+        self.add_document(docID, tokens)
+
+    def add_tombstone(self, docID:int):
+        self.docIDs.remove(docID)
+        self.tombstones.add(docID)
+        self.dirty_terms.update(self.doc_terms[docID])
+        self.invalidate_terms(self.doc_terms[docID])
+
+    def invalidate_terms(self, terms:Iterable[str]):
+        """Drops the cached live postings of terms whose documents changed.
+        """
+        for term in terms:
+            self.live_postings_cache.pop(term, None)
+        self.nr_live_terms = None
+
+    def remove_postings(self, docIDs:List[int]):
+        """Removes the postings of deleted documents, and the terms left without postings.
+        """
+        for docID in docIDs:
+            terms = self.doc_terms.pop(docID)
+            for term in terms:
+                term_postings = self.postings[term]
+                del term_postings[docID]
+                if len(term_postings) == 0:
+                    del self.postings[term]
+            self.tombstones.remove(docID)
+            self.invalidate_terms(terms)
+
+        if len(self.tombstones) == 0:
+            self.dirty_terms.clear()
+            self.live_postings_cache.clear()
+
+    def compact(self):
+        """Removes the postings of all the deleted documents.
+        """
+        self.remove_postings(list(self.tombstones))
+
+    def all_docIDs(self) -> Set[int]:
+        return self.docIDs
+
+    def live_postings(self, term:str) -> Union[Dict[int, List[int]], None]:
+        """Postings of a dirty term without the deleted documents, or None if only deleted documents are left.
+        """
+        if term in self.live_postings_cache:
+            return self.live_postings_cache[term]
+        live_postings = {docID: positions for docID, positions in self.postings[term].items() if docID not in self.tombstones}
+        if len(live_postings) == 0:
+            live_postings = None
+        self.live_postings_cache[term] = live_postings
+        return live_postings
+
+    def __getitem__(self, term:str) -> Dict[int, List[int]]:
+        term_postings = self.postings[term]
+        if term not in self.dirty_terms:
+            return term_postings
+
+        live_postings = self.live_postings(term)
+        if live_postings is None:
+            raise KeyError(term)
+        return live_postings
+
+    def __contains__(self, term) -> bool:
+        if term not in self.postings:
+            return False
+        if term not in self.dirty_terms:
+            return True
+        return self.live_postings(term) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for term in self.postings:
+            if term in self:
+                yield term
+
+    def __len__(self) -> int:
+        if len(self.dirty_terms) == 0:
+            return len(self.postings)
+        if self.nr_live_terms is None:
+            self.nr_live_terms = sum(1 for _ in self)
+        return self.nr_live_terms
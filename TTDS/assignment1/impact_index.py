@@ -0,0 +1,106 @@
+import os
+import numpy as np
+from typing import Dict, List, Tuple, Union
+
+# Precomputed ranking data for the positional inverted index ("impact-ordered" postings).
+#
+# For every term we store its idf, log10(N/df), and for every posting the full tf-idf weight of the term in
+# the document, (1+log10(tf)) * idf, next to the dense ID of the document (its index in the sorted array of
+# all docIDs). Answering a ranked query then only adds precomputed weights into an accumulator.
+#
+# The weights can optionally be quantised to uint8: weight ~= quantised_weight * scale, with
+# scale = max weight / 255. Scores are then summed as integers and only multiplied by the scale at the end,
+# at the cost of approximate scores (and ranking) for a 8x smaller weight table.
+#
+# The weights are saved next to the index they were computed from (impact_weights_file_name), together with the
+# number of documents and terms of the index and whether it uses internal docIDs, which matches checks when the
+# weights are loaded for an index.
+
+def impact_weights_file_name(index_file_name:str) -> str:
+    """File holding the precomputed weights of an index: pos_inverted_index.idx -> pos_inverted_index.impacts.npz.
+    """
+    return os.path.splitext(index_file_name)[0] + '.impacts.npz'
+
+class ImpactIndex():
+    def __init__(self, dense_docIDs:np.ndarray, terms:Dict[str, Tuple[int, int, float]], dense_ids:np.ndarray, impacts:np.ndarray, scale:Union[float, None], internal_docIDs:bool=False):
+        """
+        Args:
+            dense_docIDs (np.ndarray): sorted array of all the docIDs of the collection.
+            terms (Dict[str, Tuple[int, int, float]]): term -> (start, end, idf); the postings of the term are dense_ids[start:end].
+            dense_ids (np.ndarray): dense IDs of the postings of all the terms, concatenated.
+            impacts (np.ndarray): float64 tf-idf weights aligned with dense_ids, or uint8 if quantised.
+            scale (Union[float, None]): quantisation step of uint8 impacts, None if the impacts are not quantised.
+            internal_docIDs (bool): whether the index was built with internal docIDs (code.py --dense-docids).
+        """
+        self.dense_docIDs = dense_docIDs
+        self.terms = terms
+        self.dense_ids = dense_ids
+        self.impacts = impacts
+        self.scale = scale
+        self.internal_docIDs = internal_docIDs
+
+    @staticmethod
+    def from_term_weights(dense_docIDs:np.ndarray, term_weights:List[Tuple[str, float, np.ndarray, np.ndarray]], quantise:bool=False, internal_docIDs:bool=False) -> 'ImpactIndex':
+        """Builds the index from (term, idf, dense_ids, weights) tuples.
+        """
+        terms = dict()
+        start = 0
+        for term, idf, term_dense_ids, _ in term_weights:
+            terms[term] = (start, start + len(term_dense_ids), idf)
+            start += len(term_dense_ids)
+
+        dense_ids = np.concatenate([x[2] for x in term_weights]).astype(np.int32) if len(term_weights) > 0 else np.zeros(0, dtype=np.int32)
+        impacts = np.concatenate([x[3] for x in term_weights]).astype(np.float64) if len(term_weights) > 0 else np.zeros(0, dtype=np.float64)
+
+        scale = None
+        if quantise:
+            max_impact = impacts.max() if len(impacts) > 0 else 0.0
+            scale = max_impact / 255 if max_impact > 0 else 1.0
+            impacts = np.rint(impacts / scale).astype(np.uint8)
+
+        return ImpactIndex(dense_docIDs, terms, dense_ids, impacts, scale, internal_docIDs)
+
+    def matches(self, nr_docs:int, nr_terms:int, internal_docIDs:bool) -> bool:
+        """Whether the weights were computed for an index of nr_docs documents and nr_terms terms, built with
+        (or without) internal docIDs.
+        """
+        return len(self.dense_docIDs) == nr_docs and len(self.terms) == nr_terms and self.internal_docIDs == internal_docIDs
+
+    def idf(self, term:str) -> float:
+        return self.terms[term][2] if term in self.terms else 0.0
+
+    def __contains__(self, term:str) -> bool:
+        return term in self.terms
+
+    def term_impacts(self, term:str) -> Tuple[np.ndarray, np.ndarray]:
+        """Dense IDs of the documents containing the term and the (possibly quantised) weight of the term in each of them.
+        """
+        start, end, _ = self.terms[term]
+        return self.dense_ids[start:end], self.impacts[start:end]
+
+    def save(self, file_name:str):
+        terms = list(self.terms.keys())
+        with open(file_name, 'wb') as f:
+            np.savez(f,
+                     dense_docIDs=self.dense_docIDs,
+                     terms=np.array(terms, dtype=str),
+                     starts=np.array([self.terms[term][0] for term in terms], dtype=np.int64),
+                     ends=np.array([self.terms[term][1] for term in terms], dtype=np.int64),
+                     idfs=np.array([self.terms[term][2] for term in terms], dtype=np.float64),
+                     dense_ids=self.dense_ids,
+                     impacts=self.impacts,
+                     scale=np.array([-1.0 if self.scale is None else self.scale]),
+                     nr_docs=np.array([len(self.dense_docIDs)], dtype=np.int64),
+                     nr_terms=np.array([len(terms)], dtype=np.int64),
+                     internal_docIDs=np.array([self.internal_docIDs]))
+
+    @staticmethod
+    def load(file_name:str) -> 'ImpactIndex':
+        with np.load(file_name) as data:
+            if 'nr_docs' not in data or 'nr_terms' not in data or 'internal_docIDs' not in data:
+                raise Exception('%s does not record the index its weights were computed for, recompute them.' % file_name)
+            terms = dict()
+            for term, start, end, idf in zip(data['terms'].tolist(), data['starts'].tolist(), data['ends'].tolist(), data['idfs'].tolist()):
+                terms[term] = (start, end, idf)
+            scale = float(data['scale'][0])
+            return ImpactIndex(data['dense_docIDs'], terms, data['dense_ids'], data['impacts'], None if scale < 0 else scale, bool(data['internal_docIDs'][0]))
@@ -0,0 +1,225 @@
+import sys
+import mmap
+import struct
+import argparse
+import numpy as np
+from array import array
+from collections.abc import Mapping
+from typing import Iterator, Set, Tuple
+from compact_index import CompactPostings
+from compressed_index import IndexFormatError
+
+# Read-only positional inverted index served directly from a memory-mapped file.
+#
+# Unlike the compressed format, postings are stored uncompressed as fixed-width uint32 arrays, so a term
+# lookup returns memoryviews (or NumPy arrays, see postings_arrays) pointing into the mapped file instead
+# of decoding anything. Every process which maps the same file shares one copy of it in the page cache,
+# and opening the index only maps the file: nothing is read until a term is looked up.
+#
+# File layout (native little-endian byte order, every section starts at a multiple of 8 bytes):
+#   header        : magic (4 bytes) | version (uint32) | nr_terms (uint64) | nr_docs (uint64) | 7 section offsets (uint64)
+#   term_offsets  : uint64[nr_terms + 1], start of each term in term_bytes
+#   term_bytes    : the sorted terms, utf-8 encoded and concatenated
+#   term_table    : uint64[nr_terms][4] = (start in docIDs, df, start in offsets, start in positions)
+#   docIDs        : uint32, the sorted postings lists of all terms, concatenated
+#   offsets       : uint32, per term df + 1 offsets into the term's positions
+#   positions     : uint32, the positions of all terms, concatenated
+#   all_docIDs    : uint32[nr_docs], every document ID of the collection (sorted)
+
+MAGIC = b'MMIX'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQ7Q')
+TERM_TABLE_WIDTH = 4
+
+def align(f, alignment:int=8) -> int:
+    """Pads the file with zeros up to the next multiple of "alignment" and returns the new position.
+    """
+    position = f.tell()
+    padding = (-position) % alignment
+    f.write(b'\0' * padding)
+    return position + padding
+
+def save_mmap_pos_inverted_index(pos_inverted_index:Mapping, docIDs:Set[int], file_name:str):
+    """Writes the positional inverted index (any of the index representations) and the set of all
+    document IDs to file_name, in the layout described above.
+    """
+    if sys.byteorder != 'little':
+        raise Exception('The memory-mapped index format is only supported on little-endian machines.')
+
+    terms = sorted(pos_inverted_index.keys())
+
+    term_offsets = array('Q', [0])
+    term_bytes = bytearray()
+    term_table = array('Q')
+    all_postings = array('I')
+    all_offsets = array('I')
+    all_positions = array('I')
+
+    for term in terms:
+        term_bytes += term.encode('utf-8')
+        term_offsets.append(len(term_bytes))
+
+        postings = pos_inverted_index[term]
+        term_docIDs = sorted(postings.keys())
+        term_table.extend((len(all_postings), len(term_docIDs), len(all_offsets), len(all_positions)))
+
+        positions_start = len(all_positions)
+        all_offsets.append(0)
+        for docID in term_docIDs:
+            all_postings.append(docID)
+            all_positions.extend(postings[docID])
+            all_offsets.append(len(all_positions) - positions_start)
+
+    sections = (term_offsets, bytes(term_bytes), term_table, all_postings, all_offsets, all_positions, array('I', sorted(docIDs)))
+
+    with open(file_name, 'wb') as f:
+        f.write(b'\0' * HEADER.size)
+        section_offsets = []
+        for section in sections:
+            section_offsets.append(align(f))
+            f.write(section if isinstance(section, bytes) else section.tobytes())
+        align(f)
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(terms), len(docIDs), *section_offsets))
+
+
+class MmapPosInvertedIndex(Mapping):
+    """Read-only positional inverted index over a file written by save_mmap_pos_inverted_index.
+    index[term] returns a CompactPostings whose docIDs, offsets and positions are memoryviews into the mapping,
+    so it can be passed to the search functions like any other PosInvertedIndex.
+    """
+    def __init__(self, file_name:str):
+        with open(file_name, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.nr_terms, self.nr_docs, *section_offsets = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            raise IndexFormatError('%s is not a memory-mapped positional inverted index.' % file_name)
+        if version != VERSION:
+            raise IndexFormatError('%s is a memory-mapped positional inverted index of version %d, version %d is supported.' % (file_name, version, VERSION))
+
+        buffer = memoryview(self.mmap)
+        sections = []
+        for ii in range(len(section_offsets)):
+            end = section_offsets[ii+1] if ii+1 < len(section_offsets) else len(self.mmap)
+            sections.append(buffer[section_offsets[ii]:end])
+        self.section_offsets = section_offsets
+
+        self.term_offsets = sections[0][:8 * (self.nr_terms + 1)].cast('Q')
+        self.term_bytes = sections[1]
+        self.term_table = sections[2][:8 * TERM_TABLE_WIDTH * self.nr_terms].cast('Q')
+        self.docIDs = self.cast_section(sections[3], 'I')
+        self.offsets = self.cast_section(sections[4], 'I')
+        self.positions = self.cast_section(sections[5], 'I')
+        self.all_docIDs_view = sections[6][:4 * self.nr_docs].cast('I')
+
+    @staticmethod
+    def cast_section(section:memoryview, fmt:str) -> memoryview:
+        """Drops the alignment padding at the end of the section and casts it to fmt.
+        """
+        itemsize = struct.calcsize(fmt)
+        return section[:len(section) - len(section) % itemsize].cast(fmt)
+
+    def term_at(self, term_index:int) -> str:
+        return bytes(self.term_bytes[self.term_offsets[term_index]:self.term_offsets[term_index+1]]).decode('utf-8')
+
+    def find_term(self, term:str) -> int:
+        """Binary search for the term in the (sorted) term section. Returns its index or -1.
+        """
+        key = term.encode('utf-8')
+        lo, hi = 0, self.nr_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if bytes(self.term_bytes[self.term_offsets[mid]:self.term_offsets[mid+1]]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.nr_terms and bytes(self.term_bytes[self.term_offsets[lo]:self.term_offsets[lo+1]]) == key:
+            return lo
+        return -1
+
+    def term_entry(self, term:str) -> Tuple[int, int, int, int]:
+        term_index = self.find_term(term)
+        if term_index == -1:
+            raise KeyError(term)
+        row = TERM_TABLE_WIDTH * term_index
+        return tuple(self.term_table[row:row+TERM_TABLE_WIDTH])
+
+    def __getitem__(self, term:str) -> CompactPostings:
+        docIDs_start, df, offsets_start, positions_start = self.term_entry(term)
+        return CompactPostings(self.docIDs[docIDs_start:docIDs_start+df],
+                               self.offsets[offsets_start:offsets_start+df+1],
+                               positions_start,
+                               self.positions)
+
+    def postings_arrays(self, term:str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Zero-copy NumPy views of the docIDs, offsets and positions of the term.
+        """
+        docIDs_start, df, offsets_start, positions_start = self.term_entry(term)
+        docIDs = np.frombuffer(self.mmap, dtype=np.uint32, count=df, offset=self.section_offsets[3] + 4*docIDs_start)
+        offsets = np.frombuffer(self.mmap, dtype=np.uint32, count=df+1, offset=self.section_offsets[4] + 4*offsets_start)
+        positions = np.frombuffer(self.mmap, dtype=np.uint32, count=int(offsets[-1]), offset=self.section_offsets[5] + 4*positions_start)
+        return docIDs, offsets, positions
+
+    def document_frequency(self, term:str) -> int:
+        if self.find_term(term) == -1:
+            return 0
+        return self.term_entry(term)[1]
+
+    def all_docIDs(self) -> Set[int]:
+        return set(self.all_docIDs_view)
+
+    def __contains__(self, term) -> bool:
+        return isinstance(term, str) and self.find_term(term) != -1
+
+    def __iter__(self) -> Iterator[str]:
+        for term_index in range(self.nr_terms):
+            yield self.term_at(term_index)
+
+    def __len__(self) -> int:
+        return self.nr_terms
+
+
+parser = argparse.ArgumentParser(description="Converts an index saved by code.py (save_pos_inverted_index) into a memory-mapped index.")
+parser.add_argument('index_file_name', type=str)
+parser.add_argument('mmap_file_name', type=str)
+parser.add_argument('--collection', type=str, default=None,
+                    help="Trec file the index was built from, to read the IDs of all its documents (an index with "
+                         "DOCNOs does not store the documents which have no terms). Not needed if the index has a "
+                         "docID mapping (.docids file).")
+
+if __name__ == '__main__':
+    import os
+    import shutil
+    from compressed_index import CompressedPosInvertedIndex
+    from docid_mapping import DocIDMapping, docid_mapping_file_name
+    from impact_index import impact_weights_file_name
+
+    args = parser.parse_args()
+    with CompressedPosInvertedIndex(args.index_file_name) as pos_inverted_index:
+        # Index built with internal docIDs: its mapping lists all the documents, and is copied next to the mmap index.
+        docID_mapping = None
+        if os.path.exists(docid_mapping_file_name(args.index_file_name)):
+            docID_mapping = DocIDMapping.load(docid_mapping_file_name(args.index_file_name))
+            docIDs = set(range(len(docID_mapping)))
+        elif args.collection is not None:
+            from code import iterate_trec_documents
+            docIDs = {docId for docId, _, _ in iterate_trec_documents(args.collection)}
+        else:
+            print('Warning: no --collection given, the documents without any term are left out of the set of all documents.')
+            docIDs = set()
+            for term in pos_inverted_index:
+                docIDs.update(pos_inverted_index[term].keys())
+        save_mmap_pos_inverted_index(pos_inverted_index, docIDs, args.mmap_file_name)
+
+    if docID_mapping is not None:
+        docID_mapping.save(docid_mapping_file_name(args.mmap_file_name))
+    elif os.path.exists(docid_mapping_file_name(args.mmap_file_name)):
+        os.remove(docid_mapping_file_name(args.mmap_file_name))
+
+    # Same for the precomputed weights of the index (code.py checks that they match the index before using them).
+    if os.path.exists(impact_weights_file_name(args.index_file_name)):
+        shutil.copyfile(impact_weights_file_name(args.index_file_name), impact_weights_file_name(args.mmap_file_name))
+    elif os.path.exists(impact_weights_file_name(args.mmap_file_name)):
+        os.remove(impact_weights_file_name(args.mmap_file_name))
@@ -0,0 +1,141 @@
+import json
+import random
+import argparse
+from itertools import accumulate
+from xml.sax.saxutils import escape
+from typing import List, Set, Tuple
+
+# Shared module: the same file is in assignment1/ and assignment3/current_prog/. Each assignment is run on its own,
+# as scripts from its own folder which import their modules by plain name, so the module is copied into both folders
+# rather than imported from a common package. Make every change to both copies and keep them byte-identical
+# (cmp assignment1/synthetic_corpus.py assignment3/current_prog/synthetic_corpus.py).
+
+# Synthetic collections and queries for benchmarking, reproducible from a seed.
+#
+# The vocabulary is made of pronounceable letters-only pseudo-words ("taroke", "mesiva", ...), so they go through the
+# tokenizers, stop word removal and stemmers like real words, and match the letters-only phrase and proximity syntax of
+# Search. Word frequencies follow a Zipf law: the word of rank r is drawn with probability proportional to 1 / r^s,
+# so a few words are very frequent (long postings lists) and most are rare, like in natural language.
+#
+# Two formats are written:
+#   - TREC XML, as read by assignment1 (<DOC><DOCNO/><HEADLINE/><TEXT/></DOC>, DOCNOs from first_docno);
+#   - Guardian-style JSONL, as read by assignment3 (one {"id", "fields": {"headline", "bodyText"}} object per line).
+#
+# The queries use words of the vocabulary, and the phrases and proximity pairs are taken from the generated documents,
+# so that they have matches.
+
+SYLLABLES = [consonant + vowel for consonant in 'bdfgklmnprstvz' for vowel in 'aeiou']
+
+class ZipfVocabulary():
+    def __init__(self, size:int, s:float=1.0, seed:int=0, exclude:Set[str]=frozenset()):
+        """
+        Args:
+            size (int): number of distinct words.
+            s (float): exponent of the Zipf law (1 is close to English).
+            seed (int): seed of the words and of the documents generated from them.
+            exclude (Set[str]): words which must not be generated (e.g. the stop words).
+        """
+        self.random = random.Random(seed)
+        words = set()
+        self.words = []
+        while len(self.words) < size:
+            word = ''.join(self.random.choice(SYLLABLES) for _ in range(self.random.randint(2, 4)))
+            if word not in words and word not in exclude:
+                words.add(word)
+                self.words.append(word)
+        self.cum_weights = list(accumulate(1 / (rank ** s) for rank in range(1, size + 1)))
+
+    def sample(self, k:int) -> List[str]:
+        """Draws k words (with repetition) from the Zipf distribution.
+        """
+        return self.random.choices(self.words, cum_weights=self.cum_weights, k=k)
+
+    def rank_range(self, first:int, last:int) -> List[str]:
+        """Words of ranks first..last-1 (rank 0 being the most frequent word).
+        """
+        return self.words[first:last]
+
+def generate_documents(vocabulary:ZipfVocabulary, nr_docs:int, doc_length:int, headline_length:int=8) -> List[Tuple[str, str]]:
+    """Returns nr_docs (headline, text) pairs. Document lengths are uniform in [doc_length / 2, 3 * doc_length / 2].
+    """
+    documents = []
+    for _ in range(nr_docs):
+        length = vocabulary.random.randint(doc_length // 2, doc_length + doc_length // 2)
+        documents.append((' '.join(vocabulary.sample(headline_length)), ' '.join(vocabulary.sample(length))))
+    return documents
+
+def write_trec_file(documents:List[Tuple[str, str]], file_name:str, first_docno:int=1):
+    with open(file_name, 'w') as f:
+        f.write('<document>\n')
+        for docno, (headline, text) in enumerate(documents, first_docno):
+            f.write('<DOC>\n<DOCNO>%d</DOCNO>\n<HEADLINE>%s</HEADLINE>\n<TEXT>\n%s\n</TEXT>\n</DOC>\n' % (docno, escape(headline), escape(text)))
+        f.write('</document>\n')
+
+def write_guardian_jsonl_file(documents:List[Tuple[str, str]], file_name:str, first_id:int=0):
+    with open(file_name, 'w') as f:
+        for doc_id, (headline, text) in enumerate(documents, first_id):
+            f.write(json.dumps({'id': doc_id, 'type': 'article', 'sectionId': 'politics', 'fields': {'headline': headline, 'bodyText': text}}) + '\n')
+
+def generate_queries(vocabulary:ZipfVocabulary, documents:List[Tuple[str, str]], nr_queries:int) -> dict:
+    """Returns nr_queries queries of each kind: 'boolean' (terms combined with AND, OR and NOT, mixing frequent and rare
+    terms), 'phrase' ("a b"), 'proximity' (#n(a, b)) and 'ranked' (free text of 2 to 5 words).
+    """
+    rng = vocabulary.random
+    # Only words which occur in the documents (looking up a term which is not indexed is an error for Search).
+    occurring = set()
+    for headline, text in documents:
+        occurring.update(headline.split(' '))
+        occurring.update(text.split(' '))
+    frequent = [word for word in vocabulary.rank_range(0, max(1, len(vocabulary.words) // 100)) if word in occurring]
+    common = [word for word in vocabulary.rank_range(0, max(1, len(vocabulary.words) // 10)) if word in occurring]
+
+    # The phrases and proximity pairs are taken from the texts of at least 2 words.
+    texts = [text.split(' ') for _, text in documents if ' ' in text]
+    if len(texts) == 0:
+        raise Exception('The documents are too short to take phrase and proximity queries from them.')
+
+    def document_pair(max_distance:int) -> Tuple[str, str, int]:
+        words = rng.choice(texts)
+        if len(words) > max_distance:
+            start = rng.randrange(len(words) - max_distance)
+            distance = rng.randint(1, max_distance)
+        else:
+            # Text shorter than the distance: both words must still be in it.
+            start = rng.randrange(len(words) - 1)
+            distance = rng.randint(1, len(words) - 1 - start)
+        return words[start], words[start + distance], distance
+
+    queries = {'boolean': [], 'phrase': [], 'proximity': [], 'ranked': []}
+    for _ in range(nr_queries):
+        a, b = rng.choice(frequent), rng.choice(common)
+        queries['boolean'].append(rng.choice(['%s AND %s' % (a, b), '%s OR %s' % (a, b), '%s AND NOT %s' % (b, a), 'NOT %s' % a]))
+        term1, term2, _ = document_pair(1)
+        queries['phrase'].append('"%s %s"' % (term1, term2))
+        term1, term2, distance = document_pair(10)
+        queries['proximity'].append('#%d(%s, %s)' % (rng.randint(distance, 10), term1, term2))
+        queries['ranked'].append(' '.join(rng.choice(common) for _ in range(rng.randint(2, 5))))
+    return queries
+
+
+parser = argparse.ArgumentParser(description="Writes a synthetic collection (Zipfian vocabulary) in the TREC XML or Guardian JSONL format.")
+parser.add_argument('file_name', type=str)
+parser.add_argument('--format', type=str, default='trec', choices=['trec', 'jsonl'])
+parser.add_argument('--nr-docs', type=int, default=10000)
+parser.add_argument('--doc-length', type=int, default=200)
+parser.add_argument('--vocabulary-size', type=int, default=50000)
+parser.add_argument('--zipf-s', type=float, default=1.0)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--stopwords', type=str, default=None, help="Do not generate the words of this stop word file.")
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    exclude = frozenset()
+    if args.stopwords is not None:
+        with open(args.stopwords, 'r') as f:
+            exclude = set(f.read().splitlines())
+    vocabulary = ZipfVocabulary(args.vocabulary_size, args.zipf_s, args.seed, exclude)
+    documents = generate_documents(vocabulary, args.nr_docs, args.doc_length)
+    if args.format == 'trec':
+        write_trec_file(documents, args.file_name)
+    else:
+        write_guardian_jsonl_file(documents, args.file_name)
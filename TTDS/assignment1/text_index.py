@@ -0,0 +1,123 @@
+import argparse
+import multiprocessing as mp
+from collections.abc import Mapping
+from typing import Dict, List, Sequence
+from compact_index import CompactPostings
+
+# Reading and writing the human-readable "index.txt" format:
+#
+#   term:df
+#   \tdocID: position, position, ...
+#   \tdocID: position, ...
+#
+# with the terms in sorted order and the docIDs of each term in increasing order.
+#
+# Each term block is built with a few joins and the blocks are written to the file in batches, instead of
+# building every line with repeated string concatenation and writing it separately. Most of the time goes into
+# converting numbers to strings, and the same small positions and docIDs occur over and over, so the conversions
+# are memoised (NumberStrings). The blocks can also be formatted by several forked processes, each of them
+# formatting a contiguous range of the sorted terms; the ranges are written back in order, so the output is the
+# same for any number of workers.
+
+class NumberStrings(dict):
+    """number -> str(number), converting each number only the first time it is looked up.
+    """
+    def __missing__(self, number:int) -> str:
+        string = str(number)
+        self[number] = string
+        return string
+
+def format_term_postings(term:str, postings:Mapping, number_strings:NumberStrings, external_ids:Sequence[int]=None) -> str:
+    """Returns the block of lines of one term (postings: docID -> sorted positions).
+    With external_ids (internal docID -> external docID), the lines show the external docIDs, in increasing order.
+    """
+    to_string = number_strings.__getitem__
+    if external_ids is not None:
+        entries = sorted((external_ids[docID], positions) for docID, positions in postings.items())
+        lines = ['\t' + to_string(docID) + ': ' + ', '.join(map(to_string, positions)) + '\n' for docID, positions in entries]
+    elif isinstance(postings, CompactPostings):
+        # Walk the arrays directly instead of looking every docID up again.
+        docIDs, offsets, start, positions = postings.docIDs, postings.offsets, postings.start, postings.positions
+        lines = ['\t' + to_string(docIDs[ii]) + ': ' + ', '.join(map(to_string, positions[start+offsets[ii]:start+offsets[ii+1]])) + '\n' for ii in range(len(docIDs))]
+    else:
+        lines = ['\t' + to_string(docID) + ': ' + ', '.join(map(to_string, postings[docID])) + '\n' for docID in sorted(postings.keys())]
+    return term + ':' + str(len(postings)) + '\n' + ''.join(lines)
+
+def format_terms(pos_inverted_index:Mapping, terms:List[str], number_strings:NumberStrings, external_ids:Sequence[int]=None) -> str:
+    return ''.join([format_term_postings(term, pos_inverted_index[term], number_strings, external_ids) for term in terms])
+
+# Index being exported by save_text_pos_inverted_index (and its external docIDs), inherited by the forked workers
+# instead of being pickled.
+exported_index = None
+exported_external_ids = None
+worker_number_strings = NumberStrings()
+
+def format_term_range(terms:List[str]) -> str:
+    """Runs in a worker: formats the blocks of a range of terms of exported_index.
+    """
+    return format_terms(exported_index, terms, worker_number_strings, exported_external_ids)
+
+def save_text_pos_inverted_index(pos_inverted_index:Mapping, file_name:str, nr_workers:int=1, external_ids:Sequence[int]=None, terms_per_batch:int=1000):
+    """Writes the positional inverted index (any of the index representations) to file_name in the index.txt format.
+
+    Args:
+        pos_inverted_index (Mapping): term -> (docID -> positions).
+        file_name (str): output file, "index.txt" in our case.
+        nr_workers (int): number of forked processes formatting the term blocks, 1 formats them in this process.
+        external_ids (Sequence[int]): for an index built with internal docIDs, the external docID of each of them.
+        terms_per_batch (int): number of term blocks joined and written at a time.
+    """
+    global exported_index, exported_external_ids
+
+    terms = sorted(pos_inverted_index.keys())
+    batches = [terms[ii:ii+terms_per_batch] for ii in range(0, len(terms), terms_per_batch)]
+
+    with open(file_name, 'w', buffering=1024*1024) as f:
+        if nr_workers <= 1:
+            number_strings = NumberStrings()
+            for batch in batches:
+                f.write(format_terms(pos_inverted_index, batch, number_strings, external_ids))
+            return
+
+        exported_index = pos_inverted_index
+        exported_external_ids = external_ids
+        try:
+            with mp.get_context('fork').Pool(nr_workers) as pool:
+                # imap returns the ranges in term order.
+                for text in pool.imap(format_term_range, batches):
+                    f.write(text)
+        finally:
+            exported_index = None
+            exported_external_ids = None
+
+def load_text_pos_inverted_index(file_name:str) -> Dict[str, Dict[int, List[int]]]:
+    """Parses a file in the index.txt format back into a dictionary-based positional inverted index.
+    """
+    pos_inverted_index = dict()
+    postings = None
+
+    with open(file_name, 'r', buffering=1024*1024) as f:
+        for line in f:
+            if line[0] == '\t':
+                docID, _, positions = line.partition(': ')
+                postings[int(docID)] = list(map(int, positions.split(', ')))
+            else:
+                # The document frequency is implied by the lines which follow.
+                term = line.rpartition(':')[0]
+                postings = dict()
+                pos_inverted_index[term] = postings
+
+    return pos_inverted_index
+
+
+parser = argparse.ArgumentParser(description="Writes an index saved by code.py (save_pos_inverted_index) in the index.txt format.")
+parser.add_argument('index_file_name', type=str)
+parser.add_argument('text_file_name', type=str)
+parser.add_argument('--workers', type=int, default=1)
+
+if __name__ == '__main__':
+    from compressed_index import CompressedPosInvertedIndex
+
+    args = parser.parse_args()
+    with CompressedPosInvertedIndex(args.index_file_name) as pos_inverted_index:
+        save_text_pos_inverted_index(pos_inverted_index, args.text_file_name, args.workers)
@@ -0,0 +1,103 @@
+import os
+import argparse
+from time import perf_counter
+from preprocessors import PreprocessorConfig
+from build_index import build_indices, merge_indices, compute_impact_weights
+from search import Search
+from synthetic_corpus import ZipfVocabulary, generate_documents, generate_queries, write_guardian_jsonl_file
+from benchmark_results import latency_summary, format_latency_summary, append_benchmark_results
+
+# Usage (from this folder):
+#
+# python benchmark.py --nr-docs 5000 --impacts --results benchmark_results.jsonl
+#
+# Reproducible end-to-end benchmark of build_index.py and Search on a synthetic Guardian-style JSONL collection
+# (Zipfian vocabulary, see synthetic_corpus.py): build time of the partial indices, of the merge and of the impact
+# weights, then the latency percentiles and throughput of boolean, phrase, proximity and ranked queries.
+# The run is appended to the --results file, tagged with the git commit, to compare commits.
+
+def run_benchmark(args):
+    preprocessor_config = PreprocessorConfig('simple', args.stopwords)
+    preprocessor = preprocessor_config.build()
+    data_file_name = args.output_prefix + '.jsonl'
+    index_file_name = args.output_prefix + '.sqlite'
+
+    vocabulary = ZipfVocabulary(args.vocabulary_size, args.zipf_s, args.seed, preprocessor.stop_words_set)
+    documents = generate_documents(vocabulary, args.nr_docs, args.doc_length)
+    queries = generate_queries(vocabulary, documents, args.nr_queries)
+    write_guardian_jsonl_file(documents, data_file_name)
+    del documents
+
+    results = dict()
+    build = dict()
+    if os.path.exists(index_file_name):
+        os.remove(index_file_name)
+
+    ts = perf_counter()
+    indices = build_indices(preprocessor_config, data_file_name, args.flush_every, task_bytes=int(args.task_mb * 1024 * 1024))
+    build['build_seconds'] = perf_counter() - ts
+    ts = perf_counter()
+    merge_indices(index_file_name, indices)
+    build['merge_seconds'] = perf_counter() - ts
+    if args.impacts:
+        ts = perf_counter()
+        compute_impact_weights(index_file_name)
+        build['impacts_seconds'] = perf_counter() - ts
+    os.remove(data_file_name)
+
+    build['total_seconds'] = sum(build.values())
+    build['documents_per_second'] = args.nr_docs / build['total_seconds']
+    build['index_file_bytes'] = os.path.getsize(index_file_name)
+    results['build'] = build
+    print('build: %s' % ', '.join('%s %.3f' % item for item in build.items()))
+
+    ts = perf_counter()
+    search = Search(index_file_name, preprocessor, int(args.result_cache_mb * 1024 * 1024), args.bitmap_sets)
+    results['search_init_seconds'] = perf_counter() - ts
+
+    answerers = {'boolean': search.simple_query,
+                 'phrase': search.simple_query,
+                 'proximity': search.simple_query,
+                 'ranked': lambda query: search.ranked_query(query, args.k)}
+    for kind in ['boolean', 'phrase', 'proximity', 'ranked']:
+        answer = answerers[kind]
+        latencies = []
+        for query in queries[kind]:
+            ts = perf_counter()
+            answer(query)
+            latencies.append(perf_counter() - ts)
+        results[kind] = latency_summary(latencies)
+        print(format_latency_summary(kind, results[kind]))
+
+    config = {key: value for key, value in vars(args).items()}
+    append_benchmark_results(args.results, 'assignment3', config, results)
+    print('Results appended to %s' % args.results)
+
+    if not args.keep_index:
+        search.index.close()
+        os.remove(index_file_name)
+        impacts_file = os.path.splitext(index_file_name)[0] + '_impacts.sqlite'
+        if os.path.exists(impacts_file):
+            os.remove(impacts_file)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--stopwords', type=str, default='englishST.txt')
+parser.add_argument('--nr-docs', type=int, default=5000)
+parser.add_argument('--doc-length', type=int, default=200)
+parser.add_argument('--vocabulary-size', type=int, default=50000)
+parser.add_argument('--zipf-s', type=float, default=1.0)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--nr-queries', type=int, default=50, help="Number of queries of each kind.")
+parser.add_argument('--k', type=int, default=10)
+parser.add_argument('--task-mb', type=float, default=2, help="Size of the byte ranges the indexing processes take one at a time.")
+parser.add_argument('--flush-every', type=int, default=10000, help="Documents per partial index.")
+parser.add_argument('--impacts', action='store_true', help="Precompute the impact weights used by the ranked queries.")
+parser.add_argument('--result-cache-mb', type=float, default=0, help="Result cache of Search (off by default, to measure the queries themselves).")
+parser.add_argument('--bitmap-sets', action='store_true')
+parser.add_argument('--output-prefix', type=str, default='benchmark_suite')
+parser.add_argument('--keep-index', action='store_true')
+parser.add_argument('--results', type=str, default='benchmark_results.jsonl')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    run_benchmark(args)
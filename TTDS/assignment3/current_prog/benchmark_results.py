@@ -0,0 +1,67 @@
+import os
+import json
+import subprocess
+from time import time
+from typing import Dict, List, Union
+
+# Shared module: the same file is in assignment1/ and assignment3/current_prog/. Each assignment is run on its own,
+# as scripts from its own folder which import their modules by plain name, so the module is copied into both folders
+# rather than imported from a common package. Make every change to both copies and keep them byte-identical
+# (cmp assignment1/benchmark_results.py assignment3/current_prog/benchmark_results.py).
+
+# Latency statistics and the results file of the benchmark suites (benchmark.py suite in assignment1,
+# benchmark.py in assignment3/current_prog).
+#
+# Each run appends one JSON object per line to the results file, tagged with the git commit of the code it measured,
+# so that the same suite run on two commits can be compared line by line.
+
+def percentile(sorted_values:List[float], fraction:float) -> float:
+    """Nearest-rank percentile of an already sorted, non-empty list (fraction in [0, 1]).
+    """
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def latency_summary(latencies:List[float]) -> Dict[str, float]:
+    """Summarises per-query latencies (in seconds): mean, p50, p90, p99 and max in milliseconds, and the throughput
+    in queries per second (queries answered one after the other).
+    """
+    if len(latencies) == 0:
+        return {'queries': 0}
+    sorted_latencies = sorted(latencies)
+    total = sum(latencies)
+    return {'queries': len(latencies),
+            'mean_ms': 1000 * total / len(latencies),
+            'p50_ms': 1000 * percentile(sorted_latencies, 0.5),
+            'p90_ms': 1000 * percentile(sorted_latencies, 0.9),
+            'p99_ms': 1000 * percentile(sorted_latencies, 0.99),
+            'max_ms': 1000 * sorted_latencies[-1],
+            'queries_per_second': len(latencies) / total if total > 0 else 0.0}
+
+def format_latency_summary(name:str, summary:Dict[str, float]) -> str:
+    if summary['queries'] == 0:
+        return '%-10s no queries' % name
+    return ('%-10s %5d queries: mean %8.3f ms, p50 %8.3f ms, p90 %8.3f ms, p99 %8.3f ms, max %8.3f ms, %9.1f queries/s'
+            % (name, summary['queries'], summary['mean_ms'], summary['p50_ms'], summary['p90_ms'], summary['p99_ms'], summary['max_ms'], summary['queries_per_second']))
+
+def git_commit() -> Union[str, None]:
+    """Commit of the working tree the benchmark runs from (with a "-dirty" suffix if it has changes), or None outside git.
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=folder, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no', '.'], cwd=folder, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if status.strip() else '')
+
+def append_benchmark_results(file_name:str, suite:str, config:Dict, results:Dict) -> Dict:
+    """Appends a run of a benchmark suite to the results file (one JSON object per line) and returns it.
+    """
+    run = {'suite': suite,
+           'timestamp': time(),
+           'commit': git_commit(),
+           'config': config,
+           'results': results}
+    with open(file_name, 'a') as f:
+        f.write(json.dumps(run) + '\n')
+    return run
@@ -1,17 +1,17 @@
 import os
 import sys
 import json
-import pickle
+import math
 import multiprocessing as mp
 import gc
-from time import time
+import heapq
+from time import time, perf_counter
 from functools import wraps
 from sqlitedict import SqliteDict
-from preprocessors import Preprocessor, SimplePreprocessor, Word2VecPreprocessor
-from tokenizers import RegexpTokenizer
-from typing import List, Optional, Dict
-from nltk.stem import PorterStemmer
-from nltk.stem.snowball import SnowballStemmer
+from preprocessors import Preprocessor, PreprocessorConfig
+from compressed_index import CompressedPosInvertedIndex, save_compressed_pos_inverted_index
+from sqlite_index import SqliteIndexWriter
+from typing import List, Optional, Dict, Tuple, Iterator, Union
 
 # Assumptions:
 # 1. File is in standard format: 1 json entry per line, each entry must have: fields: headline and fields:bodyText, + id field.
@@ -31,30 +31,134 @@ from nltk.stem.snowball import SnowballStemmer
 # on the use case).
 
 # Current assumption: no commas are left after preprocessing.
-def merge_indices(merged_index_file_name:str, indices_files:List[str], delete:Optional[bool]=True):
-    with SqliteDict(merged_index_file_name, autocommit=False) as slitedict:
-        for index_file in indices_files:
-            index = load_pos_inverted_index(index_file)
-            word_count = 0
-            for word in index:
-                word_count += 1
-                word_dict = slitedict.get(word)
-                if word_dict is None:
-                    slitedict[word] = index[word]
-                else:
-                    curr_dict = slitedict[word]
-                    curr_dict.update(index[word])
-                    slitedict[word] = curr_dict
-                slitedict.commit()
-            
-            del index
-            gc.collect()
-
-            if delete:
-                os.remove(index_file)
+#
+# The partial indices are term-sorted runs (save_compressed_pos_inverted_index writes the terms in sorted order), so
+# they are merged SPIMI-style: a heap-based k-way merge reads the runs sequentially, side by side, and each term's
+# combined postings are written to the sqlite store exactly once. Only the term dictionaries of the runs and the
+# postings of the current term are in memory. The store is written in batches by SqliteIndexWriter (see
+# sqlite_index.py) and committed every commit_every_x_words terms.
+def iterate_run(index:CompressedPosInvertedIndex, run_number:int) -> Iterator[Tuple[str, int, Dict[int, List[int]]]]:
+    for word, postings in index.iterate_postings():
+        yield word, run_number, postings
+
+def merge_runs(indices:List[CompressedPosInvertedIndex]) -> Iterator[Tuple[str, Dict[int, List[int]]]]:
+    """Yields (word, combined postings) for every word of the runs, in sorted order. The postings of a word found in
+    several runs are combined in docID order (a process of build_indices indexes ranges from all over the file into
+    the same run, so the order of the runs is not the docID order).
+    """
+    word = None
+    postings = None
+    combined = False
+    for next_word, _, run_postings in heapq.merge(*[iterate_run(index, run_number) for run_number, index in enumerate(indices)]):
+        if next_word != word:
+            if word is not None:
+                yield word, sort_postings(postings) if combined else postings
+            word = next_word
+            postings = run_postings
+            combined = False
+        else:
+            postings.update(run_postings)
+            combined = True
+    if word is not None:
+        yield word, sort_postings(postings) if combined else postings
+
+def sort_postings(postings:Dict[int, List[int]]) -> Dict[int, List[int]]:
+    return {docId: postings[docId] for docId in sorted(postings)}
+
+def merge_indices(merged_index_file_name:str, indices_files:List[str], delete:Optional[bool]=True, commit_every_x_words:int=10000):
+    indices = [load_pos_inverted_index(index_file) for index_file in indices_files]
+
+    with SqliteIndexWriter(merged_index_file_name) as writer:
+        # Merging into an existing index: words which are already in it get the new postings added to theirs.
+        existing = len(writer) > 0
+        for word_count, (word, postings) in enumerate(merge_runs(indices), 1):
+            if existing:
+                stored_postings = writer.get(word)
+                if stored_postings is not None:
+                    stored_postings.update(postings)
+                    postings = stored_postings
+            writer[word] = postings
+            if word_count % commit_every_x_words == 0:
+                writer.commit()
+
+    for index, index_file in zip(indices, indices_files):
+        index.close()
+        if delete:
+            os.remove(index_file)
     print('Indices successfully merged?')
                 
 
+def impacts_file_name(index_file_name:str) -> str:
+    """Sqlite file holding the precomputed ranking data of an index: index.sqlite -> index_impacts.sqlite.
+    """
+    return os.path.splitext(index_file_name)[0] + '_impacts.sqlite'
+
+def compute_impact_weights(index_file_name:str, quantise:Optional[bool]=False, commit_every_x_words:int=10000):
+    """Precomputes the ranking data used by Search.ranked_query and stores it next to the index, in impacts_file_name(index_file_name):
+    the tf-idf weight of every (term, document) pair (table "impacts", term -> {docId: weight}) and the idf of every term
+    (table "idf"). Ranked queries then only add up weights.
+    With quantise=True the weights are stored as integers in [0, 255], the scale is saved in table "meta".
+    Table "meta" also records the number of documents (N) and of terms of the index, which Search checks before it
+    uses the weights, so the weights of another (or an older) build of the index are ignored.
+    The data is kept in a separate file because sqlite only allows one writer per file, so the index could not be
+    read through one connection while the weights are written through another.
+    """
+    output_file_name = impacts_file_name(index_file_name)
+
+    with SqliteDict(index_file_name, flag='r') as index:
+        doc_ids = set()
+        for word, postings in index.iteritems():
+            doc_ids.update(postings.keys())
+        # Same N as Search: with dense docIDs, the documents without any indexed term count too.
+        docids_file = docids_file_name(index_file_name)
+        N = len(load_docids(docids_file)) if os.path.exists(docids_file) else len(doc_ids)
+
+        idfs = dict()
+        max_weight = 0
+        with SqliteIndexWriter(output_file_name, tablename='impacts', flag='n') as impacts_table:
+            for word_count, (word, postings) in enumerate(index.iteritems()):
+                # Same expressions as Search.ranked_query used to compute at query time.
+                idf = math.log(N / len(postings), 10)
+                weights = dict()
+                for doc, positions in postings.items():
+                    weights[doc] = (1 + math.log(len(positions), 10)) * idf
+                    max_weight = max(max_weight, weights[doc])
+                idfs[word] = idf
+                impacts_table[word] = weights
+                if word_count % commit_every_x_words == 0:
+                    impacts_table.commit()
+
+            scale = None
+            if quantise:
+                scale = max_weight / 255 if max_weight > 0 else 1.0
+                for word_count, word in enumerate(idfs):
+                    impacts_table[word] = {doc: int(round(weight / scale)) for doc, weight in impacts_table[word].items()}
+                    if word_count % commit_every_x_words == 0:
+                        impacts_table.commit()
+
+    with SqliteIndexWriter(output_file_name, tablename='idf') as idf_table:
+        idf_table.update(idfs)
+
+    with SqliteIndexWriter(output_file_name, tablename='meta') as meta_table:
+        meta_table['N'] = N
+        meta_table['nr_terms'] = len(idfs)
+        meta_table['scale'] = scale
+    print('Impact weights computed.')
+
+def docids_file_name(index_file_name:str) -> str:
+    """JSON file holding the docID mapping of an index built with dense docIDs: index.sqlite -> index_docids.json.
+    Entry i of the list is the external (standardised) ID of internal docID i.
+    """
+    return os.path.splitext(index_file_name)[0] + '_docids.json'
+
+def save_docids(external_ids:List[int], file_name:str):
+    with open(file_name, 'w') as f:
+        json.dump(external_ids, f)
+
+def load_docids(file_name:str) -> List[int]:
+    with open(file_name, 'r') as f:
+        return json.load(f)
+
 def timing(f):
     @wraps(f)
     def wrap(*args, **kw):
@@ -66,52 +170,56 @@ def timing(f):
         return result
     return wrap
 
-def build_indices(preprocessor:Preprocessor, 
-                  file_names:List[str], 
-                  flush_every_x_lines:int,
-                  ) -> List[str]:
-    nr_processors = mp.cpu_count()
-    with mp.Pool(processes=nr_processors) as pool:
-        list_of_indices = pool.starmap(construct_index, ((preprocessor, x, flush_every_x_lines) for x in file_names))
-    indices = []
-    for x in list_of_indices:
-        indices += x
-    print('Indices construction finished.')
-    return indices
-
+# Partial indices are saved in the delta + variable-byte compressed format (see compressed_index.py).
+# Loading only reads the term dictionary, postings are decoded term by term.
 def save_pos_inverted_index(pos_inverted_index, file_name:str):
-    with open(file_name, 'wb') as f:
-        pickle.dump(pos_inverted_index, f)
+    save_compressed_pos_inverted_index(pos_inverted_index, file_name)
 
-def load_pos_inverted_index(file_name:str):
-    with open(file_name, 'rb') as f:
-        pos_inverted_index = pickle.load(f)
-    return pos_inverted_index
+def load_pos_inverted_index(file_name:str) -> CompressedPosInvertedIndex:
+    return CompressedPosInvertedIndex(file_name)
 
-# Test without sqlite and with sqlite.
-def construct_index(preprocessor:Preprocessor, data_path:str, flush_every_x_lines:int) -> List[str]:
-    indices = []
+class IndexWorker():
+    """Builds the partial indices of a process: the documents of every range given to index_range are added to the
+    same in-memory index, which is saved as a partial index (a run) every flush_every_x_lines documents and when flush
+    is called. Also keeps the time spent indexing, for the utilisation statistics of build_indices.
+    """
+    def __init__(self, flush_every_x_lines:int, run_prefix:str):
+        """
+        Args:
+            flush_every_x_lines (int): number of documents per partial index.
+            run_prefix (str): prefix of the partial index files (numbered from 0), must be unique among the workers.
+        """
+        self.flush_every_x_lines = flush_every_x_lines
+        self.run_prefix = run_prefix
+        self.pos_inverted_index = dict()
+        self.nr_buffered_docs = 0
+        self.indices = []
 
-    pos_inverted_index = dict()
-    line_count = 0
-    _, file_name = os.path.split(data_path)
-    
-    
-    with open(data_path, 'r') as f:
-        for line in f:
-            if line_count % flush_every_x_lines == 0:
-                if line_count != 0:
-                    save_pos_inverted_index(pos_inverted_index, index_name)
-                    del pos_inverted_index
-                    gc.collect()
-                pos_inverted_index = dict()
-                index_name = str(line_count//flush_every_x_lines) + '_' + file_name
-                indices.append(index_name)
-            
+        self.nr_tasks = 0
+        self.nr_docs = 0
+        self.nr_bytes = 0
+        self.busy_seconds = 0.0
+
+    def index_range(self, preprocessor:Preprocessor, data_path:str, start:int=0, end:Optional[int]=None, first_docId:Optional[int]=None) -> List[int]:
+        """Indexes the documents of data_path found in the byte range [start, end) (the whole file by default).
+        If first_docId is given, the documents get the internal docIDs first_docId, first_docId+1, ... instead of their "id".
+
+        Returns:
+            List[int]: the "id" of every document of the range, in file order.
+        """
+        ts = perf_counter()
+        external_ids = []
+        pos_inverted_index = self.pos_inverted_index
+
+        for line in iterate_lines(data_path, start, end):
             data = json.loads(line)
             headline = data['fields']['headline']
             body = data['fields']['bodyText']
             docId = data['id']
+            if first_docId is not None:
+                docId = first_docId + len(external_ids)
+            external_ids.append(data['id'])
+            self.nr_bytes += len(line)
 
             terms = preprocessor.process_text_lines([headline, body])
             for index, term in enumerate(terms):
@@ -123,87 +231,194 @@ def construct_index(preprocessor:Preprocessor, data_path:str, flush_every_x_line
                 else:
                     pos_inverted_index[term] = dict()
                     pos_inverted_index[term][docId] = [index]
-            
-            line_count += 1
 
-        save_pos_inverted_index(pos_inverted_index, index_name)
+            self.nr_buffered_docs += 1
+            if self.nr_buffered_docs == self.flush_every_x_lines:
+                self.flush()
+                pos_inverted_index = self.pos_inverted_index
+
+        self.nr_tasks += 1
+        self.nr_docs += len(external_ids)
+        self.busy_seconds += perf_counter() - ts
+        return external_ids
+
+    def flush(self):
+        """Saves the documents indexed since the last flush as a partial index.
+        """
+        if self.nr_buffered_docs == 0:
+            return
+        index_name = self.run_prefix + str(len(self.indices))
+        save_pos_inverted_index(self.pos_inverted_index, index_name)
+        self.indices.append(index_name)
+        self.pos_inverted_index = dict()
+        self.nr_buffered_docs = 0
+        gc.collect()
+
+    def stats(self) -> Dict[str, float]:
+        return {'tasks': self.nr_tasks, 'documents': self.nr_docs, 'bytes': self.nr_bytes, 'runs': len(self.indices), 'busy_seconds': self.busy_seconds}
+
+# Test without sqlite and with sqlite.
+def construct_index(preprocessor:Preprocessor, 
+                    data_path:str, 
+                    flush_every_x_lines:int, 
+                    first_docId:Optional[int]=None,
+                    start:int=0,
+                    end:Optional[int]=None,
+                    ) -> Tuple[List[str], List[int]]:
+    """Indexes the documents of data_path found in the byte range [start, end) (the whole file by default) in this
+    process, saving a partial index every flush_every_x_lines documents.
+    If first_docId is given, the documents get the internal docIDs first_docId, first_docId+1, ... instead of their "id".
+
+    Returns:
+        Tuple[List[str], List[int]]: the partial index files and the "id" of every document, in file order.
+    """
+    _, file_name = os.path.split(data_path)
+    worker = IndexWorker(flush_every_x_lines, str(start) + '_' + file_name + '_')
+    external_ids = worker.index_range(preprocessor, data_path, start, end, first_docId)
+    worker.flush()
+    return worker.indices, external_ids
+
+# Pool workers of build_indices. The IndexWorker and the preprocessor of a process are created by the pool initializer
+# and kept across tasks, so a process writes full partial indices whatever the size of the tasks, and the preprocessor
+# is not pickled into every task (the tasks are only byte ranges). Once all the tasks are done, every
+# process gets exactly one flush_index_worker task: the barrier keeps a process which has flushed from taking another
+# process's flush task.
+# An exception raised by a pool initializer makes the pool restart the process over and over, so the error of building
+# the preprocessor is kept and raised by the tasks instead.
+index_worker = None
+index_worker_barrier = None
+index_worker_preprocessor = None
+index_worker_error = None
+
+def init_index_worker(flush_every_x_lines:int, file_name:str, barrier, preprocessor:Union[Preprocessor, PreprocessorConfig]):
+    global index_worker, index_worker_barrier, index_worker_preprocessor, index_worker_error
+    index_worker = IndexWorker(flush_every_x_lines, str(os.getpid()) + '_' + file_name + '_')
+    index_worker_barrier = barrier
+    if isinstance(preprocessor, PreprocessorConfig):
+        try:
+            preprocessor = preprocessor.build()
+        except Exception as e:
+            index_worker_error = e
+    index_worker_preprocessor = preprocessor
+
+def index_range_task(task:Tuple[str, int, int, int, Optional[int]]) -> Tuple[int, List[int]]:
+    if index_worker_error is not None:
+        raise index_worker_error
+    data_path, task_number, start, end, first_docId = task
+    return task_number, index_worker.index_range(index_worker_preprocessor, data_path, start, end, first_docId)
+
+def flush_index_worker(_) -> Tuple[int, List[str], Dict[str, float]]:
+    ts = perf_counter()
+    try:
+        index_worker.flush()
+    except BaseException:
+        # The process would never reach the barrier: break it, so the processes waiting on it raise
+        # BrokenBarrierError instead of waiting forever, and the build fails instead of hanging.
+        index_worker_barrier.abort()
+        raise
+    index_worker.busy_seconds += perf_counter() - ts
+    index_worker_barrier.wait()
+    return os.getpid(), index_worker.indices, index_worker.stats()
+
+def format_worker_stats(pid:int, stats:Dict[str, float], wall_seconds:float) -> str:
+    return ('worker %d: %d tasks, %d documents, %.1f MB, %d runs, busy %.2fs of %.2fs (%.0f%%)'
+            % (pid, stats['tasks'], stats['documents'], stats['bytes'] / (1024 * 1024), stats['runs'], stats['busy_seconds'], wall_seconds,
+               100 * stats['busy_seconds'] / wall_seconds if wall_seconds > 0 else 0))
+
+def build_indices(preprocessor:Union[Preprocessor, PreprocessorConfig], 
+                  data_path:str, 
+                  flush_every_x_lines:int,
+                  docids_file:Optional[str]=None,
+                  task_bytes:int=2*1024*1024,
+                  ) -> List[str]:
+    """Builds the partial indices of the data file in parallel. The file is split into byte ranges of about task_bytes
+    bytes (see calculate_byte_ranges), which the processes of the pool take one at a time as they become idle
+    (imap_unordered), so a range of long documents does not keep the other processes waiting. Every process reads its
+    ranges of the file directly and prints how busy it was at the end.
+    With docids_file, the documents are indexed under dense internal docIDs 0..N-1 (in file order) instead of their
+    "id" field, and the list of their external IDs is saved to docids_file (see docids_file_name). Search then keeps
+    the set of all documents as a range and only converts docIDs back when it returns the results.
+    The preprocessor is given to the processes once, when they start. With a PreprocessorConfig, each process builds
+    its own preprocessor from it (and this process does not need to build one at all).
+    """
+    nr_processors = mp.cpu_count()
+    nr_tasks = max(1, math.ceil(os.path.getsize(data_path) / task_bytes))
+    byte_ranges = calculate_byte_ranges(data_path, nr_tasks)
+    _, file_name = os.path.split(data_path)
+
+    barrier = mp.Barrier(nr_processors)
+    with mp.Pool(processes=nr_processors, initializer=init_index_worker, initargs=(flush_every_x_lines, file_name, barrier, preprocessor)) as pool:
+        first_docIds = [None] * len(byte_ranges)
+        if docids_file is not None:
+            # The first docID of a range is the number of documents before it.
+            nr_lines = pool.starmap(count_nr_lines, ((data_path, start, end) for start, end in byte_ranges))
+            first_docId = 0
+            for ii in range(len(byte_ranges)):
+                first_docIds[ii] = first_docId
+                first_docId += nr_lines[ii]
+
+        ts = perf_counter()
+        external_ids = [None] * len(byte_ranges)
+        tasks = [(data_path, ii, start, end, y) for ii, ((start, end), y) in enumerate(zip(byte_ranges, first_docIds))]
+        for ii, ids in pool.imap_unordered(index_range_task, tasks):
+            external_ids[ii] = ids
+        workers = pool.map(flush_index_worker, range(nr_processors), chunksize=1)
+        wall_seconds = perf_counter() - ts
+
+    indices = []
+    for pid, worker_indices, stats in sorted(workers):
+        indices += worker_indices
+        print(format_worker_stats(pid, stats, wall_seconds))
+    if docids_file is not None:
+        save_docids([docId for ids in external_ids for docId in ids], docids_file)
+    print('Indices construction finished.')
     return indices
 
-def count_nr_lines(file_path:str) -> int:
+def calculate_byte_ranges(data_path:str, n:int) -> List[Tuple[int, int]]:
+    """Splits the file into (at most) n byte ranges [start, end) of about the same size, which start and end on line
+    boundaries: a range is extended up to the end of the line it stops in.
+    """
+    file_size = os.path.getsize(data_path)
+    boundaries = [0]
+    with open(data_path, 'rb') as f:
+        for ii in range(1, n):
+            boundary = max(file_size * ii // n, boundaries[-1])
+            if boundary > 0:
+                # Reading the rest of the line which contains the byte just before the boundary moves it to the
+                # start of the next line (and keeps it if it already is at the start of a line).
+                f.seek(boundary - 1)
+                f.readline()
+                boundary = f.tell()
+            boundaries.append(boundary)
+    boundaries.append(file_size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+def iterate_lines(data_path:str, start:int=0, end:Optional[int]=None) -> Iterator[bytes]:
+    """Yields the lines of the file which start in the byte range [start, end) (start must be at the start of a line).
+    """
+    with open(data_path, 'rb') as f:
+        f.seek(start)
+        position = start
+        while end is None or position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+
+def count_nr_lines(file_path:str, start:int=0, end:Optional[int]=None) -> int:
     nr_lines = 0
-    with open(file_path, 'r') as f:
-        for _ in f:
-            nr_lines += 1
+    for _ in iterate_lines(file_path, start, end):
+        nr_lines += 1
     return nr_lines
 
-def calculate_optimal_partitions(nr_lines:int, n:int) -> Dict[int, int]:
-    div = nr_lines // n
-    mod = nr_lines % n
-    partitions = []
-    for _ in range(n):
-        x = div
-        if mod > 0:
-            mod -= 1
-            x += 1
-        partitions.append(x)
-
-    # Accumulate values:
-    for ii in range(1, n):
-        partitions[ii] += partitions[ii-1]
-    
-    partitions_dict = dict()
-    for ii in range(n):
-        partitions_dict[ii] = partitions[ii]
-    
-    return partitions_dict
-    
-
-def partition_data_into_n(data_path:str, nr_lines:int, n:int) -> List[str]:
-    path, file_name = os.path.split(data_path)
-    file_path = path + '/' + file_name
-
-    if nr_lines is None:
-        nr_lines = count_nr_lines(data_path)
-    
-    partitions_dict = calculate_optimal_partitions(nr_lines, n)
-    partition = 0
-
-    partitions_names = []
-    gs = []
-    for ii in range(n):
-        new_file_path = './' + str(ii) + '_' + file_name
-        partitions_names.append(new_file_path)
-        g = open(new_file_path, 'w')
-        gs.append(g)
-    
-    count = 0
-
-    with open(file_path, 'r') as f:
-        for line in f:
-            if partitions_dict[partition] == count:
-                partition += 1
-            count += 1
-            gs[partition].write(line)
-
-    for ii in range(n):
-        gs[ii].close()
-    
-    print('Partition finished.')
-    return partitions_names
-
-def delete_data_partitions(file_paths:List[str]):
-    for file in file_paths:
-        os.remove(file)
-
 if __name__ == '__main__':
-    tokenizer = RegexpTokenizer(pattern='(?i)[a-zÀ-ÿ]+')
-
     stopwords_file_name = "englishST.txt"
-    preprocessor = Word2VecPreprocessor(tokenizer, stopwords_file_name)
+    # Built in each process of build_indices, this process does not load the spaCy pipeline.
+    preprocessor = PreprocessorConfig('word2vec', stopwords_file_name, token_pattern='(?i)[a-zÀ-ÿ]+')
 
-    #chunks = partition_data_into_n("./standard_politics.large", None, 4)
-    chunks = partition_data_into_n(sys.argv[1], None, 4)
-    indices = build_indices(preprocessor, chunks, 10000)
+    #indices = build_indices(preprocessor, "./standard_politics.large", 10000, docids_file_name('index3.sqlite'))
+    indices = build_indices(preprocessor, sys.argv[1], 10000, docids_file_name('index3.sqlite'))
     merge_indices('index3.sqlite', indices)
-    # delete_data_partitions(chunks)
+    compute_impact_weights('index3.sqlite')
     
\ No newline at end of file
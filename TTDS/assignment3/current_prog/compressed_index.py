@@ -0,0 +1,210 @@
+import os
+import struct
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Tuple
+
+# Shared module: the same file is in assignment1/ and assignment3/current_prog/. Each assignment is run on its own,
+# as scripts from its own folder which import their modules by plain name, so the module is copied into both folders
+# rather than imported from a common package. Make every change to both copies and keep them byte-identical
+# (cmp assignment1/compressed_index.py assignment3/current_prog/compressed_index.py).
+
+# Binary on-disk format for positional inverted indices (replaces pickling the nested dictionary).
+#
+# File layout:
+#   header      : magic (4 bytes) | version (1 byte) | offset of the term dictionary (8 bytes, little endian)
+#   postings    : one block per term, in sorted term order
+#   dictionary  : vbyte(nr_terms), then for each term:
+#                 vbyte(len(term)) | term (utf-8) | vbyte(df) | vbyte(offset of block) | vbyte(length of block)
+#
+# A postings block is: for each docID (in increasing order)
+#   vbyte(docID - previous docID) | vbyte(tf) | vbyte(position - previous position) x tf
+# with "previous" starting at 0 for the first docID of the block / the first position of each document.
+#
+# Variable-byte encoding: 7 bits per byte, least significant group first, the high bit is set on every byte
+# except the last one of a number.
+
+MAGIC = b'VBIX'
+VERSION = 1
+HEADER = struct.Struct('<4sBQ')
+
+class IndexFormatError(Exception):
+    """Raised when a file is not an index in the expected format (or version).
+    """
+    pass
+
+def vbyte_encode_number(number:int, out:bytearray):
+    """Appends the variable-byte encoding of a non-negative number to "out".
+    """
+    while number >= 128:
+        out.append((number & 127) | 128)
+        number >>= 7
+    out.append(number)
+
+def vbyte_decode_number(data:bytes, pos:int) -> Tuple[int, int]:
+    """Decodes the number starting at data[pos].
+
+    Returns:
+        Tuple[int, int]: the decoded number and the position right after it.
+    """
+    number = 0
+    shift = 0
+    byte = data[pos]
+    while byte >= 128:
+        number |= (byte & 127) << shift
+        shift += 7
+        pos += 1
+        byte = data[pos]
+    number |= byte << shift
+    return number, pos + 1
+
+def encode_postings(postings:Dict[int, List[int]]) -> bytes:
+    """Delta + variable-byte encodes the postings of a term ({docID: sorted positions}).
+    """
+    out = bytearray()
+    prev_docID = 0
+    for docID in sorted(postings.keys()):
+        positions = postings[docID]
+        vbyte_encode_number(docID - prev_docID, out)
+        vbyte_encode_number(len(positions), out)
+        prev_position = 0
+        for position in positions:
+            vbyte_encode_number(position - prev_position, out)
+            prev_position = position
+        prev_docID = docID
+    return bytes(out)
+
+def decode_postings(data:bytes) -> Dict[int, List[int]]:
+    """Inverse of encode_postings.
+    """
+    postings = dict()
+    pos = 0
+    end = len(data)
+    docID = 0
+    while pos < end:
+        gap, pos = vbyte_decode_number(data, pos)
+        docID += gap
+        tf, pos = vbyte_decode_number(data, pos)
+        positions = []
+        position = 0
+        for _ in range(tf):
+            gap, pos = vbyte_decode_number(data, pos)
+            position += gap
+            positions.append(position)
+        postings[docID] = positions
+    return postings
+
+def save_compressed_pos_inverted_index(pos_inverted_index:Mapping, file_name:str):
+    """Writes the positional inverted index to file_name in the binary format described above.
+    """
+    dictionary = bytearray()
+    vbyte_encode_number(len(pos_inverted_index), dictionary)
+
+    with open(file_name, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0))
+        offset = HEADER.size
+
+        for term in sorted(pos_inverted_index.keys()):
+            block = encode_postings(pos_inverted_index[term])
+            f.write(block)
+
+            term_bytes = term.encode('utf-8')
+            vbyte_encode_number(len(term_bytes), dictionary)
+            dictionary += term_bytes
+            vbyte_encode_number(len(pos_inverted_index[term]), dictionary)
+            vbyte_encode_number(offset, dictionary)
+            vbyte_encode_number(len(block), dictionary)
+            offset += len(block)
+
+        f.write(dictionary)
+
+        # Now that the postings have been written, fill in where the dictionary starts.
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, offset))
+
+
+class CompressedPosInvertedIndex(Mapping):
+    """Read-only positional inverted index backed by a file written by save_compressed_pos_inverted_index.
+    Only the term dictionary is read when the index is opened; the postings of a term are read and decoded
+    the first time the term is looked up. The most recently used decoded postings are kept in a bounded cache.
+
+    The postings are read with os.pread, which does not use (or move) the offset of the file. The offset is shared by
+    the processes forked while the index is open (e.g. the workers of code.py's batch executor), so reading with
+    seek + read could return another process's bytes. os.pread is only available on Unix.
+    """
+    def __init__(self, file_name:str, cache_size:int=1024):
+        self.file_name = file_name
+        self.file = open(file_name, 'rb')
+        self.fd = self.file.fileno()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+        magic, version, dictionary_offset = HEADER.unpack(os.pread(self.fd, HEADER.size, 0))
+        if magic != MAGIC:
+            raise IndexFormatError('%s is not a compressed positional inverted index.' % file_name)
+        if version != VERSION:
+            raise IndexFormatError('%s is a compressed positional inverted index of version %d, version %d is supported.' % (file_name, version, VERSION))
+
+        data = os.pread(self.fd, os.fstat(self.fd).st_size - dictionary_offset, dictionary_offset)
+
+        # term -> (df, offset, length)
+        self.terms = dict()
+        nr_terms, pos = vbyte_decode_number(data, 0)
+        for _ in range(nr_terms):
+            term_length, pos = vbyte_decode_number(data, pos)
+            term = data[pos:pos+term_length].decode('utf-8')
+            pos += term_length
+            df, pos = vbyte_decode_number(data, pos)
+            offset, pos = vbyte_decode_number(data, pos)
+            length, pos = vbyte_decode_number(data, pos)
+            self.terms[term] = (df, offset, length)
+
+    def document_frequency(self, term:str) -> int:
+        """Number of documents containing the term, without decoding its postings.
+        """
+        if term not in self.terms:
+            return 0
+        return self.terms[term][0]
+
+    def __getitem__(self, term:str) -> Dict[int, List[int]]:
+        if term in self.cache:
+            self.cache.move_to_end(term)
+            return self.cache[term]
+
+        _, offset, length = self.terms[term]
+        postings = decode_postings(os.pread(self.fd, length, offset))
+
+        self.cache[term] = postings
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return postings
+
+    def iterate_postings(self) -> Iterator[Tuple[str, Dict[int, List[int]]]]:
+        """Yields (term, postings) for every term in sorted term order, reading the postings blocks one after the
+        other (sequentially, through a file object of its own) and without going through the cache. Used to merge
+        indices term by term.
+        """
+        with open(self.file_name, 'rb') as f:
+            f.seek(HEADER.size)
+            for term, (_, offset, length) in self.terms.items():
+                if f.tell() != offset:
+                    f.seek(offset)
+                yield term, decode_postings(f.read(length))
+
+    def __contains__(self, term) -> bool:
+        return term in self.terms
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.terms)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
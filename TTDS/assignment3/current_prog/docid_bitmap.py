@@ -0,0 +1,218 @@
+from array import array
+from bisect import bisect_left
+from itertools import chain, compress, repeat
+from typing import Dict, Iterable, Iterator, Union
+
+# Shared module: the same file is in assignment1/ and assignment3/current_prog/. Each assignment is run on its own,
+# as scripts from its own folder which import their modules by plain name, so the module is copied into both folders
+# rather than imported from a common package. Make every change to both copies and keep them byte-identical
+# (cmp assignment1/docid_bitmap.py assignment3/current_prog/docid_bitmap.py).
+
+# Compressed set of docIDs, in the style of Roaring bitmaps.
+#
+# The docIDs are split into chunks of 2^16 by their high 16 bits, and the low 16 bits of the docIDs of each chunk
+# are kept in a container:
+#   - an array container, a sorted array('H'), while the chunk holds at most ARRAY_CONTAINER_MAX docIDs
+#     (2 bytes per docID);
+#   - a bitset container, a 2^16-bit int, once it holds more (a fixed 8 KB, i.e. less than 2 bytes per docID).
+# Union, intersection and difference work container by container. Between two bitsets they are a single int
+# operation (|, &, & ~), which is what makes NOT (all documents minus a set) and OR of frequent terms cheap:
+# the set of all documents is mostly full bitsets, instead of a Python set with a 28-byte int per document.
+#
+# Like frozenset, a DocIDBitmap is not modified by the set operations, so results can be shared (e.g. cached).
+# Only update() modifies the bitmap, by replacing its containers.
+
+ARRAY_CONTAINER_MAX = 4096
+CONTAINER_BITS = 16
+CONTAINER_SIZE = 1 << CONTAINER_BITS
+LOW_MASK = CONTAINER_SIZE - 1
+BITSET_BYTES = CONTAINER_SIZE // 8
+
+# Bitsets are converted to and from a bytes object with one byte (0 or 1) per bit, so that the loops over the bits run
+# in C (int(..., 2), format, translate, itertools.compress) instead of bit by bit in Python.
+DIGITS_TO_FLAGS = bytes.maketrans(b'01', b'\x00\x01')
+FLAGS_TO_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+
+Container = Union[array, int]
+
+def array_to_bitset(lows:Iterable[int]) -> int:
+    if isinstance(lows, array) and len(lows) <= ARRAY_CONTAINER_MAX:
+        # Few bits: cheaper to set them one by one than to go through CONTAINER_SIZE flags.
+        bitset = bytearray(BITSET_BYTES)
+        for low in lows:
+            bitset[low >> 3] |= 1 << (low & 7)
+        return int.from_bytes(bitset, 'little')
+
+    flags = bytearray(CONTAINER_SIZE)
+    # Sets flags[low] = 1 for every low (map calls __setitem__ from C, any consumes the Nones it returns).
+    any(map(flags.__setitem__, lows, repeat(1)))
+    return int(flags[::-1].translate(FLAGS_TO_DIGITS), 2)
+
+def bitset_flags(bitset:int) -> bytes:
+    """Returns CONTAINER_SIZE bytes, byte i being 1 if bit i of the bitset is set and 0 otherwise.
+    """
+    return format(bitset, '0%db' % CONTAINER_SIZE)[::-1].encode('ascii').translate(DIGITS_TO_FLAGS)
+
+def bitset_to_array(bitset:int) -> array:
+    return array('H', compress(range(CONTAINER_SIZE), bitset_flags(bitset)))
+
+def popcount(bitset:int) -> int:
+    # int.bit_count only exists from Python 3.10 (the course environment, ttds.yml, is Python 3.8).
+    return bin(bitset).count('1')
+
+def container_size(container:Container) -> int:
+    return len(container) if isinstance(container, array) else popcount(container)
+
+def normalise_container(container:Container) -> Union[Container, None]:
+    """Returns the container in the representation matching its cardinality, or None if it is empty.
+    """
+    if isinstance(container, array):
+        if len(container) == 0:
+            return None
+        return container if len(container) <= ARRAY_CONTAINER_MAX else array_to_bitset(container)
+    size = popcount(container)
+    if size == 0:
+        return None
+    return container if size > ARRAY_CONTAINER_MAX else bitset_to_array(container)
+
+def bitset_filter(lows:array, bitset:int, keep:bool) -> array:
+    """Returns the lows which are (keep=True) or are not (keep=False) in the bitset.
+    """
+    bits = bitset.to_bytes(BITSET_BYTES, 'little')
+    return array('H', [low for low in lows if bool(bits[low >> 3] >> (low & 7) & 1) == keep])
+
+def union_containers(a:Container, b:Container) -> Container:
+    if isinstance(a, array) and isinstance(b, array):
+        if len(a) + len(b) <= ARRAY_CONTAINER_MAX:
+            return array('H', sorted(set(a).union(b)))
+        return normalise_container(array_to_bitset(chain(a, b)))
+    if isinstance(a, array):
+        a = array_to_bitset(a)
+    if isinstance(b, array):
+        b = array_to_bitset(b)
+    return a | b
+
+def intersect_containers(a:Container, b:Container) -> Union[Container, None]:
+    if isinstance(a, array) and isinstance(b, array):
+        if len(a) > len(b):
+            a, b = b, a
+        return normalise_container(array('H', sorted(set(a).intersection(b))))
+    if isinstance(a, array):
+        return normalise_container(bitset_filter(a, b, True))
+    if isinstance(b, array):
+        return normalise_container(bitset_filter(b, a, True))
+    return normalise_container(a & b)
+
+def subtract_containers(a:Container, b:Container) -> Union[Container, None]:
+    if isinstance(a, array):
+        if isinstance(b, array):
+            return normalise_container(array('H', sorted(set(a).difference(b))))
+        return normalise_container(bitset_filter(a, b, False))
+    if isinstance(b, array):
+        b = array_to_bitset(b)
+    return normalise_container(a & ~b)
+
+class DocIDBitmap():
+    """Compressed, immutable set of non-negative docIDs. Supports len, iteration (in increasing docID order), "in",
+    and union, intersection and difference with other bitmaps or with any iterable of docIDs (also as |, &, -).
+    """
+    __slots__ = ('containers',)
+
+    def __init__(self, containers:Dict[int, Container]=None):
+        """
+        Args:
+            containers (Dict[int, Container]): high 16 bits -> non-empty container of the low 16 bits.
+        """
+        self.containers = dict() if containers is None else containers
+
+    @staticmethod
+    def from_iterable(docIDs:Iterable[int]) -> 'DocIDBitmap':
+        if isinstance(docIDs, DocIDBitmap):
+            return docIDs
+        chunks = dict()
+        for docID in docIDs:
+            high = docID >> CONTAINER_BITS
+            if high in chunks:
+                chunks[high].append(docID & LOW_MASK)
+            else:
+                chunks[high] = [docID & LOW_MASK]
+
+        containers = dict()
+        for high, lows in chunks.items():
+            lows.sort()
+            if len(lows) <= ARRAY_CONTAINER_MAX:
+                # Drop duplicates (sets and postings lists have none, so this is usually a no-op).
+                containers[high] = array('H', lows if len(set(lows)) == len(lows) else sorted(set(lows)))
+            else:
+                containers[high] = normalise_container(array_to_bitset(lows))
+        return DocIDBitmap(containers)
+
+    def union(self, other:Iterable[int]) -> 'DocIDBitmap':
+        other = DocIDBitmap.from_iterable(other)
+        containers = dict(self.containers)
+        for high, container in other.containers.items():
+            containers[high] = union_containers(containers[high], container) if high in containers else container
+        return DocIDBitmap(containers)
+
+    def intersection(self, other:Iterable[int]) -> 'DocIDBitmap':
+        other = DocIDBitmap.from_iterable(other)
+        containers = dict()
+        for high, container in self.containers.items():
+            if high in other.containers:
+                result = intersect_containers(container, other.containers[high])
+                if result is not None:
+                    containers[high] = result
+        return DocIDBitmap(containers)
+
+    def difference(self, other:Iterable[int]) -> 'DocIDBitmap':
+        other = DocIDBitmap.from_iterable(other)
+        containers = dict()
+        for high, container in self.containers.items():
+            if high in other.containers:
+                container = subtract_containers(container, other.containers[high])
+                if container is None:
+                    continue
+            containers[high] = container
+        return DocIDBitmap(containers)
+
+    def update(self, other:Iterable[int]):
+        """Adds the docIDs of other to this bitmap. The containers are replaced, not modified, so bitmaps sharing
+        containers with this one are not affected.
+        """
+        self.containers = self.union(other).containers
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def __contains__(self, docID:int) -> bool:
+        container = self.containers.get(docID >> CONTAINER_BITS)
+        if container is None:
+            return False
+        low = docID & LOW_MASK
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        index = bisect_left(container, low)
+        return index < len(container) and container[index] == low
+
+    def __iter__(self) -> Iterator[int]:
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            base = high << CONTAINER_BITS
+            if isinstance(container, array):
+                yield from [base + low for low in container]
+            else:
+                yield from compress(range(base, base + CONTAINER_SIZE), bitset_flags(container))
+
+    def __len__(self) -> int:
+        return sum(container_size(container) for container in self.containers.values())
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, DocIDBitmap):
+            return self.containers == other.containers
+        return set(self) == other
+
+    def nbytes(self) -> int:
+        """Size in bytes of the containers (2 bytes per docID of an array container, 8 KB per bitset container).
+        """
+        return sum(2 * len(container) if isinstance(container, array) else BITSET_BYTES for container in self.containers.values())
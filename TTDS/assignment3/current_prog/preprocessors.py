@@ -1,10 +1,9 @@
 
 from nltk.stem.porter import PorterStemmer
 from nltk.stem.snowball import SnowballStemmer
-from tokenizers import Tokenizer
+from tokenizers import Tokenizer, RegexpTokenizer
 from typing import List, Set
 import unicodedata
-import spacy
 from nltk.tokenize import sent_tokenize
 
 class Preprocessor():
@@ -54,6 +53,8 @@ class Word2VecPreprocessor(Preprocessor):
     # Remove stop words.
     def __init__(self, tokenizer:Tokenizer, stopwords_file:str):
         super().__init__()
+        # Imported here: loading spaCy takes most of the start-up time of the processes which import this module.
+        import spacy
         self.nlp = spacy.load('en_core_web_sm', disable=["parser", "ner", "textcat", "tagger"])
         self.tokenizer = tokenizer
 
@@ -90,3 +91,30 @@ class Word2VecPreprocessor(Preprocessor):
         for sent in tokenized_sents:
             ret += sent
         return ret
+
+
+class PreprocessorConfig():
+    """Description of a preprocessor, from which it can be built (build). Cheap to pickle, unlike the preprocessors
+    themselves (the stemmer, the spaCy pipeline of Word2VecPreprocessor), so it is what is sent to other processes:
+    build_index.build_indices builds the preprocessor once in each of its processes.
+    """
+    def __init__(self, kind:str, stopwords_file:str, token_pattern:str='(?i)[0-9a-zÀ-ÿ]+', stemmer_language:str='english'):
+        """
+        Args:
+            kind (str): 'simple' (SimplePreprocessor) or 'word2vec' (Word2VecPreprocessor).
+            stopwords_file (str): stop words file, one word per line.
+            token_pattern (str): pattern of the RegexpTokenizer.
+            stemmer_language (str): language of the SnowballStemmer of a SimplePreprocessor.
+        """
+        if kind not in ['simple', 'word2vec']:
+            raise Exception('Unknown preprocessor kind: %s' % kind)
+        self.kind = kind
+        self.stopwords_file = stopwords_file
+        self.token_pattern = token_pattern
+        self.stemmer_language = stemmer_language
+
+    def build(self) -> Preprocessor:
+        tokenizer = RegexpTokenizer(self.token_pattern)
+        if self.kind == 'simple':
+            return SimplePreprocessor(tokenizer, self.stopwords_file, SnowballStemmer(self.stemmer_language))
+        return Word2VecPreprocessor(tokenizer, self.stopwords_file)
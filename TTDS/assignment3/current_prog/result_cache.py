@@ -0,0 +1,103 @@
+import sys
+from collections import OrderedDict
+from typing import AbstractSet, Dict, Hashable, Union
+from docid_bitmap import DocIDBitmap
+
+# Shared module: the same file is in assignment1/ and assignment3/current_prog/. Each assignment is run on its own,
+# as scripts from its own folder which import their modules by plain name, so the module is copied into both folders
+# rather than imported from a common package. Make every change to both copies and keep them byte-identical
+# (cmp assignment1/result_cache.py assignment3/current_prog/result_cache.py).
+
+# Bounded LRU cache for the results of query sub-expressions.
+#
+# Keys are normalised (pre-processed) sub-expressions, e.g. ('term', 'scotland'), ('phrase', ('middl', 'east'))
+# or ('proximity', 10, 'incom', 'tax'); values are the docIDs matching them, stored as frozensets (or as the
+# DocIDBitmaps they were computed as, which are immutable too) so a cached result cannot be modified by its users. Entries are evicted, least recently used first, once the estimated
+# size of the cached results exceeds the memory budget.
+#
+# Cached results are only valid for the index they were computed from: use one cache per index and clear it
+# whenever the index changes.
+
+# Estimated size of an int object held only by a cached result (ints are 28 bytes on 64-bit CPython).
+INT_SIZE = 28
+
+def estimate_result_size(key:Hashable, result:AbstractSet[int]) -> int:
+    """Rough number of bytes retained by a cache entry: the key, the set and the ints it references.
+    """
+    if isinstance(result, DocIDBitmap):
+        return sys.getsizeof(key) + sys.getsizeof(result.containers) + result.nbytes()
+    return sys.getsizeof(key) + sys.getsizeof(result) + INT_SIZE * len(result)
+
+class QueryResultCache():
+    def __init__(self, max_bytes:int=64*1024*1024):
+        """
+        Args:
+            max_bytes (int): memory budget of the cached results (estimated by estimate_result_size).
+            0 disables the cache.
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sizes = dict()
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key:Hashable) -> Union[frozenset, DocIDBitmap, None]:
+        """Returns the cached result of key (marking it as recently used), or None.
+        """
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return result
+
+    def put(self, key:Hashable, result:AbstractSet[int]) -> Union[frozenset, DocIDBitmap]:
+        """Caches the result of key, evicting the least recently used entries to stay within the memory budget.
+        Results larger than the whole budget are not cached.
+
+        Returns:
+            Union[frozenset, DocIDBitmap]: the result, as it is stored in the cache.
+        """
+        if not isinstance(result, DocIDBitmap):
+            result = frozenset(result)
+        size = estimate_result_size(key, result)
+        if size > self.max_bytes:
+            return result
+
+        if key in self.entries:
+            self.nbytes -= self.sizes[key]
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        self.sizes[key] = size
+        self.nbytes += size
+
+        while self.nbytes > self.max_bytes:
+            evicted_key, _ = self.entries.popitem(last=False)
+            self.nbytes -= self.sizes.pop(evicted_key)
+            self.evictions += 1
+        return result
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hit_rate(),
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes}
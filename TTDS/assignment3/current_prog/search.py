@@ -1,10 +1,14 @@
+import os
 import re
+import json
 import math
 from typing import List, Tuple
 from tokenizers import RegexpTokenizer
 from itertools import product
 from sqlitedict import SqliteDict
 from preprocessors import Preprocessor, SimplePreprocessor
+from result_cache import QueryResultCache
+from docid_bitmap import DocIDBitmap
 from nltk.stem.snowball import SnowballStemmer
 
 # Usage:
@@ -21,10 +25,45 @@ class Search():
                  index_file:str = './index.sqlite', 
                  preprocessor:Preprocessor = SimplePreprocessor(RegexpTokenizer('(?i)[0-9a-zÀ-ÿ]+'), 
                                                                 'englishST.txt', 
-                                                                SnowballStemmer('english'))):
+                                                                SnowballStemmer('english')),
+                 result_cache_bytes:int = 64*1024*1024,
+                 bitmap_sets:bool = False):
         self.index = SqliteDict(index_file)
-        self.all_ids = self.get_all_document_ids()
         self.preprocessor = preprocessor
+
+        # Index built with dense docIDs (build_index.build_indices with docids_file): external_ids[docId] is the ID
+        # returned to the caller, and the set of all documents does not need a scan of the whole index.
+        self.external_ids = None
+        docids_file = os.path.splitext(index_file)[0] + '_docids.json'
+        if os.path.exists(docids_file):
+            with open(docids_file, 'r') as f:
+                self.external_ids = json.load(f)
+            self.all_ids = set(range(len(self.external_ids)))
+        else:
+            self.all_ids = self.get_all_document_ids()
+
+        # With bitmap_sets, the sets of documents of boolean queries are DocIDBitmaps (compressed, cheap NOT and OR of
+        # frequent terms) and are only converted to sets when simple_query returns.
+        self.bitmap_sets = bitmap_sets
+        if bitmap_sets:
+            self.all_ids = DocIDBitmap.from_iterable(self.all_ids)
+
+        # Results of the terms, phrases and proximity searches of simple_query, keyed on their pre-processed terms.
+        self.result_cache = QueryResultCache(result_cache_bytes)
+
+        # Precomputed tf-idf weights (see build_index.compute_impact_weights), if they were computed for this index.
+        # The weights are ignored if they were computed for another index (e.g. before the index was rebuilt).
+        self.impacts = None
+        self.impacts_scale = None
+        impacts_file = os.path.splitext(index_file)[0] + '_impacts.sqlite'
+        if os.path.exists(impacts_file):
+            with SqliteDict(impacts_file, tablename='meta', flag='r') as meta:
+                impacts_meta = dict(meta.items())
+            if impacts_meta.get('N') == len(self.all_ids) and impacts_meta.get('nr_terms') == len(self.index):
+                self.impacts = SqliteDict(impacts_file, tablename='impacts', flag='r')
+                self.impacts_scale = impacts_meta['scale']
+            else:
+                print('Ignoring %s: it was not computed for this index, ranked queries compute the weights at query time.' % impacts_file)
         
     def get_all_document_ids(self) -> set:
         ids = set()
@@ -33,6 +72,11 @@ class Search():
                 raise Exception('Index contains a key (%s) with no associated document IDs. Aborting.' % key)
             ids.update(self.index[key])
         return ids
+
+    def new_id_set(self, ids=()):
+        """Returns the ids as a DocIDBitmap with bitmap_sets, as a set otherwise.
+        """
+        return DocIDBitmap.from_iterable(ids) if self.bitmap_sets else set(ids)
     
     def parse_boolop(self, query:str) -> set:
         sep = re.split(r' (AND|OR)( NOT)? ', query) 
@@ -40,19 +84,19 @@ class Search():
         boolop = sep[1]
         neg = sep[2]
         rhs = sep[3]
-        lhs = self.simple_query(lhs)
-        rhs = self.simple_query(rhs)
+        lhs = self.evaluate_query(lhs)
+        rhs = self.evaluate_query(rhs)
         if neg == ' NOT':
             rhs = self.all_ids - rhs
         if boolop == 'AND':
             return lhs & rhs 
         elif boolop == 'OR':
             return lhs | rhs
-        return set()
+        return self.new_id_set()
     
     def parse_neg(self, query:str) -> set:
         sep = query.split('NOT')
-        rhs = self.simple_query(sep[1])
+        rhs = self.evaluate_query(sep[1])
         return self.all_ids - rhs
     
     def parse_prox(self, query:str) -> set:
@@ -63,15 +107,22 @@ class Search():
         return self.common_prox_phr(n, term1, term2, False)
     
     def common_prox_phr(self, n:int, term1:str, term2:str, phr:bool) -> set:
-        common_docs = self.simple_query(term1) & self.simple_query(term2)
-        term1 = self.preprocessor.process_text_lines([term1])[0]
-        term2 = self.preprocessor.process_text_lines([term2])[0]
+        stem1 = self.preprocessor.process_text_lines([term1])[0]
+        stem2 = self.preprocessor.process_text_lines([term2])[0]
+        key = ('phrase', (stem1, stem2)) if phr else ('proximity', n, stem1, stem2)
+        cached_docs = self.result_cache.get(key)
+        if cached_docs is not None:
+            return cached_docs if self.bitmap_sets else set(cached_docs)
+        common_docs = self.evaluate_query(term1) & self.evaluate_query(term2)
+        term1, term2 = stem1, stem2
         matching_docs = set()
         for doc in common_docs:
             comparison_pairs = list(product(self.index[term1][doc], self.index[term2][doc]))
             comparison_function = lambda n, a, b: (b-a)==1 if phr else abs(b-a)<=n
             if any(comparison_function(n, a, b) for (a,b) in comparison_pairs):
                 matching_docs.add(doc)
+        matching_docs = self.new_id_set(matching_docs)
+        self.result_cache.put(key, matching_docs)
         return matching_docs
     
     def parse_phr(self, query:str) -> set:
@@ -81,8 +132,18 @@ class Search():
         return self.common_prox_phr(None, term1, term2, True)
     
     def simple_query(self, query:str) -> set:
+        docs = self.evaluate_query(query)
+        if self.bitmap_sets:
+            docs = set(docs)
+        if self.external_ids is not None:
+            return {self.external_ids[doc] for doc in docs}
+        return docs
+
+    def evaluate_query(self, query:str) -> set:
+        """Returns the (internal) docIDs matching the query.
+        """
         if not query:
-            return set()
+            return self.new_id_set()
         if ' AND ' in query or ' OR ' in query:
             return self.parse_boolop(query)
         elif query.startswith('NOT '):
@@ -94,11 +155,34 @@ class Search():
         else:
             terms = self.preprocessor.process_text_lines([query])
             if len(terms) > 0:
-                return set(self.index[terms[0]].keys())
-            return set()
+                key = ('term', terms[0])
+                docs = self.result_cache.get(key)
+                if docs is None:
+                    docs = self.result_cache.put(key, self.new_id_set(self.index[terms[0]].keys()))
+                return docs if self.bitmap_sets else set(docs)
+            return self.new_id_set()
         
+    def to_external_id(self, doc:int) -> int:
+        return doc if self.external_ids is None else self.external_ids[doc]
+
+    def ranked_query_precomputed(self, query:List[str]) -> List[Tuple[int, float]]:
+        # Sums the precomputed weights of the query terms, no logs at query time.
+        scores = dict()
+        for term in query:
+            if term not in self.impacts:
+                continue
+            for doc, w_t_d in self.impacts[term].items():
+                scores[doc] = scores.get(doc, 0) + w_t_d
+        if self.impacts_scale is not None:
+            return [(doc, score * self.impacts_scale) for (doc, score) in scores.items()]
+        return list(scores.items())
+
     def ranked_query(self, query:str, n_results:int) -> List[Tuple[int, float]]:
         query = self.preprocessor.process_text_lines([query])
+        if self.impacts is not None:
+            scores = self.ranked_query_precomputed(query)
+            scores = [(self.to_external_id(doc), round(score,4)) for (doc, score) in scores]
+            return sorted(sorted(scores, key=lambda i: int(i[0])), key=lambda i: i[1], reverse=True)[:n_results]
         relevant = set()
         scores = []
         for term in query:
@@ -115,5 +199,5 @@ class Search():
                     w_t_d = lhs * rhs
                     score += w_t_d
             scores.append((doc, score))
-        scores = [(doc, round(score,4)) for (doc, score) in scores]
+        scores = [(self.to_external_id(doc), round(score,4)) for (doc, score) in scores]
         return sorted(sorted(scores, key=lambda i: int(i[0])), key=lambda i: i[1], reverse=True)[:n_results]
\ No newline at end of file
@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import pickle
+from typing import Any, Dict, Optional
+
+# Bulk writer for the sqlite stores of build_index.py (the merged index, the impact weights) and of
+# transform_json_to_sqlite.py.
+#
+# The stores keep the table layout and value encoding of SqliteDict, so Search and compute_impact_weights read them
+# through SqliteDict as before:
+#   CREATE TABLE "<tablename>" (key TEXT PRIMARY KEY, value BLOB)
+# where value is the pickled object (same pickle protocol as SqliteDict).
+#
+# Writing through SqliteDict sends every row through its worker thread, and the builds committed often to bound the
+# size of the transaction, each commit waiting for an fsync. Instead, the writer:
+#   - buffers rows and inserts them with executemany, batch_size rows at a time;
+#   - uses WAL journal mode and synchronous=OFF while the store is built (a crash in the middle of a build leaves a
+#     store which has to be rebuilt anyway);
+#   - on close, runs ANALYZE, checkpoints the WAL into the database file and switches back to the rollback journal,
+#     so the store is a single file again, readable by SqliteDict's default connection settings.
+
+class SqliteIndexWriter():
+    def __init__(self, file_name:str, tablename:str='unnamed', flag:str='c', batch_size:int=10000):
+        """
+        Args:
+            file_name (str): sqlite file, created if it does not exist.
+            tablename (str): table to write to (several tables can be written to the same file, one after the other).
+            flag (str): 'c' to add to the table if it exists, 'n' to start from a new, empty file (as in SqliteDict).
+            batch_size (int): number of buffered rows inserted with one executemany.
+        """
+        if flag not in ['c', 'n']:
+            raise Exception('Unrecognized flag: %s' % flag)
+        if flag == 'n' and os.path.exists(file_name):
+            os.remove(file_name)
+
+        self.file_name = file_name
+        self.tablename = tablename.replace('"', '""')
+        self.batch_size = batch_size
+        # key -> pickled value, not yet inserted.
+        self.batch = dict()
+
+        self.conn = sqlite3.connect(file_name)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS "%s" (key TEXT PRIMARY KEY, value BLOB)' % self.tablename)
+        self.conn.commit()
+
+    def __setitem__(self, key, value):
+        self.batch[key] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def get(self, key, default:Optional[Any]=None) -> Any:
+        if key in self.batch:
+            return pickle.loads(self.batch[key])
+        row = self.conn.execute('SELECT value FROM "%s" WHERE key = ?' % self.tablename, (key,)).fetchone()
+        if row is None:
+            return default
+        return pickle.loads(row[0])
+
+    def __getitem__(self, key) -> Any:
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __len__(self) -> int:
+        self.flush()
+        return self.conn.execute('SELECT COUNT(*) FROM "%s"' % self.tablename).fetchone()[0]
+
+    def update(self, items:Dict):
+        for key, value in items.items():
+            self[key] = value
+
+    def flush(self):
+        """Inserts the buffered rows (in the current transaction).
+        """
+        if len(self.batch) > 0:
+            self.conn.executemany('REPLACE INTO "%s" (key, value) VALUES (?, ?)' % self.tablename, self.batch.items())
+            self.batch = dict()
+
+    def commit(self):
+        self.flush()
+        self.conn.commit()
+
+    def close(self):
+        self.commit()
+        self.conn.execute('ANALYZE')
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.conn.execute('PRAGMA journal_mode=DELETE')
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,7 +1,7 @@
 import json
 import argparse
 import os
-from sqlitedict import SqliteDict
+from sqlite_index import SqliteIndexWriter
 
 parser = argparse.ArgumentParser()
 parser.add_argument('json_file_path', type=str)
@@ -14,31 +14,23 @@ def transform_json_to_sqlite(json_file_path:str, sqlite_file_name:str):
 
     If the source file name and the new file name are the same, the source file will be deleted.
     It's not efficient storage-wise (needs 2xsource file space).
+    The documents are written in batches (see sqlite_index.py), the store is read with SqliteDict.
     """
 
     folder_path, _ = os.path.split(json_file_path)
     sqlite_file_path = sqlite_file_name if folder_path == '' else folder_path + '/' + sqlite_file_name
 
     f = open(json_file_path, 'r')
-    slitedict = SqliteDict(sqlite_file_path, autocommit=False)
-
-    cache_max_size = 1000
-    counter = 0
+    writer = SqliteIndexWriter(sqlite_file_path)
 
     for line in f:
         data = json.loads(line)
         doc_id = data['id']
         del data['id']
-        slitedict[doc_id] = data
-
-        counter += 1
-        if counter % cache_max_size == 0:
-            slitedict.commit()
-    
-    slitedict.commit()
+        writer[doc_id] = data
     
     f.close()
-    slitedict.close()
+    writer.close()
 
 if __name__ == '__main__':
     args = parser.parse_args()
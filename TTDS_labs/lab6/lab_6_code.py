@@ -47,23 +47,56 @@ def construct_stopwords_set(stopwords_file_name:str) -> Set[str]:
 
 class SimplePreprocessor():
     """Class for pre-processing text. Given a list of strings, it tokenizes them, removes stop words, lowercases and stems them.
+    The stems of the words are memoised (the vocabulary is tiny compared to the number of tokens), in a dictionary of
+    at most stem_cache_size words; 0 disables the cache. When it is full, the first-inserted words are evicted (FIFO,
+    a hit does not refresh a word): an evicted frequent word is stemmed again and re-inserted on its next occurrence,
+    which keeps the lookups of the tokenizing loops a plain dictionary get.
     """
-    def __init__(self, tokenizer:SimpleTokenizer, stop_words_set:Set[str], stemmer:PorterStemmer):
+    def __init__(self, tokenizer:SimpleTokenizer, stop_words_set:Set[str], stemmer:PorterStemmer, stem_cache_size:int=100000):
         self.tokenizer = tokenizer
         self.stop_words_set = stop_words_set
         self.stemmer = stemmer
+
+        self.stem_cache_size = stem_cache_size
+        self.stem_cache = dict()
+        self.stem_lookups = 0
+        self.stem_cache_misses = 0
     
     @staticmethod
     def lowercase_word(word:str) -> str:
         return str.lower(word)
+
+    def stem(self, word:str) -> str:
+        """Stems a word which is not in the stem cache and adds it to the cache, evicting the first-inserted word if it is full.
+        """
+        self.stem_cache_misses += 1
+        stemmed_word = self.stemmer.stem(word)
+        if self.stem_cache_size > 0:
+            if len(self.stem_cache) >= self.stem_cache_size:
+                # Dictionaries keep insertion order, so the first key is the first-inserted one.
+                del self.stem_cache[next(iter(self.stem_cache))]
+            self.stem_cache[word] = stemmed_word
+        return stemmed_word
+
+    def stem_cache_stats(self) -> Dict[str, float]:
+        hits = self.stem_lookups - self.stem_cache_misses
+        return {'lookups': self.stem_lookups,
+                'hits': hits,
+                'misses': self.stem_cache_misses,
+                'hit_rate': hits / self.stem_lookups if self.stem_lookups > 0 else 0.0,
+                'size': len(self.stem_cache)}
     
     def remove_stop_words_lowercase_and_stem(self, tokens:List[str]) -> List[str]:
         final_tokens = []
+        stem_cache = self.stem_cache
         for token in tokens:
             lowercase_token = SimplePreprocessor.lowercase_word(token)
             if lowercase_token not in self.stop_words_set:
-                stemmed_token = self.stemmer.stem(lowercase_token)
+                stemmed_token = stem_cache.get(lowercase_token)
+                if stemmed_token is None:
+                    stemmed_token = self.stem(lowercase_token)
                 final_tokens.append(stemmed_token)
+        self.stem_lookups += len(final_tokens)
         return final_tokens
     
     def process_text_lines(self, text_lines:List[str]) -> List[str]: